@@ -4,17 +4,39 @@ This file stores all the behaviours and algorithms of the bot
 import cv2
 import math
 import random
+import time
+import numpy as np
+from collections import deque
 from environment import *
-from render import *
 
 """This is the behaviour of the AI. It is essentially a state machine"""
 class Behavior:
-    def __init__(self):
+    """
+    navigation is the name of the engine used to avoid obstacles
+    It is one of the keys in NAVIGATION_ENGINES
+    config is the BehaviorConfig used. If not given the defaults are used
+    """
+    def __init__(self, navigation=None, config=None):
+        if navigation is None:
+            navigation = NAVIGATION_ENGINE
+        if config is None:
+            config = BehaviorConfig()
+        self.navigation = navigation
+        self.config = config
+        #Kept here so the target survives state changes
+        self.target_manager = TargetManager()
         self.curr_state = ExploreState(self)
 
-    """Called each frame for the AI to decide suitable action"""
-    def action(self, environment, controller, frame):
-        self.curr_state.action(environment, controller, frame)
+    """Makes a new navigation engine for a state to use"""
+    def make_navigator(self):
+        return NAVIGATION_ENGINES[self.navigation](config=self.config)
+
+    """
+    Called each frame for the AI to decide suitable action
+    If an overlay is passed, the AI records what it is doing on it
+    """
+    def action(self, environment, controller, overlay=None):
+        self.curr_state.action(environment, controller, overlay)
 
 
 """This is a state the bot uses"""
@@ -23,7 +45,7 @@ class State:
         self.state_machine = state_machine
 
     """This is to be overridden"""
-    def action(self, environment, controller, frame=None):
+    def action(self, environment, controller, overlay=None):
         pass
 
 DIR_CHANGE_CHANCE = 0.01
@@ -32,12 +54,12 @@ DIR_CHANGE_CHANCE = 0.01
 class ExploreState(State):
     def __init__(self, state_machine):
         super().__init__(state_machine)
-        self.avoid = CollisionAvoidance()
+        self.avoid = state_machine.make_navigator()
         #Initialise random explore direction
         self.dir = Vector2(1,0).rotate(random.uniform(0, 2 * math.pi))
 
     """Overrides"""
-    def action(self, environment, controller, frame=None):
+    def action(self, environment, controller, overlay=None):
         #Check if there are neighbour objects
         if len(environment.objects) > 0:
             self.state_machine.curr_state = TargetState(self.state_machine)
@@ -45,16 +67,16 @@ class ExploreState(State):
 
         #Get move direction
         move_dir = self.get_direction()
-        #Pass it through collision avoidance
-        if not environment.player is None:
-            move_dir = self.avoid.get_direction(move_dir, environment, frame)
-        #Move the AI
-        controller.move(move_dir)
+        #Move the AI and pass it through collision avoidance
+        if environment.player is None:
+            controller.move(move_dir)
+        else:
+            self.avoid.steer(move_dir, environment, controller, overlay)
 
     """Get the next direction to walk"""
     def get_direction(self):
         #Get new direction
-        if random.uniform(0,99) < DIR_CHANGE_CHANCE * 100:
+        if random.uniform(0,99) < self.state_machine.config.dir_change_chance * 100:
             #Generate a random angle
             angle = random.uniform(0, 2 * math.pi)
             self.dir.angle = angle
@@ -66,42 +88,19 @@ class ExploreState(State):
 class TargetState(State):
     def __init__(self, state_machine, tracking_buffer=(20,20)):
         super().__init__(state_machine)
-        self.avoid = CollisionAvoidance()
-        self.sort_alg = ImportanceSort()
+        self.avoid = state_machine.make_navigator()
+        self.target_manager = state_machine.target_manager
 
     """Given an environment return the target object"""
     def find_target(self, environment):
-        objects = environment.objects
-
-        #Calculate importance for all the objects
-        object_importances = []
-        player_pos = environment.player.centre
-        for o in environment.objects:
-            object_importances.append((o, self.get_importance(o, player_pos)))
-
-        #Sort the neighbours based on importance
-        objects = self.sort_alg.sort(object_importances)
-
-        if len(objects) == 0:
-            return None
-        #Get the most important object as the target
-        return objects[0][0]
+        return self.target_manager.update(environment)
 
     """Get the importance of a game object"""
     def get_importance(self, game_object, player_pos):
-        importance = 0
-        if game_object.type == GameObject.SQUARE:
-            importance += 10
-        elif game_object.type == GameObject.TRIANGLE:
-            importance += 100
-        elif game_object.type == GameObject.PENTAGON:
-            importance += 200
-        dist = player_pos.distance_to(game_object.centre)
-        importance += (max(200 - dist, 0) / 10)
-        return importance
+        return self.target_manager.selector.get_importance(game_object, player_pos)
 
     """Overrides"""
-    def action(self, environment, controller, frame=None):
+    def action(self, environment, controller, overlay=None):
         #Get optimal target based on heuristics
         target = self.find_target(environment)
 
@@ -110,20 +109,290 @@ class TargetState(State):
             self.state_machine.curr_state = ExploreState(self.state_machine)
             return
         
-        #Render of frame if passed in
-        if not frame is None:
-            BotRender.draw_rect(target.bbox, frame, color=(0,0,255))
-            BotRender.draw_text(frame, "Target", target.centre.to_tuple(), color=(0,0,255))
+        #Render of overlay if passed in
+        if not overlay is None:
+            overlay.draw_rect(target.bbox, color=(0,0,255))
+            overlay.draw_text("Target", target.centre.to_tuple(), color=(0,0,255))
 
         #Get move direction
         move_dir = target.centre - environment.player.centre
-        #Pass it through collision avoidance
-        move_dir = self.avoid.get_direction(move_dir, environment, frame)
-        #Move the AI
-        controller.move(move_dir)
-        #Shoot
-        controller.shoot(target.centre)
+        #Move the AI and pass it through collision avoidance
+        self.avoid.steer(move_dir, environment, controller, overlay)
+        #Only shoot if nothing is in the way
+        #Otherwise keep moving until there is a clear shot
+        if self.target_manager.blocked:
+            if not overlay is None:
+                overlay.draw_line(environment.player.centre, target.centre
+                    , (128,128,128))
+        else:
+            controller.shoot(target.centre)
+
+
+#This is how important each type of object is as a target
+#Any type not in the table has an importance of 0
+IMPORTANCE_TABLE = {
+    GameObject.SQUARE : 10,
+    GameObject.TRIANGLE : 100,
+    GameObject.PENTAGON : 200
+}
+#Objects closer than this distance get extra importance
+IMPORTANCE_RANGE = 200
+#The higher the factor the more the distance matters
+IMPORTANCE_DISTANCE_FACTOR = 0.1
+
+"""
+Scores game objects on how good a target they are
+and selects the best ones
+"""
+class TargetSelector:
+    """
+    The importance table maps each game object type to its importance
+    If not given, IMPORTANCE_TABLE is used
+    """
+    def __init__(self, importance_table=None):
+        if importance_table is None:
+            importance_table = IMPORTANCE_TABLE
+        self.importance_table = dict(importance_table)
+
+    """Get the importance of a single game object"""
+    def get_importance(self, game_object, player_pos):
+        importance = self.importance_table.get(game_object.type, 0)
+        dist = player_pos.distance_to(game_object.centre)
+        importance += max(IMPORTANCE_RANGE - dist, 0) * IMPORTANCE_DISTANCE_FACTOR
+        return importance
+
+    """
+    Given a list of game objects return the importance
+    of all of them as a numpy array
+    """
+    def get_importances(self, objects, player_pos):
+        importances = np.fromiter(
+            (self.importance_table.get(o.type, 0) for o in objects)
+            , dtype=np.float64, count=len(objects))
+        centres = BBoxOps.bbox_centres(BBoxOps.to_array(o.bbox for o in objects))
+        dists = np.hypot(centres[:, 0] - player_pos.x, centres[:, 1] - player_pos.y)
+        importances += (np.maximum(IMPORTANCE_RANGE - dists, 0)
+            * IMPORTANCE_DISTANCE_FACTOR)
+        return importances
 
+    """
+    Returns the k most important objects in the environment
+    as a list of (object, importance) from most to least important
+    Objects with the same importance keep their environment order
+    """
+    def top_k(self, environment, k=1):
+        objects = environment.objects
+        if len(objects) == 0 or k <= 0 or environment.player is None:
+            return []
+        importances = self.get_importances(objects, environment.player.centre)
+
+        #Only the k best need to be ordered
+        if k < len(objects):
+            best = np.argpartition(-importances, k - 1)[:k]
+            #Make sure ties at the cut off are won by the earlier objects
+            cut_off = importances[best].min()
+            best = np.union1d(best, np.flatnonzero(importances == cut_off))
+        else:
+            best = np.arange(len(objects))
+        order = best[np.lexsort((best, -importances[best]))][:k]
+        return [(objects[i], float(importances[i])) for i in order]
+
+
+#A new target must be this much more important than the current target
+#before the bot switches to it
+TARGET_SWITCH_MARGIN = 20
+#Objects are only rescored if their position relative to the player
+#has moved more than this many pixels
+RESCORE_DISTANCE = 5
+#How many of the most recent switch events are kept
+SWITCH_EVENT_HISTORY = 100
+#Whether targets with another object in the way are skipped
+LINE_OF_SIGHT = True
+#How many of the most important objects are checked for a clear shot
+LINE_OF_SIGHT_CANDIDATES = 4
+
+"""
+Keeps track of the current target across frames
+Importances are cached and only objects that have changed are rescored
+The target is only switched when another object is more important
+by the switch margin
+If line_of_sight is True, targets with another object between them and
+the player are skipped for the most important object with a clear shot.
+If none of the candidates have a clear shot the target is kept but blocked
+"""
+class TargetManager:
+    def __init__(self, selector=None, switch_margin=TARGET_SWITCH_MARGIN
+        , rescore_distance=RESCORE_DISTANCE, line_of_sight=LINE_OF_SIGHT
+        , candidates=LINE_OF_SIGHT_CANDIDATES):
+        if selector is None:
+            selector = TargetSelector()
+        self.selector = selector
+        self.switch_margin = switch_margin
+        self.rescore_distance = rescore_distance
+        self.line_of_sight = line_of_sight
+        self.candidates = candidates
+        #Maps object uid to (type, offset from player, importance)
+        self.scores = {}
+        #Bboxes of the objects last scored as an (N, 4) array
+        self.bboxes = None
+        self.target = None
+        #Whether another object is in the way of the target
+        self.blocked = False
+        self.frames = 0
+        #Metrics
+        self.rescores = 0
+        self.switches = 0
+        self.target_losses = 0
+        self.blocked_frames = 0
+        #Stores (frame, old uid, new uid, reason)
+        self.switch_events = deque(maxlen=SWITCH_EVENT_HISTORY)
+
+    """Returns the metrics of the manager as a dictionary"""
+    @property
+    def metrics(self):
+        return {
+            'frames' : self.frames,
+            'rescores' : self.rescores,
+            'switches' : self.switches,
+            'target_losses' : self.target_losses,
+            'blocked_frames' : self.blocked_frames
+        }
+
+    """Removes the current target and all cached importances"""
+    def reset(self):
+        self.scores = {}
+        self.target = None
+        self.blocked = False
+
+    """Rescores the objects that changed and drops objects that are gone"""
+    def update_scores(self, objects, player_pos):
+        if len(objects) == 0:
+            self.scores = {}
+            self.bboxes = None
+            return
+        #Kept so the line of sight check can use them too
+        self.bboxes = BBoxOps.to_array(o.bbox for o in objects)
+        centres = BBoxOps.bbox_centres(self.bboxes)
+        offsets = centres - (player_pos.x, player_pos.y)
+
+        #Find the objects that need to be rescored
+        changed = []
+        for i, o in enumerate(objects):
+            cached = self.scores.get(o.uid)
+            if (cached is None or cached[0] != o.type
+                or np.hypot(*(offsets[i] - cached[1])) > self.rescore_distance):
+                changed.append(i)
+
+        if len(changed) > 0:
+            importances = self.selector.get_importances(
+                [objects[i] for i in changed], player_pos)
+            for i, importance in zip(changed, importances):
+                self.scores[objects[i].uid] = (objects[i].type, offsets[i]
+                    , float(importance))
+            self.rescores += len(changed)
+
+        #Forget objects that no longer exist
+        if len(self.scores) > len(objects):
+            uids = set(o.uid for o in objects)
+            self.scores = {uid : score for uid, score in self.scores.items()
+                if uid in uids}
+
+    """Records a target switch"""
+    def switch_target(self, new_target, reason):
+        old_uid = None if self.target is None else self.target.uid
+        new_uid = None if new_target is None else new_target.uid
+        self.switch_events.append((self.frames, old_uid, new_uid, reason))
+        self.target = new_target
+
+    """
+    Casts rays from the player to the most important objects and the
+    object at current_index, if given, against every object at once
+    bboxes is the array of the objects' bboxes. Made if not given
+    Returns the candidates from most to least important
+    and the uids of the ones another object is in the way of
+    """
+    def find_blocked(self, objects, player_pos, current_index=None, bboxes=None):
+        importances = np.fromiter((self.scores[o.uid][2] for o in objects)
+            , dtype=np.float64, count=len(objects))
+        #Ties are won by the earlier objects like in update
+        indexes = np.lexsort((np.arange(len(objects)), -importances))
+        indexes = indexes[:self.candidates]
+        if not current_index is None and not current_index in indexes:
+            indexes = np.append(indexes, current_index)
+
+        if bboxes is None:
+            bboxes = BBoxOps.to_array(o.bbox for o in objects)
+        centres = BBoxOps.bbox_centres(bboxes[indexes])
+        hits = BBoxOps.segments_intersect_rects(
+            np.broadcast_to((player_pos.x, player_pos.y), centres.shape)
+            , centres, bboxes)
+        #An object is not in the way of itself
+        hits[np.arange(len(indexes)), indexes] = False
+        blocked = hits.any(axis=1)
+        candidates = [objects[i] for i in indexes]
+        return candidates, set(o.uid for o, b in zip(candidates, blocked) if b)
+
+    """Given an environment return the target object"""
+    def update(self, environment):
+        self.frames += 1
+        self.blocked = False
+        if environment.player is None:
+            return None
+        objects = environment.objects
+        self.update_scores(objects, environment.player.centre)
+
+        #Find the best object
+        best = None
+        best_importance = None
+        current = None
+        current_index = None
+        for i, o in enumerate(objects):
+            importance = self.scores[o.uid][2]
+            if best is None or importance > best_importance:
+                best = o
+                best_importance = importance
+            if not self.target is None and o.uid == self.target.uid:
+                current = o
+                current_index = i
+
+        if best is None:
+            if not self.target is None:
+                self.target_losses += 1
+                self.switch_target(None, 'lost')
+            return None
+
+        blocked = set()
+        if self.line_of_sight and len(objects) > 1:
+            candidates, blocked = self.find_blocked(objects
+                , environment.player.centre, current_index, self.bboxes)
+            #Aim for the most important object with a clear shot
+            clear = [o for o in candidates if not o.uid in blocked]
+            if best.uid in blocked and len(clear) > 0:
+                best = clear[0]
+                best_importance = self.scores[best.uid][2]
+
+        if current is None:
+            #The old target is gone so use the best object
+            if not self.target is None:
+                self.target_losses += 1
+                self.switch_target(best, 'lost')
+            else:
+                self.switch_target(best, 'new')
+        elif current.uid in blocked and not best.uid in blocked:
+            #Something is in the way of the old target
+            self.switches += 1
+            self.switch_target(best, 'blocked')
+        elif (best.uid != current.uid and best_importance
+            > self.scores[current.uid][2] + self.switch_margin):
+            self.switches += 1
+            self.switch_target(best, 'challenger')
+        else:
+            #The target object may have been redetected
+            self.target = current
+        self.blocked = self.target.uid in blocked
+        if self.blocked:
+            self.blocked_frames += 1
+        return self.target
 
 
 #This is the max distance the bot sees for the collision avoidance algorithm
@@ -135,12 +404,80 @@ MIN_AVOIDANCE_FORCE = 1
 DIRECTION_FORCE = 200
 SIGHT_OFFSET = 70
 
+"""
+Stores the constants that change how the bot moves
+Each Behavior has its own so they can be tuned without changing the globals
+"""
+class BehaviorConfig:
+    #The names of the constants that can be changed
+    NAMES = ['max_see_ahead', 'avoidance_factor', 'max_avoidance_force'
+        , 'direction_force', 'sight_offset', 'dir_change_chance']
+
+    def __init__(self, max_see_ahead=MAX_SEE_AHEAD
+        , avoidance_factor=AVOIDANCE_FACTOR
+        , max_avoidance_force=MAX_AVOIDANCE_FORCE
+        , direction_force=DIRECTION_FORCE, sight_offset=SIGHT_OFFSET
+        , dir_change_chance=DIR_CHANGE_CHANCE):
+        self.max_see_ahead = max_see_ahead
+        self.avoidance_factor = avoidance_factor
+        self.max_avoidance_force = max_avoidance_force
+        self.direction_force = direction_force
+        self.sight_offset = sight_offset
+        self.dir_change_chance = dir_change_chance
+
+    """Returns the constants as a dictionary of name to value"""
+    def to_dict(self):
+        return {name : getattr(self, name) for name in BehaviorConfig.NAMES}
+
+    """
+    Returns the avoidance force for an object the given distance away
+    Works on numbers and numpy arrays
+    """
+    def get_avoidance_size(self, dist):
+        return np.exp(-1 * self.avoidance_factor * dist
+            + math.log(self.max_avoidance_force * MIN_AVOIDANCE_FORCE)) + MIN_AVOIDANCE_FORCE
+
+
+"""
+This is the base of the algorithms used to move while avoiding obstacles
+config is the BehaviorConfig used. If not given the defaults are used
+"""
+class NavigationEngine:
+    def __init__(self, config=None):
+        if config is None:
+            config = BehaviorConfig()
+        self.config = config
+    """
+    Given a desired direction and the environment
+    Return the actual direction that should be moved to avoid obstacles
+    This is to be overridden
+    """
+    def get_direction(self, direction, environment, overlay = None):
+        return direction
+
+    """
+    Moves the player in the desired direction while avoiding obstacles
+    """
+    def steer(self, direction, environment, controller, overlay = None):
+        controller.move(self.get_direction(direction, environment, overlay))
+
+
 """This is the Collision Avoidance algorithm"""
-class CollisionAvoidance:
+class CollisionAvoidance(NavigationEngine):
+    """
+    If batch is true all the objects are handled at once with numpy
+    rather than one avoidance force at a time.
+    The batch version does not round like Vector2 does, so the directions
+    differ by up to about 1e-4 of the size of all the forces added
+    """
+    def __init__(self, batch=True, config=None):
+        super().__init__(config)
+        self.batch = batch
+
     """
     Adds an avoidance force to the direction
     """
-    def add_avoidance_force(self, collidable, player_pos, new_dir, frame):
+    def add_avoidance_force(self, collidable, player_pos, new_dir, overlay):
         #Get object center
         object_center = BBoxOps.bbox_centre(collidable)
         #Get distance from player to the object
@@ -148,129 +485,381 @@ class CollisionAvoidance:
         dir_to_object = object_center - player_pos
 
         #Closer the object, the more to move away
-        avoid_size = math.exp(-1 * AVOIDANCE_FACTOR * dist
-            + math.log(MAX_AVOIDANCE_FORCE * MIN_AVOIDANCE_FORCE)) + MIN_AVOIDANCE_FORCE
+        avoid_size = float(self.config.get_avoidance_size(dist))
         avoidance_vector = dir_to_object.normalize() * avoid_size * -1
 
         new_dir = new_dir + avoidance_vector
 
-        if not frame is None:
-            frame = cv2.line(frame, object_center.to_tuple()
-            , (object_center + avoidance_vector).to_tuple() 
+        if not overlay is None:
+            overlay.draw_line(object_center
+            , object_center + avoidance_vector
             , (255,0,0), 5)
         
         return new_dir
 
+    """
+    Batch version of add_avoidance_force
+    Given an (N, 4) array of bboxes and how many times each one collides
+    with the sight ranges, returns the object centres and the avoidance
+    forces as (N, 2) arrays
+    """
+    def get_avoidance_forces(self, bboxes, hits, player_pos):
+        centres = BBoxOps.bbox_centres(bboxes)
+        dir_to_objects = centres - (player_pos.x, player_pos.y)
+        dists = np.hypot(dir_to_objects[:, 0], dir_to_objects[:, 1])
+
+        #Closer the object, the more to move away
+        avoid_sizes = self.config.get_avoidance_size(dists)
+        #Objects on top of the player have no direction to avoid
+        safe_dists = np.where(dists > 0, dists, 1)
+        scale = np.where(dists > 0, -1 * avoid_sizes / safe_dists, 0)
+        forces = dir_to_objects * (scale * hits)[:, None]
+        return centres, forces
+
+    """Draws the avoidance forces calculated by get_avoidance_forces"""
+    def draw_avoidance_forces(self, overlay, centres, forces, hits):
+        for i in np.flatnonzero(hits):
+            object_center = Vector2(centres[i][0], centres[i][1])
+            #Draw the force of a single collision
+            force = Vector2(forces[i][0], forces[i][1]) * (1 / hits[i])
+            overlay.draw_line(object_center, object_center + force
+                , (255,0,0), 5)
+
     """
     Given a desired direction and the environment
     Return the actual direction that should be moved to avoid obstacles
-    If the frame is passed, the sight radius will be drawn
+    If the overlay is passed, the sight radius will be drawn
     """
-    def get_direction(self, direction, environment, frame = None):
-        direction = direction.normalize() * DIRECTION_FORCE
-        sight_offset = direction.normalize() * SIGHT_OFFSET
+    def get_direction(self, direction, environment, overlay = None):
+        direction = direction.normalize() * self.config.direction_force
+        sight_offset = direction.normalize() * self.config.sight_offset
 
         if environment.player is None:
             return
         player_pos = environment.player.centre
 
         #Get the sight range
-        sight_range = Circle(player_pos + sight_offset, MAX_SEE_AHEAD)
+        sight_range = Circle(player_pos + sight_offset, self.config.max_see_ahead)
         #Get surrounding sight range
-        surround_range = Circle(player_pos, MAX_SEE_AHEAD)
+        surround_range = Circle(player_pos, self.config.max_see_ahead)
 
         new_dir = direction
 
-        #Check whether the sight vector colllide with any objects in the environment
-        for collidable in environment.objects:
-            #Check if collision occurs
-            if sight_range.intersects_rect(collidable.bbox):
-                new_dir = self.add_avoidance_force(collidable.bbox, player_pos, new_dir, frame)
-            if surround_range.intersects_rect(collidable.bbox):
-                new_dir = self.add_avoidance_force(collidable.bbox, player_pos, new_dir, frame)
+        if self.batch:
+            bboxes = BBoxOps.to_array(o.bbox for o in environment.objects)
+            #Count collisions with both sight ranges for every object
+            hits = (sight_range.intersects_rects(bboxes).astype(np.int64)
+                + surround_range.intersects_rects(bboxes))
+            centres, forces = self.get_avoidance_forces(bboxes, hits, player_pos)
+            total_force = forces.sum(axis=0)
+            new_dir = new_dir + Vector2(float(total_force[0]), float(total_force[1]))
+
+            #Drawing is done in its own pass
+            if not overlay is None:
+                self.draw_avoidance_forces(overlay, centres, forces, hits)
+        else:
+            #Check whether the sight vector colllide with any objects in the environment
+            for collidable in environment.objects:
+                #Check if collision occurs
+                if sight_range.intersects_rect(collidable.bbox):
+                    new_dir = self.add_avoidance_force(collidable.bbox, player_pos, new_dir, overlay)
+                if surround_range.intersects_rect(collidable.bbox):
+                    new_dir = self.add_avoidance_force(collidable.bbox, player_pos, new_dir, overlay)
 
         #Draw sight radius
-        if not frame is None:
-            cv2.circle(frame, sight_range.centre.to_tuple()
-            , sight_range.radius, (255,0,0), 1)
-            cv2.circle(frame, surround_range.centre.to_tuple()
-            , surround_range.radius, (255,0,0), 1)
+        if not overlay is None:
+            overlay.draw_circle(sight_range, (255,0,0), 1)
+            overlay.draw_circle(surround_range, (255,0,0), 1)
 
         return new_dir
 
 
-"""Implements the merge sort algorithm"""
-class MergeSort:
-    def __init__(self, descending = False):
-        self.descending = descending
-
-    """Sort an array"""
-    def sort(self, array):
-        if len(array) <= 1:
-            return array
-        mid = len(array)//2
-        #Divide objects into two parts
-        left = array[:mid]
-        right = array[mid:]
-        #Sort the left
-        left = self.sort(left)
-        right = self.sort(right)
-        return self.__merge(left, right)
-
-    """Merge two arrays in sorted order"""
-    def __merge(self, arr1, arr2):
-        temp = []
-        while len(arr1) > 0 or len(arr2) > 0:
-            if len(arr1) == 0:
-                temp.append(arr2.pop(0))
-            elif len(arr2) == 0:
-                temp.append(arr1.pop(0))
-            elif self.compare(arr1[0], arr2[0]) == -1:
-                if self.descending:
-                    temp.append(arr2.pop(0))
-                else:
-                    temp.append(arr1.pop(0))
-            else:
-                if self.descending:
-                    temp.append(arr1.pop(0))
-                else:
-                    temp.append(arr2.pop(0))
-        return temp
-
-    """Checks if the algorithm should insert i given j is highest"""
-    def __should_insert(self, i, j):
-        if self.descending and self.compare(i, j) == 1:
-            return True
-        elif not self.descending and self.compare(i,j) == -1:
-            return True
-        return False
-
-    """
-    Given two elements i and j
-    return -1 if i < j
-    return 0 if i == j
-    return 1 if i > j
-    """
-    def compare(self, i, j):
-        if i < j:
-            return -1
-        elif i == j:
-            return 0
-        else:
-            return 1
+#Resolution of the distance field relative to the frame
+FIELD_SCALE = 0.25
+
+"""
+Avoids obstacles using a potential field
+The obstacle bboxes are drawn onto a low resolution mask once per frame
+and the distance to the closest obstacle is found for every pixel.
+The player moves down the gradient of the field, away from obstacles
+Unlike CollisionAvoidance this takes into account the size of obstacles
+"""
+class PotentialFieldAvoidance(NavigationEngine):
+    def __init__(self, scale=FIELD_SCALE, config=None):
+        super().__init__(config)
+        self.scale = scale
+
+    """
+    Returns the signed distance from every pixel of the field
+    to the closest obstacle edge in frame pixels
+    Pixels inside obstacles are negative
+    """
+    def get_distance_field(self, environment):
+        #The field is shared by everything that uses it this frame
+        if not environment.distance_field is None:
+            return environment.distance_field
+
+        width = max(int(environment.size[0] * self.scale), 1)
+        height = max(int(environment.size[1] * self.scale), 1)
+        #Draw all the bboxes at once by marking their corners
+        #and summing along both axes
+        bboxes = BBoxOps.to_array(o.bbox for o in environment.objects) * self.scale
+        x1 = np.clip(np.floor(bboxes[:, 0]), 0, width).astype(np.intp)
+        y1 = np.clip(np.floor(bboxes[:, 1]), 0, height).astype(np.intp)
+        x2 = np.clip(np.ceil(bboxes[:, 0] + bboxes[:, 2]), 0, width).astype(np.intp)
+        y2 = np.clip(np.ceil(bboxes[:, 1] + bboxes[:, 3]), 0, height).astype(np.intp)
+        corners = np.zeros((height + 1, width + 1), dtype=np.int32)
+        np.add.at(corners, (y1, x1), 1)
+        np.add.at(corners, (y1, x2), -1)
+        np.add.at(corners, (y2, x1), -1)
+        np.add.at(corners, (y2, x2), 1)
+        coverage = corners.cumsum(axis=0).cumsum(axis=1)[:height, :width]
+        #Free space is non zero so distanceTransform measures to obstacles
+        mask = np.where(coverage > 0, 0, 255).astype(np.uint8)
+
+        outside = cv2.distanceTransform(mask, cv2.DIST_L2, 5)
+        inside = cv2.distanceTransform(255 - mask, cv2.DIST_L2, 5)
+        #With no obstacles the distances are too large to use
+        max_dist = float(width + height)
+        outside = np.minimum(outside, max_dist)
+        inside = np.minimum(inside, max_dist)
+        environment.distance_field = (outside - inside) / self.scale
+        return environment.distance_field
+
+    """
+    Returns the repulsion force at the given position in the frame
+    """
+    def get_repulsion(self, field, pos):
+        height, width = field.shape
+        x = min(max(int(pos.x * self.scale), 0), width - 1)
+        y = min(max(int(pos.y * self.scale), 0), height - 1)
+        dist = field[y, x]
+        #Nothing close enough to avoid
+        if dist >= self.config.max_see_ahead:
+            return Vector2(0,0)
+
+        #Central difference of the field points away from the obstacles
+        grad_x = field[y, min(x + 1, width - 1)] - field[y, max(x - 1, 0)]
+        grad_y = field[min(y + 1, height - 1), x] - field[max(y - 1, 0), x]
+        gradient = Vector2(float(grad_x), float(grad_y))
+
+        #Closer the object, the more to move away
+        avoid_size = float(self.config.get_avoidance_size(max(float(dist), 0)))
+        return gradient.normalize() * avoid_size
+
+    """
+    Given a desired direction and the environment
+    Return the actual direction that should be moved to avoid obstacles
+    If the overlay is passed, the repulsion forces will be drawn
+    """
+    def get_direction(self, direction, environment, overlay = None):
+        direction = direction.normalize() * self.config.direction_force
+        sight_offset = direction.normalize() * self.config.sight_offset
+
+        if environment.player is None:
+            return
+        player_pos = environment.player.centre
+        field = self.get_distance_field(environment)
+
+        #Avoid obstacles around the player and the ones ahead
+        new_dir = direction
+        for pos in (player_pos, player_pos + sight_offset):
+            repulsion = self.get_repulsion(field, pos)
+            new_dir = new_dir + repulsion
+            if not overlay is None:
+                overlay.draw_line(pos, pos + repulsion, (255,0,0), 5)
+
+        return new_dir
 
 
-"""Sort game objects based on importance"""
-class ImportanceSort(MergeSort):
-    def __init__(self):
-        #Make sure merge sort is done descendingly
-        super().__init__(True)
+#How far the player moves in a frame while a movement key is pressed
+PLAYER_SPEED = 6
+#How many frames ahead the planner looks
+PLANNER_HORIZON = 12
+#How much less each frame further ahead matters to the planner
+PLANNER_DISCOUNT = 0.9
+#Radius of the player used by the planner
+PLAYER_RADIUS = 20
+#The most time the planner can take each frame in seconds
+#The time each part takes is estimated from the last frames
+PLANNER_TIME_BUDGET = 0.002
+#Only this many of the closest objects are looked at by the planner
+PLANNER_MAX_OBJECTS = 64
+#Objects are gathered this many at a time so the budget is checked in between
+PLANNER_GATHER_CHUNK = 256
+
+"""
+Looks ahead to choose which movement keys to press
+Every key combination is tried over a short horizon against where the
+tracked objects are predicted to be, all in one numpy batch.
+The best keys are pressed directly rather than turning a direction
+into keys
+"""
+class LookaheadPlanner(NavigationEngine):
+    #The key combinations the planner can choose from
+    #Not moving comes first so it wins ties
+    KEYS = [(), ('d',), ('d','s'), ('s',), ('a','s'), ('a',), ('a','w')
+        , ('w',), ('d','w')]
+
+    def __init__(self, horizon=PLANNER_HORIZON, time_budget=PLANNER_TIME_BUDGET
+        , config=None):
+        super().__init__(config)
+        self.horizon = horizon
+        self.time_budget = time_budget
+        #Unit direction for every key combination
+        directions = []
+        for keys in LookaheadPlanner.KEYS:
+            x = ('d' in keys) - ('a' in keys)
+            y = ('s' in keys) - ('w' in keys)
+            length = math.hypot(x, y) or 1
+            directions.append((x / length, y / length))
+        self.directions = np.array(directions)
+        #Time taken per object to gather it and per frame of lookahead
+        #Used to keep within the time budget
+        self.gather_cost = None
+        self.step_cost = None
+        #How many times the budget ran out before the first frame
+        self.fallbacks = 0
+
+    """
+    Given the last estimate of a cost and a new measurement,
+    returns the new estimate. It goes up straight away but comes down slowly
+    """
+    @staticmethod
+    def update_cost(cost, new_cost):
+        if cost is None or new_cost > cost:
+            return new_cost
+        return 0.9 * cost + 0.1 * new_cost
+
+    """Returns whether work that costs cost per object would go over budget"""
+    def over_budget(self, start_time, cost, num_objects):
+        elapsed = time.perf_counter() - start_time
+        return elapsed + (cost or 0) * num_objects > self.time_budget
+
+    """
+    Returns the centres, velocities and clearances of the closest objects
+    The objects are gathered a chunk at a time. If all of them or the next
+    chunk would go over the budget, None is returned
+    """
+    def gather(self, objects, player_pos, start_time):
+        #Give up straight away rather than spend the budget for nothing
+        if self.over_budget(start_time, self.gather_cost, len(objects)):
+            return None
+        centres = np.empty((0, 2))
+        clearance = np.empty(0)
+        kept = []
+        for i in range(0, len(objects), PLANNER_GATHER_CHUNK):
+            chunk = objects[i:i + PLANNER_GATHER_CHUNK]
+            if self.over_budget(start_time, self.gather_cost, len(chunk)):
+                return None
+            chunk_start = time.perf_counter()
+
+            bboxes = BBoxOps.to_array(o.bbox for o in chunk)
+            centres = np.concatenate((centres, BBoxOps.bbox_centres(bboxes)))
+            #Keep this far away from the centre of each object
+            clearance = np.concatenate((clearance
+                , np.hypot(bboxes[:, 2], bboxes[:, 3]) / 2 + PLAYER_RADIUS))
+            kept.extend(chunk)
+            #Only keep the closest objects
+            if len(kept) > PLANNER_MAX_OBJECTS:
+                dists = np.hypot(*(centres - player_pos).T) - clearance
+                closest = np.argpartition(dists, PLANNER_MAX_OBJECTS)[:PLANNER_MAX_OBJECTS]
+                centres = centres[closest]
+                clearance = clearance[closest]
+                kept = [kept[j] for j in closest]
+
+            self.gather_cost = LookaheadPlanner.update_cost(self.gather_cost
+                , (time.perf_counter() - chunk_start) / len(chunk))
+        velocities = np.array([o.velocity for o in kept]
+            , dtype=np.float64).reshape(-1, 2)
+        return centres, velocities, clearance
+
+    """
+    Returns the score of every key combination after looking ahead
+    as many frames as the time budget allows
+    Before gathering each chunk of objects and before each frame the time
+    it will take is checked against the budget. If the budget runs out
+    before the first frame, None is returned
+    """
+    def score(self, direction, environment, start_time):
+        goal = direction.normalize()
+        player_pos = np.array([environment.player.centre.x
+            , environment.player.centre.y])
+        gathered = self.gather(environment.objects, player_pos, start_time)
+        if gathered is None:
+            return None
+        centres, velocities, clearance = gathered
+        num_objects = max(len(centres), 1)
+
+        #Reward moving in the desired direction
+        progress = (self.directions @ np.array([goal.x, goal.y])
+            * self.config.direction_force)
+        scores = np.zeros(len(self.directions))
+        for step in range(1, self.horizon + 1):
+            #Stop looking ahead if the next frame would go over budget
+            if self.over_budget(start_time, self.step_cost, num_objects):
+                if step == 1:
+                    return None
+                break
+            step_start = time.perf_counter()
+
+            discount = PLANNER_DISCOUNT ** step
+            #Positions of the player for each key and of each object
+            player_at = player_pos + self.directions * PLAYER_SPEED * step
+            objects_at = centres + velocities * step
+            offsets = player_at[:, None, :] - objects_at[None, :, :]
+            gaps = np.maximum(np.hypot(offsets[..., 0], offsets[..., 1])
+                - clearance, 0)
+            #Closer the object, the higher the cost
+            danger = (np.exp(-1 * self.config.avoidance_factor * gaps)
+                * self.config.max_avoidance_force).sum(axis=1)
+            scores += discount * (progress - danger)
+
+            self.step_cost = LookaheadPlanner.update_cost(self.step_cost
+                , (time.perf_counter() - step_start) / num_objects)
+        return scores
+
+    """Returns the movement keys the player should press"""
+    def plan(self, direction, environment, overlay = None):
+        start_time = time.perf_counter()
+        if environment.player is None:
+            return ()
+        scores = self.score(direction, environment, start_time)
+        if scores is None:
+            #Out of time so move towards the goal without looking ahead
+            self.fallbacks += 1
+            #The estimates only come down when measured, so bring them down
+            #here or one slow frame could stop the planner for good
+            self.gather_cost = LookaheadPlanner.update_cost(self.gather_cost, 0)
+            self.step_cost = LookaheadPlanner.update_cost(self.step_cost, 0)
+            goal = direction.normalize()
+            scores = self.directions @ np.array([goal.x, goal.y])
+        best = int(np.argmax(scores))
+
+        #Draw the planned path
+        if not overlay is None:
+            player_pos = environment.player.centre
+            move = self.directions[best] * PLAYER_SPEED * self.horizon
+            overlay.draw_line(player_pos, player_pos + Vector2(move[0], move[1])
+                , (255,0,0), 5)
+        return LookaheadPlanner.KEYS[best]
 
     """Overrides"""
-    def compare(self, i, j):
-        if i[1] < j[1]:
-            return -1
-        elif i[1] == j[1]:
-            return 0
-        else:
-            return 1
\ No newline at end of file
+    def get_direction(self, direction, environment, overlay = None):
+        best = self.directions[LookaheadPlanner.KEYS.index(
+            self.plan(direction, environment, overlay))]
+        return Vector2(best[0], best[1])
+
+    """Overrides"""
+    def steer(self, direction, environment, controller, overlay = None):
+        controller.press_keys(self.plan(direction, environment, overlay))
+
+
+#Every engine is a NavigationEngine
+NAVIGATION_ENGINES = {
+    'avoidance' : CollisionAvoidance,
+    'field' : PotentialFieldAvoidance,
+    'planner' : LookaheadPlanner
+}
+#The engine used by the bot to avoid obstacles
+NAVIGATION_ENGINE = 'avoidance'
@@ -0,0 +1,614 @@
+"""
+Benchmarks for the bot
+Run python3 benchmark.py <benchmark> from the src folder
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+#Use the default perception settings rather than a tuned profile so the
+#results can be compared with the baseline. Must be set before config is
+#imported. The name is PERCEPTION_PROFILE_ENV in config.py
+os.environ['USE_PERCEPTION_PROFILE'] = '0'
+from environment import *
+from behavior import *
+from config import CAPTURE_SIZE, PIPELINE, FRAME_RING_SIZE, TRACKING_RATE
+from controller import RecordingBackend
+from game_parser import (DetectionAlgorithm, TrackedObjects, ReplayCapture
+    , GameParser)
+from synthetic import SyntheticFrameGenerator, match_detections
+from simulator import run_episode
+from buffers import BUFFER_POOL, FrameRing
+from metrics import METRICS
+from lifecycle import BotLifecycle
+from bot import Bot
+from perception_worker import PerceptionWorker
+try:
+    import resource
+except ImportError:
+    #Not available on Windows
+    resource = None
+
+
+################################################################################
+#Helpers
+################################################################################
+
+"""Makes an environment filled with random objects"""
+def make_random_environment(num_objects, size=(800,400), seed=0):
+    rng = random.Random(seed)
+    environment = Environment(size)
+    object_types = [GameObject.SQUARE, GameObject.TRIANGLE, GameObject.PENTAGON
+        , GameObject.ENEMY, GameObject.ALLY]
+    objects = []
+    for _ in range(num_objects):
+        bbox = (rng.uniform(0, size[0]), rng.uniform(0, size[1])
+            , rng.uniform(10, 60), rng.uniform(10, 60))
+        objects.append(GameObject(bbox, rng.choice(object_types)))
+    environment.objects = objects
+    return environment
+
+"""
+Times a function and returns the median time of a call in seconds
+"""
+def time_call(func, repeats=50):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+"""Returns the given percentile of a list of times"""
+def percentile(times, percent):
+    times = sorted(times)
+    return times[min(len(times) * percent // 100, len(times) - 1)]
+
+"""Prints the p50, p95 and p99 of a list of times in milliseconds"""
+def print_latencies(name, times):
+    print(f"{name} latency p50 {percentile(times, 50) * 1000:.2f}ms, "
+        + f"p95 {percentile(times, 95) * 1000:.2f}ms, "
+        + f"p99 {percentile(times, 99) * 1000:.2f}ms")
+
+"""
+Adds up the counts from match_detections and prints the
+precision and recall of each object type
+"""
+def print_accuracy(counts):
+    print(f"{'type':>10} {'precision':>10} {'recall':>10}")
+    for object_type, (tp, fp, fn) in sorted(counts.items()):
+        precision = tp / (tp + fp) if tp + fp > 0 else float('nan')
+        recall = tp / (tp + fn) if tp + fn > 0 else float('nan')
+        print(f"{object_type:>10} {precision:>10.2f} {recall:>10.2f}")
+
+"""Adds the counts of one frame to the totals"""
+def add_counts(totals, counts):
+    for object_type, frame_counts in counts.items():
+        total = totals.get(object_type, (0, 0, 0))
+        totals[object_type] = tuple(a + b for a, b in zip(total, frame_counts))
+
+"""
+Returns the most memory the process has used in MB
+or None if it cannot be found
+"""
+def get_peak_memory():
+    if resource is None:
+        return None
+    #ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak / 1024
+
+"""
+Given a list of sizes and times, returns the exponent b
+of the best fit time = a * size^b
+"""
+def fit_exponent(sizes, times):
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(t) for t in times]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    num = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+    den = sum((x - x_mean) ** 2 for x in xs)
+    return num / den
+
+
+################################################################################
+#Benchmarks
+################################################################################
+
+"""
+Checks that target selection grows linearly with the number of objects
+Returns whether the benchmark passed
+"""
+def bench_target_selection(sizes=(100, 1000, 10000, 50000), k=5
+    , max_exponent=1.3):
+    selector = TargetSelector()
+    times = []
+    print(f"{'objects':>10} {'top_k ms':>10}")
+    for size in sizes:
+        environment = make_random_environment(size)
+        times.append(time_call(lambda: selector.top_k(environment, k)))
+        print(f"{size:>10} {times[-1] * 1000:>10.3f}")
+    exponent = fit_exponent(sizes, times)
+    passed = exponent <= max_exponent
+    print(f"Scaling exponent {exponent:.2f} (max {max_exponent})"
+        + ("" if passed else " FAILED"))
+    return passed
+
+"""
+Times the line of sight check of the target manager, including making
+its bbox array, and checks it stays within the budget at every size.
+The time to make the bbox array is also shown on its own.
+The rays are also checked against the scalar BBoxOps.intersects_rect
+"""
+def bench_line_of_sight(sizes=(100, 200), budget=0.00025, rays=200):
+    manager = TargetManager()
+    passed = True
+    print(f"{'objects':>10} {'check us':>10} {'bboxes us':>10}")
+    for size in sizes:
+        environment = make_random_environment(size)
+        objects = environment.objects
+        player_pos = environment.player.centre
+
+        manager.update_scores(objects, player_pos)
+        #Each frame reuses the bbox array made when scoring, but making it
+        #is counted here so the check is timed with everything it needs
+        seconds = time_call(lambda: manager.find_blocked(objects, player_pos, 0))
+        bbox_seconds = time_call(lambda: BBoxOps.to_array(o.bbox for o in objects))
+        within = seconds <= budget
+        passed = passed and within
+        print(f"{size:>10} {seconds * 1e6:>10.1f} {bbox_seconds * 1e6:>10.1f}"
+            + ("" if within else f" over budget of {budget * 1e6:.0f}us FAILED"))
+
+    #Compare random rays with the scalar version
+    rng = random.Random(1)
+    environment = make_random_environment(sizes[0])
+    bboxes = [o.bbox for o in environment.objects]
+    starts = [(rng.uniform(0, 800), rng.uniform(0, 400)) for _ in range(rays)]
+    ends = [(rng.uniform(0, 800), rng.uniform(0, 400)) for _ in range(rays)]
+    hits = BBoxOps.segments_intersect_rects(starts, ends, bboxes)
+    mismatches = sum(hits[i, j] != BBoxOps.intersects_rect(
+        Segment(*starts[i], *ends[i]), bbox)
+        for i in range(rays) for j, bbox in enumerate(bboxes))
+    print(f"{mismatches} of {hits.size} ray checks differ from the scalar version"
+        + ("" if mismatches == 0 else " FAILED"))
+    return passed and mismatches == 0
+
+
+"""
+Checks the batch CollisionAvoidance gives the same direction as the scalar one.
+The scalar version rounds its Vector2s to 4 decimal places after every step
+so the two differ by up to about 1e-4 of the forces added together.
+Returns whether every difference is within tolerance of the forces added
+"""
+def bench_avoidance(sizes=(20, 100, 400), trials=50, tolerance=5e-4):
+    batch = CollisionAvoidance(batch=True)
+    scalar = CollisionAvoidance(batch=False)
+    config = batch.config
+    rng = random.Random(1)
+    worst = 0
+    for trial in range(trials):
+        environment = make_random_environment(sizes[trial % len(sizes)], seed=trial)
+        environment.player = GameObject((rng.uniform(0, 800), rng.uniform(0, 400)
+            , 30, 30), GameObject.PLAYER)
+        direction = Vector2(rng.uniform(-1, 1), rng.uniform(-1, 1))
+        batch_dir = batch.get_direction(direction, environment)
+        scalar_dir = scalar.get_direction(direction, environment)
+
+        #Size of all the forces added together
+        player_pos = environment.player.centre
+        bboxes = BBoxOps.to_array(o.bbox for o in environment.objects)
+        sight_offset = direction.normalize() * config.sight_offset
+        hits = (Circle(player_pos + sight_offset, config.max_see_ahead)
+            .intersects_rects(bboxes).astype(np.int64)
+            + Circle(player_pos, config.max_see_ahead).intersects_rects(bboxes))
+        _, forces = batch.get_avoidance_forces(bboxes, hits, player_pos)
+        total = config.direction_force + np.hypot(forces[:, 0], forces[:, 1]).sum()
+
+        difference = math.hypot(batch_dir.x - scalar_dir.x, batch_dir.y - scalar_dir.y)
+        worst = max(worst, difference / total)
+    passed = worst <= tolerance
+    print(f"Largest difference from the scalar version {worst:.2e} of the forces"
+        + f" (max {tolerance:.0e})" + ("" if passed else " FAILED"))
+    return passed
+
+
+"""
+Runs full detection on synthetic frames of each density
+and reports its speed and accuracy for each object type
+"""
+def bench_detection(densities=(0.1, 0.3, 0.6), frames=100, speed=2):
+    detect_alg = DetectionAlgorithm()
+    for density in densities:
+        generator = SyntheticFrameGenerator(density=density, speed=speed)
+        times = []
+        counts = {}
+        detections = 0
+        for _ in range(frames):
+            frame, truth, player_bbox = generator.next_frame()
+            start = time.perf_counter()
+            detected = detect_alg.detect(frame, player_bbox=player_bbox)
+            times.append(time.perf_counter() - start)
+            detections += len(detected)
+            add_counts(counts, match_detections(detected, truth))
+        print(f"Density {density} ({len(generator.objects)} objects): "
+            + f"{detections / sum(times):.0f} detections per second")
+        print_latencies('Detection', times)
+        print_accuracy(counts)
+    return True
+
+"""
+Tracks the objects of a synthetic frame as they move
+and reports the speed and accuracy of the trackers
+"""
+def bench_tracking(density=0.3, frames=100, speed=2):
+    detect_alg = DetectionAlgorithm()
+    generator = SyntheticFrameGenerator(density=density, speed=speed)
+    frame, truth, _ = generator.next_frame()
+    tracked = TrackedObjects(truth)
+    tracked.init(frame)
+    times = []
+    counts = {}
+    for _ in range(frames):
+        frame, truth, _ = generator.next_frame()
+        start = time.perf_counter()
+        objects = tracked.update(frame, detect_alg)
+        times.append(time.perf_counter() - start)
+        objects = [obj for obj in objects if obj.is_tracked]
+        add_counts(counts, match_detections(objects, truth))
+    print(f"Tracking {len(generator.objects)} objects over {frames} frames")
+    print_latencies('Tracking', times)
+    print_accuracy(counts)
+    return True
+
+#Where the results of the replay benchmark are compared against
+REPLAY_BASELINE_PATH = 'replay_baseline.json'
+#How much worse than the baseline the replay can be before it fails
+#0.2 means 20% fewer frames per second or 20% more latency
+REPLAY_REGRESSION_THRESHOLD = 0.2
+#How many frames are in the synthetic session
+#used when no recorded sessions are given
+SYNTHETIC_SESSION_FRAMES = 300
+
+"""
+Plays a session through the whole bot with no display
+and returns the results as a dictionary
+The frame budget never runs out so every session does the same work.
+The peak memory is only found if measure_memory is true.
+ru_maxrss is the peak of the whole process and only ever grows,
+so it says nothing about sessions played after the first
+"""
+def replay_session(frames, pipeline=PIPELINE, measure_memory=True):
+    METRICS.reset()
+    #Buffers left by the last session would make this one allocate less
+    BUFFER_POOL.reset()
+    backend = RecordingBackend()
+    screen_cap = ReplayCapture(frames)
+    bot = Bot(screen_cap.size, display_view=False, backend=backend
+        , screen_cap=screen_cap, listen_keys=False)
+    #Degradations depend on how fast the machine is at the time
+    bot.budget.deadline = math.inf
+    bot.lifecycle.set_state(BotLifecycle.RUNNING)
+    start = time.perf_counter()
+    bot.play(pipeline)
+    duration = time.perf_counter() - start
+
+    summary = METRICS.snapshot()
+    latency = summary['spans'].get('capture_to_decision')
+    commands = backend.summary()
+    return {
+        'frames' : screen_cap.frames_read,
+        'fps' : screen_cap.frames_read / duration,
+        'latency_p50' : None if latency is None else latency['p50'],
+        'latency_p95' : None if latency is None else latency['p95'],
+        'latency_p99' : None if latency is None else latency['p99'],
+        'peak_memory_mb' : get_peak_memory() if measure_memory else None,
+        'decisions' : 0 if latency is None else latency['count'],
+        'commands' : {kind : value['count'] for kind, value in commands.items()
+            if isinstance(value, dict)}
+    }
+
+"""
+Returns the reasons a result is worse than its baseline
+by more than the threshold
+"""
+def get_regressions(result, baseline, threshold):
+    regressions = []
+    if result['fps'] < baseline['fps'] * (1 - threshold):
+        regressions.append(f"fps {result['fps']:.1f} is below "
+            + f"baseline {baseline['fps']:.1f}")
+    for key in ('latency_p50', 'latency_p95'):
+        if result[key] is None or baseline[key] is None:
+            continue
+        if result[key] > baseline[key] * (1 + threshold):
+            regressions.append(f"{key} {result[key] * 1000:.1f}ms is above "
+                + f"baseline {baseline[key] * 1000:.1f}ms")
+    return regressions
+
+"""
+Plays recorded sessions through the whole bot and checks
+the frame rate and latency have not got worse than the baseline
+sessions are paths to videos of the captured game view
+If none are given, a synthetic session is played
+If there is no baseline for a session or update_baseline is true,
+the results are saved as the new baseline
+"""
+def bench_replay(sessions=(), update_baseline=False
+    , baseline_path=REPLAY_BASELINE_PATH
+    , threshold=REPLAY_REGRESSION_THRESHOLD):
+    baselines = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baselines = json.load(f)
+
+    if len(sessions) == 0:
+        generator = SyntheticFrameGenerator(CAPTURE_SIZE)
+        sessions = {'synthetic' : [generator.next_frame()[0]
+            for _ in range(SYNTHETIC_SESSION_FRAMES)]}
+    else:
+        sessions = {os.path.basename(path) : ReplayCapture.read_video(path)
+            for path in sessions}
+
+    passed = True
+    for i, (name, frames) in enumerate(sessions.items()):
+        result = replay_session(frames, measure_memory=i == 0)
+        if result['frames'] == 0:
+            print(f"{name}: no frames could be read")
+            passed = False
+            continue
+        print(f"{name}: {result['frames']} frames at {result['fps']:.1f} fps, "
+            + f"{result['decisions']} decisions")
+        if not result['latency_p50'] is None:
+            print("Capture to decision latency "
+                + f"p50 {result['latency_p50'] * 1000:.2f}ms, "
+                + f"p95 {result['latency_p95'] * 1000:.2f}ms, "
+                + f"p99 {result['latency_p99'] * 1000:.2f}ms")
+        if not result['peak_memory_mb'] is None:
+            print(f"Peak memory {result['peak_memory_mb']:.0f}MB")
+        print(f"Commands sent {result['commands']}")
+
+        if update_baseline or not name in baselines:
+            print(f"Saving {name} as the baseline")
+            baselines[name] = result
+            continue
+        regressions = get_regressions(result, baselines[name], threshold)
+        for regression in regressions:
+            print(f"REGRESSION {name}: {regression}")
+        passed = passed and len(regressions) == 0
+
+    with open(baseline_path, 'w') as f:
+        json.dump(baselines, f, indent=4)
+    return passed
+
+#Frame rate of the real game. Used to say how much faster
+#than real time the simulator runs
+GAME_FPS = 30
+
+"""
+Plays each navigation engine in the simulator and prints how it did
+and how many times faster than real time the episodes ran
+"""
+def bench_simulator(frames=2000, perceive_frames=300):
+    print(f"{'engine':>10} {'perceive':>9} {'x real time':>12} {'collisions':>11} "
+        + f"{'destroyed':>10} {'score':>7} {'ms/decision':>12}")
+    runs = [(engine, False, frames) for engine in NAVIGATION_ENGINES]
+    runs.append((NAVIGATION_ENGINE, True, perceive_frames))
+    for engine, perceive, episode_frames in runs:
+        start = time.perf_counter()
+        stats = run_episode(Behavior(engine), episode_frames, perceive)
+        speed = episode_frames / (time.perf_counter() - start) / GAME_FPS
+        print(f"{engine:>10} {str(perceive):>9} {speed:>12.1f} "
+            + f"{stats['collisions']:>11} {stats['shapes_destroyed']:>10} "
+            + f"{stats['score']:>7} {stats['cpu_per_decision'] * 1000:>12.3f}")
+    return True
+
+"""
+Captures and parses synthetic frames and checks that once warmed up
+the buffer pool allocates close to nothing each frame, and that the median
+bytes numpy and OpenCV allocate each frame stays under max_transient_kb.
+PIL makes a new image every grab, so that image is not counted
+Returns whether the benchmark passed
+"""
+def bench_allocations(frames=200, warmup=20, max_allocations=0.1
+    , max_transient_kb=64):
+    generator = SyntheticFrameGenerator(CAPTURE_SIZE)
+    session = [generator.next_frame() for _ in range(frames)]
+    frame_ring = FrameRing(8, BUFFER_POOL)
+    game_parser = GameParser(5)
+    environment = Environment(CAPTURE_SIZE)
+    game_parser.init(session[0][0], session[0][2])
+
+    allocations = 0
+    transient_bytes = []
+    tracemalloc.start()
+    for i, (image, _, _) in enumerate(session):
+        if i == warmup:
+            allocations = BUFFER_POOL.allocations
+        #Stands in for the new RGB image PIL makes for every grab
+        grabbed = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        #Convert into the ring like the screen capture does
+        frame = frame_ring.next(grabbed.shape)
+        cv2.cvtColor(grabbed, cv2.COLOR_BGR2RGB, dst=frame)
+        #The grabbed image is freed before measuring so it is not counted
+        grabbed = None
+        tracemalloc.reset_peak()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        game_parser.update(frame, environment)
+        frame_ring.release(frame)
+        if i >= warmup:
+            transient_bytes.append(tracemalloc.get_traced_memory()[1] - start_bytes)
+        BUFFER_POOL.end_frame()
+    tracemalloc.stop()
+
+    per_frame = (BUFFER_POOL.allocations - allocations) / (frames - warmup)
+    passed = per_frame <= max_allocations
+    print(f"Buffer allocations per frame after warm up {per_frame:.3f} "
+        + f"(max {max_allocations})" + ("" if passed else " FAILED"))
+    transient_p50 = percentile(transient_bytes, 50) / 1024
+    within = transient_p50 <= max_transient_kb
+    passed = passed and within
+    print(f"Memory allocated per frame after warm up p50 {transient_p50:.0f}KB, "
+        + f"p95 {percentile(transient_bytes, 95) / 1024:.0f}KB "
+        + f"(max p50 {max_transient_kb}KB, not counting the "
+        + f"{session[0][0].nbytes / 1024:.0f}KB grabbed image)"
+        + ("" if within else " FAILED"))
+    return passed
+
+#Modules timed by the imports benchmark
+IMPORT_MODULES = ['environment', 'behavior', 'game_parser', 'controller'
+    , 'render', 'pipeline', 'bot']
+#Modules that need a display and must only be imported when used
+DISPLAY_MODULES = ['pyautogui', 'pynput', 'PIL.ImageGrab']
+#Run in a new process to time importing a module
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds' : time.perf_counter() - start,
+    'display_modules' : [m for m in {display_modules} if m in sys.modules]}}))
+"""
+#Run in a new process to check perception and behaviour work with no display
+HEADLESS_SCRIPT = """
+from environment import Environment, Vector2
+from game_parser import GameParser
+from behavior import Behavior
+from controller import BotController, NullBackend
+from synthetic import SyntheticFrameGenerator
+generator = SyntheticFrameGenerator()
+frame, _, player_bbox = generator.next_frame()
+game_parser = GameParser(5)
+environment = Environment(generator.size)
+game_parser.init(frame, player_bbox)
+for _ in range(3):
+    frame, _, _ = generator.next_frame()
+    game_parser.update(frame, environment)
+    Behavior().action(environment
+        , BotController(Vector2(0, 0), NullBackend(), threaded=False))
+print(len(environment.objects))
+"""
+
+"""Runs python code in a new process with no display. Returns the result"""
+def run_without_display(code):
+    env = dict(os.environ)
+    env.pop('DISPLAY', None)
+    env.pop('WAYLAND_DISPLAY', None)
+    return subprocess.run([sys.executable, '-c', code], env=env
+        , capture_output=True, text=True)
+
+"""
+Times importing each module in a new process with no display and checks
+that none of them import the display modules, then checks that the
+perception and behaviour run with no display
+"""
+def bench_imports(modules=IMPORT_MODULES):
+    passed = True
+    for module in modules:
+        result = run_without_display(IMPORT_SCRIPT.format(module=module
+            , display_modules=DISPLAY_MODULES))
+        if result.returncode != 0:
+            print(f"{module:>12}: import FAILED")
+            print(result.stderr.strip())
+            passed = False
+            continue
+        timing = json.loads(result.stdout.strip().splitlines()[-1])
+        loaded = timing['display_modules']
+        print(f"{module:>12}: {timing['seconds'] * 1000:7.1f}ms"
+            + ("" if len(loaded) == 0 else f" imported {', '.join(loaded)} FAILED"))
+        passed = passed and len(loaded) == 0
+
+    result = run_without_display(HEADLESS_SCRIPT)
+    if result.returncode == 0:
+        print("Perception and behaviour ran with no display")
+    else:
+        print("Perception and behaviour FAILED with no display")
+        print(result.stderr.strip())
+        passed = False
+    return passed
+
+"""
+Starts the perception worker with frames already waiting for it, like when
+the bot sends frames while the worker process is still starting.
+Only the first frame says where the player is, so it must not be lost when
+the worker skips to the newest frame.
+Returns whether every frame was parsed without the worker crashing
+"""
+def bench_worker(frames=30, queued=FRAME_RING_SIZE - 1, timeout=30):
+    generator = SyntheticFrameGenerator(CAPTURE_SIZE)
+    session = [generator.next_frame() for _ in range(frames)]
+    worker = PerceptionWorker(TRACKING_RATE, session[0][2], live=True
+        , max_restarts=0)
+    passed = True
+    #Frames sent back by the worker
+    parsed = 0
+    try:
+        for i, (frame, _, _) in enumerate(session):
+            worker.submit(frame, time.perf_counter())
+            #Let the frames back up before reading any results
+            if i + 1 < queued:
+                continue
+            while worker.in_flight > 0:
+                if worker.receive(timeout) is None:
+                    print(f"No result from the worker in {timeout}s")
+                    passed = False
+                    break
+                parsed += 1
+            if not passed:
+                break
+    except RuntimeError as e:
+        print(e)
+        passed = False
+    finally:
+        worker.stop()
+    print(f"Perception worker parsed {parsed} of {worker.frames_sent} frames, "
+        + f"{worker.frames_skipped} skipped"
+        + ("" if passed else " FAILED"))
+    return passed
+
+
+BENCHMARKS = {
+    'targets' : bench_target_selection,
+    'line_of_sight' : bench_line_of_sight,
+    'avoidance' : bench_avoidance,
+    'detection' : bench_detection,
+    'tracking' : bench_tracking,
+    'replay' : bench_replay,
+    'simulator' : bench_simulator,
+    'allocations' : bench_allocations,
+    'imports' : bench_imports,
+    'worker' : bench_worker,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the bot benchmarks")
+    parser.add_argument('benchmarks', nargs='*'
+        , help="Benchmarks to run. Runs all of them if none are given. "
+        + "Choose from: " + ", ".join(BENCHMARKS))
+    parser.add_argument('--sessions', nargs='+', default=[]
+        , help="Videos of recorded sessions for the replay benchmark")
+    parser.add_argument('--update-baseline', action='store_true'
+        , help="Save the replay results as the new baseline")
+    args = parser.parse_args()
+    #Options given to the benchmarks that take them
+    options = {
+        'replay' : {'sessions' : args.sessions
+            , 'update_baseline' : args.update_baseline}
+    }
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+
+    passed = True
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"Running {name} benchmark")
+        passed = BENCHMARKS[name](**options.get(name, {})) and passed
+    sys.exit(0 if passed else 1)
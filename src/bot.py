@@ -1,18 +1,27 @@
-import cv2
-import math
 import time
-from game_parser import GameParser
-from game_parser import *
-from controller import *
-from config import *
-from pynput import keyboard, mouse
-from environment import *
-from behavior import *
-from render import *
+from game_parser import GameParser, ScreenCapture
+from controller import BotController
+from config import (CAPTURE_SIZE, AUTO_CONFIGURE, ADAPTIVE_ROI, TRACKING_RATE
+    , RENDER_EVERY_N_FRAMES, RECORD_VIDEO_PATH, VIDEO_CODEC, VIDEO_FPS
+    , VIDEO_SCALE, VIDEO_BACKLOG, PIPELINE, CAPTURE_QUEUE_SIZE, FRAME_DEADLINE
+    , DEGRADED_MAX_TRACKERS, PROFILE_FRAMES, PROFILE_OUTPUT_DIR
+    , METRICS_JSONL_PATH, METRICS_PROMETHEUS_PATH, METRICS_EXPORT_INTERVAL
+    , PERCEPTION_PROCESS)
+from environment import Environment, Vector2, BBoxOps
+from behavior import Behavior
+from render import BotRender, Overlay
+from pipeline import BotPipeline, WorkerPipeline
+from budget import FrameBudget
+from metrics import METRICS, MetricsExporter
+from profiler import StageProfiler
+from lifecycle import BotLifecycle
+from buffers import BUFFER_POOL
+from roi import AdaptiveROI
 
 
 HELP_MSG = """Thank you for using this bot. 
-Press 'esc' to quit the bot and 'p' to pause the bot"""
+Press 'esc' to quit the bot and 'p' to pause the bot
+Press 'o' to profile the bot and 'o' again to stop early"""
 
 ################################################################################
 #Bot Classes
@@ -22,94 +31,251 @@ Press 'esc' to quit the bot and 'p' to pause the bot"""
 
 """This is the main bot class"""
 class Bot:
-    def __init__(self, capture_size, display_view = True):
+    """
+    backend is the ControllerBackend used to send inputs to the game
+    If not given the real keyboard and mouse are used
+    screen_cap is where frames come from. If not given the screen is captured
+    If listen_keys is False the keyboard is not listened to
+    """
+    def __init__(self, capture_size, display_view = True, backend = None
+        , screen_cap = None, listen_keys = True):
         self.display_view = display_view
-        self.screen_cap = ScreenCapture(capture_size)
-        self.render = BotRender()
+        if screen_cap is None:
+            screen_cap = ScreenCapture(capture_size)
+        self.screen_cap = screen_cap
+        self.render = BotRender(RENDER_EVERY_N_FRAMES)
+        if display_view and not RECORD_VIDEO_PATH is None:
+            self.render.record(RECORD_VIDEO_PATH, VIDEO_CODEC, VIDEO_FPS
+                , VIDEO_SCALE, VIDEO_BACKLOG)
         self.game_parser = GameParser(TRACKING_RATE)
         self.environment = Environment(capture_size)
         self.behaviour = Behavior()
+        #Region of the view that is captured and parsed
+        self.roi = AdaptiveROI(capture_size) if ADAPTIVE_ROI else None
+        self.budget = FrameBudget(FRAME_DEADLINE, metrics=METRICS)
+        self.exporter = MetricsExporter(METRICS, METRICS_JSONL_PATH
+            , METRICS_PROMETHEUS_PATH, METRICS_EXPORT_INTERVAL)
+        self.profiler = StageProfiler(PROFILE_OUTPUT_DIR)
 
         #Used to pause or quit bot
-        self.playing = True
-        self.paused = True
+        self.lifecycle = BotLifecycle()
+        self.control = None
+        #Where the player was found when configuring
+        self.player_bbox = None
+        #Set while perception runs in another process
+        self.perception_worker = None
 
         #Listener for quitting bot
-        self.keyboard_listener = keyboard.Listener(
-            on_press=self.on_keypress
-        )
-        self.keyboard_listener.start()
-        #Configure bot
-        self.configure()
-        self.control = BotController(
-            Vector2.from_tuple(self.screen_cap.position))
+        self.keyboard_listener = None
+        self.esc_key = None
+        if listen_keys:
+            #Imported here as it needs a display
+            from pynput import keyboard
+            self.esc_key = keyboard.Key.esc
+            self.keyboard_listener = keyboard.Listener(
+                on_press=self.on_keypress
+            )
+            self.keyboard_listener.start()
+        #Configure bot. It starts paused
+        if self.configure():
+            self.control = BotController(
+                Vector2.from_tuple(self.screen_cap.position), backend)
+            self.lifecycle.set_state(BotLifecycle.PAUSED)
+
+    @property
+    def playing(self):
+        return self.lifecycle.playing
+
+    @property
+    def paused(self):
+        return self.lifecycle.paused
 
     """Called by keyboard listener"""
     def on_keypress(self, key):
         try:
-            if key == keyboard.Key.esc:
-                self.playing = False
+            if key == self.esc_key:
+                self.lifecycle.stop()
+                #Stop waiting for the player to be clicked
+                self.screen_cap.cancel_configure()
             elif key.char == 'p':
-                self.paused = not self.paused
+                self.lifecycle.toggle_pause()
+            elif key.char == 'o':
+                self.profiler.toggle(PROFILE_FRAMES)
         except:
             pass
 
-    """Configures the bot"""
+    """
+    Configures the bot
+    Returns False if the bot was quit before it was configured
+    """
     def configure(self):
-        #Configure capture
-        self.screen_cap.configure()
+        start = time.perf_counter()
+        player_bbox = None
+        if AUTO_CONFIGURE:
+            #Find the player without waiting for a click
+            player_bbox = self.screen_cap.auto_configure()
+            if player_bbox is None:
+                print("Could not find the player tank")
+        if player_bbox is None:
+            #Configure capture
+            if not self.screen_cap.configure():
+                return False
+            start = time.perf_counter()
 
         #Get frame and select player
         frame = self.screen_cap.get_frame()
 
         #Get bbox to search player
-        player_search_bbox = BBoxOps.centre_to_bbox(
-            self.screen_cap.get_view_centre(), Vector2(100,100))
+        if player_bbox is None:
+            player_search_bbox = BBoxOps.centre_to_bbox(
+                self.screen_cap.get_view_centre(), Vector2(100,100))
+        else:
+            player_search_bbox = BBoxOps.make_buffer(player_bbox, (10, 10))
 
         #Initialise parser
         self.game_parser.init(frame, player_search_bbox)
+        self.screen_cap.release_frame(frame)
+        self.player_bbox = player_search_bbox
+        print(f"Configured in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return True
+
 
+    """
+    Profiles each stage of the bot over the next given number of frames
+    The stats are dumped to PROFILE_OUTPUT_DIR named with the tag
+    """
+    def profile(self, frames = PROFILE_FRAMES, tag = None):
+        self.profiler.start(frames, tag)
 
-    """Check if the bot is paused"""
+    """Runs a stage of a frame while timing and profiling it"""
+    def run_stage(self, stage, func, *args):
+        with self.profiler.stage(stage):
+            return self.budget.run_stage(stage, func, *args)
+
+    """
+    Check if the bot is paused
+    If it is, sleeps until it is resumed or quit
+    """
     def check_if_paused(self):
         #Pause loop
         if self.paused:
             print("Bot has been paused. Press 'p' to resume")
-            while self.paused and self.playing:
-                pass
-            print("Bot has been unpaused.")
+            if self.lifecycle.wait_until_running():
+                self.resume()
+                print("Bot has been unpaused.")
+
+    """
+    Called when the bot is resumed
+    The game has changed while paused so tracking starts again
+    from where the player was last seen
+    """
+    def resume(self):
+        self.game_parser.reset(self.environment.player.bbox)
+        if not self.perception_worker is None:
+            self.perception_worker.reset(self.environment.player.bbox)
 
 
-    """Lets the bot play"""
-    def play(self):
+    """
+    Lets the bot play
+    If pipeline is true, each stage of the bot runs on its own thread
+    and if PERCEPTION_PROCESS is true, perception runs in another process
+    """
+    def play(self, pipeline = PIPELINE):
+        if not self.playing:
+            self.shutdown()
+            return
         print(HELP_MSG)
-        #Make video writere
-        # output_video = cv2.VideoWriter('output.avi'
-        #     ,cv2.VideoWriter_fourcc('M','J','P','G'), 10
-        #     , CAPTURE_SIZE)
+        if pipeline:
+            pipeline_class = WorkerPipeline if PERCEPTION_PROCESS else BotPipeline
+            pipeline_class(self, CAPTURE_QUEUE_SIZE).run()
+            self.shutdown()
+            return
         while self.playing:
+            self.budget.start_frame()
             #Get the current game frame
-            frame = self.screen_cap.get_frame()
+            capture_time = time.perf_counter()
+            roi_rect = self.get_roi_rect()
+            frame = self.run_stage('capture', self.screen_cap.get_frame, roi_rect)
+            #There are no more frames when replaying
+            if frame is None:
+                self.lifecycle.stop()
+                break
 
             #Update the environment
-            self.game_parser.update(frame, self.environment)
+            self.game_parser.defer_detection = self.budget.is_active(
+                FrameBudget.DEFER_DETECTION)
+            self.run_stage('parse', self.game_parser.update
+                , frame, self.environment, roi_rect)
+
+            #Render if option is true and there is time
+            render = (self.display_view
+                and not self.budget.is_active(FrameBudget.SKIP_RENDER)
+                and not self.budget.overran())
+
+            #Things the bot wants drawn are recorded for the renderer
+            overlay = Overlay() if render else None
 
             #Apply the bot action
-            self.behaviour.action(self.environment, self.control, frame)
+            #When running late the last decision is kept every other frame
+            if (not self.budget.is_active(FrameBudget.REUSE_DECISION)
+                or self.budget.frames % 2 == 0):
+                self.run_stage('behaviour', self.behaviour.action
+                    , self.environment, self.control, overlay)
+                METRICS.record('capture_to_decision'
+                    , time.perf_counter() - capture_time)
+            if not self.roi is None:
+                self.roi.update(self.environment, self.behaviour, self.control)
+
+            #Only keep tracking the most important objects
+            if self.budget.is_active(FrameBudget.DROP_TRACKERS):
+                self.drop_trackers()
 
             #Render view if option is true
-            if self.display_view:
-               self.render.render_view(frame, self.environment)
+            if render:
+               self.run_stage('render', self.render.render_view
+                    , frame, self.environment, overlay)
 
-            #output_video.write(frame)
+            #The renderer has its own copy so the frame can be reused
+            self.screen_cap.release_frame(frame)
+            self.budget.end_frame()
+            self.profiler.end_frame()
+            BUFFER_POOL.end_frame()
+            self.exporter.maybe_export()
 
             #Check if the bot is paused
             self.check_if_paused()
 
-        print(f"Average fps {self.render.get_average_fps()}")
-        #output_video.release()
+        self.shutdown()
+
+    """Returns the region of the view to capture and parse, or None for all of it"""
+    def get_roi_rect(self):
+        if self.roi is None:
+            return None
+        return self.roi.rect
+
+    """Stops tracking all but the DEGRADED_MAX_TRACKERS most important objects"""
+    def drop_trackers(self):
+        tracked_objects = self.game_parser.tracked_objects
+        if tracked_objects is None or len(tracked_objects.objects) <= DEGRADED_MAX_TRACKERS:
+            return
+        targets = self.behaviour.target_manager.selector.top_k(
+            self.environment, DEGRADED_MAX_TRACKERS)
+        tracked_objects.keep(set(o.uid for o, _ in targets))
+
+    """Stops the bot once it has finished playing"""
+    def shutdown(self):
+        #Release all the inputs
+        if not self.control is None:
+            self.control.stop()
+        self.profiler.stop()
+        self.exporter.export()
+        BUFFER_POOL.print_stats()
+        if not self.roi is None:
+            print(f"Average view coverage {self.roi.average_coverage:.2f}")
+        if self.display_view:
+            print(f"Average fps {self.render.get_average_fps()}")
         #Close all windows
-        cv2.destroyAllWindows()
+        self.render.stop()
         print("Bot has shutdown. Goodbye.")
 
 
@@ -0,0 +1,110 @@
+"""
+This file keeps track of how long each frame takes
+and decides what the bot should skip when it is running late
+"""
+import time
+
+
+"""
+Keeps each frame within a deadline
+When a frame runs over, the next degradation in DEGRADATIONS is applied.
+Once frames have been on time for a while the last one is removed
+"""
+class FrameBudget:
+    #Stop rendering the bot view
+    SKIP_RENDER = 'skip_render'
+    #Run full detection less often
+    DEFER_DETECTION = 'defer_detection'
+    #Only keep trackers for the most important objects
+    DROP_TRACKERS = 'drop_trackers'
+    #Only make a new decision every other frame
+    REUSE_DECISION = 'reuse_decision'
+    #The order the degradations are applied in
+    DEGRADATIONS = [SKIP_RENDER, DEFER_DETECTION, DROP_TRACKERS, REUSE_DECISION]
+
+    """
+    deadline is how long a frame can take in seconds
+    recover_frames is how many frames in a row must be on time
+    before a degradation is removed
+    If metrics are given, the stage and frame times are recorded in them
+    """
+    def __init__(self, deadline, recover_frames=30, metrics=None):
+        self.deadline = deadline
+        self.metrics = metrics
+        self.recover_frames = recover_frames
+        #How many of the degradations are applied
+        self.level = 0
+        self.frames = 0
+        self.on_time_frames = 0
+        self.late_frames = 0
+        self.frame_start = None
+        #Time taken by each stage this frame
+        self.stage_times = {}
+
+    """Called at the start of every frame"""
+    def start_frame(self):
+        self.frames += 1
+        self.frame_start = time.perf_counter()
+        self.stage_times = {}
+
+    """Returns how long the current frame has taken in seconds"""
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.frame_start
+
+    """Returns whether the current frame is past its deadline"""
+    def overran(self):
+        return self.elapsed > self.deadline
+
+    """Records how long a stage took this frame"""
+    def add_stage_time(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0) + seconds
+        if not self.metrics is None:
+            self.metrics.record(stage, seconds)
+
+    """
+    Runs a function as a stage of the frame and records its time
+    Returns what the function returns
+    """
+    def run_stage(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        self.add_stage_time(stage, time.perf_counter() - start)
+        return result
+
+    """Returns whether the degradation is being applied"""
+    def is_active(self, degradation):
+        return FrameBudget.DEGRADATIONS.index(degradation) < self.level
+
+    """
+    Called at the end of every frame
+    Applies or removes degradations based on how long it took
+    """
+    def end_frame(self):
+        elapsed = self.elapsed
+        if not self.metrics is None:
+            self.metrics.record('frame', elapsed)
+            self.metrics.count('frames')
+        if elapsed > self.deadline:
+            if not self.metrics is None:
+                self.metrics.count('late_frames')
+            self.late_frames += 1
+            self.on_time_frames = 0
+            if self.level < len(FrameBudget.DEGRADATIONS):
+                #Blame the slowest stage
+                reason = f"frame took {elapsed * 1000:.1f}ms"
+                if len(self.stage_times) > 0:
+                    stage = max(self.stage_times, key=self.stage_times.get)
+                    reason += (f", {stage} took "
+                        + f"{self.stage_times[stage] * 1000:.1f}ms")
+                self.level += 1
+                print("Frame budget: applying "
+                    + f"{FrameBudget.DEGRADATIONS[self.level - 1]} ({reason})")
+        else:
+            self.on_time_frames += 1
+            if self.level > 0 and self.on_time_frames >= self.recover_frames:
+                self.level -= 1
+                self.on_time_frames = 0
+                print("Frame budget: removing "
+                    + f"{FrameBudget.DEGRADATIONS[self.level]} "
+                    + f"({self.recover_frames} frames on time)")
@@ -0,0 +1,200 @@
+"""
+This file stores preallocated numpy buffers that are reused every frame
+so the bot does not allocate new frames and scratch images each tick
+"""
+import threading
+from collections import deque
+import numpy as np
+from metrics import METRICS
+
+
+"""
+Lends out scratch buffers and takes them back to be reused
+Each buffer is a flat block of memory so any shape that fits can be
+borrowed from it. A new block is only allocated when none are free
+that are big enough
+"""
+class BufferPool:
+    """max_free is the most unused blocks kept"""
+    def __init__(self, max_free=16, window=100):
+        self.max_free = max_free
+        #Unused blocks from smallest to largest
+        self.free = []
+        #Maps id of a lent out array to its block
+        self.lent = {}
+        self.lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+        self.frames = 0
+        #Allocations made this frame
+        self.frame_allocations = 0
+        #Allocations made in each recent frame
+        self.recent_allocations = deque(maxlen=window)
+
+    """Records that a block of memory was allocated"""
+    def count_allocation(self):
+        with self.lock:
+            self.allocations += 1
+            self.frame_allocations += 1
+        METRICS.count('buffer_allocations')
+
+    """
+    Returns an array of the shape and type to use
+    Its contents are whatever was left in it
+    release must be called when done with it
+    """
+    def acquire(self, shape, dtype=np.uint8):
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        block = None
+        with self.lock:
+            for i, free_block in enumerate(self.free):
+                if free_block.nbytes >= nbytes:
+                    block = self.free.pop(i)
+                    self.reuses += 1
+                    break
+        if block is None:
+            block = np.empty(nbytes, dtype=np.uint8)
+            self.count_allocation()
+        #A view of the start of the block is contiguous so OpenCV
+        #can write to it with dst=
+        array = block[:nbytes].view(dtype).reshape(shape)
+        with self.lock:
+            self.lent[id(array)] = block
+        return array
+
+    """Gives back an array from acquire"""
+    def release(self, array):
+        with self.lock:
+            block = self.lent.pop(id(array), None)
+            if block is None:
+                return
+            self.free.append(block)
+            self.free.sort(key=lambda b: b.nbytes)
+            #Drop the smallest blocks if too many are unused
+            if len(self.free) > self.max_free:
+                self.free.pop(0)
+
+    """
+    Returns a context manager that lends an array for its block
+    Use as: with pool.borrow(shape) as array:
+    """
+    def borrow(self, shape, dtype=np.uint8):
+        return BorrowedBuffer(self, shape, dtype)
+
+    """Called at the end of every frame to record its allocations"""
+    def end_frame(self):
+        with self.lock:
+            self.frames += 1
+            self.recent_allocations.append(self.frame_allocations)
+            self.frame_allocations = 0
+
+    """
+    Drops the unused blocks and clears the counts
+    Arrays still lent out can be given back as normal
+    """
+    def reset(self):
+        with self.lock:
+            self.free = []
+            self.allocations = 0
+            self.reuses = 0
+            self.frames = 0
+            self.frame_allocations = 0
+            self.recent_allocations.clear()
+
+    """Returns the average allocations of the recent frames"""
+    @property
+    def allocations_per_frame(self):
+        with self.lock:
+            if len(self.recent_allocations) == 0:
+                return 0
+            return sum(self.recent_allocations) / len(self.recent_allocations)
+
+    """Prints how many buffers have been allocated and reused"""
+    def print_stats(self):
+        print(f"Buffer pool: {self.allocations} allocations, {self.reuses} reuses "
+            + f"over {self.frames} frames, {self.allocations_per_frame:.2f} "
+            + "allocations per recent frame")
+
+
+"""Lends an array from a BufferPool for a block of code"""
+class BorrowedBuffer:
+    def __init__(self, pool, shape, dtype):
+        self.pool = pool
+        self.shape = shape
+        self.dtype = dtype
+        self.array = None
+
+    def __enter__(self):
+        self.array = self.pool.acquire(self.shape, self.dtype)
+        return self.array
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.array)
+        return False
+
+
+"""
+Frame buffers that are reused once they are given back
+next hands out a free frame, or makes a new one if they are all in use,
+and release gives it back once the bot is done with it
+"""
+class FrameRing:
+    """
+    size is how many frames are kept for reuse
+    Allocations are counted in the pool if given
+    """
+    def __init__(self, size, pool=None):
+        self.size = size
+        self.slots = []
+        #Whether each frame has been handed out and not given back
+        self.in_use = []
+        self.lock = threading.Lock()
+        self.pool = pool
+
+    """
+    Returns a free frame buffer of the shape
+    Its contents are whatever was left in it
+    """
+    def next(self, shape, dtype=np.uint8):
+        dtype = np.dtype(dtype)
+        with self.lock:
+            free = [i for i, in_use in enumerate(self.in_use) if not in_use]
+            for i in free:
+                slot = self.slots[i]
+                if slot.shape == shape and slot.dtype == dtype:
+                    self.in_use[i] = True
+                    return slot
+            slot = np.empty(shape, dtype=dtype)
+            if len(free) > 0:
+                #Replace a free frame of the wrong shape
+                self.slots[free[0]] = slot
+                self.in_use[free[0]] = True
+            else:
+                #Every frame is in use so make another
+                self.slots.append(slot)
+                self.in_use.append(True)
+        if not self.pool is None:
+            self.pool.count_allocation()
+        return slot
+
+    """
+    Gives back a frame from next so it can be reused
+    Frames that did not come from next are ignored
+    """
+    def release(self, frame):
+        with self.lock:
+            for i, slot in enumerate(self.slots):
+                if slot is frame:
+                    break
+            else:
+                return
+            self.in_use[i] = False
+            #Only keep size frames once the extra ones are free
+            if len(self.slots) > self.size:
+                del self.slots[i]
+                del self.in_use[i]
+
+
+#The buffers used by the bot
+BUFFER_POOL = BufferPool()
@@ -1,6 +1,8 @@
 """
 This is the configurations file
 """
+import json
+import os
 
 ################################################################################
 #Bot Parameters
@@ -8,13 +10,119 @@ This is the configurations file
 
 #This is the minimum area an object must be for the bot to notice
 CAPTURE_SIZE = (800,400)
+#Whether to find the player tank on the screen at startup
+#instead of waiting for it to be clicked
+#Falls back to clicking if the player cannot be found
+AUTO_CONFIGURE = True
+
+#Whether only the part of the view around the player is captured and parsed
+#The part grows with the player's speed, the target and nearby objects
+ADAPTIVE_ROI = False
+#The smallest part of the view used
+ROI_MIN_SIZE = (400,200)
+#Space left around the objects the part covers
+ROI_MARGIN = 60
+#Objects closer to the player than this are always covered
+ROI_THREAT_RADIUS = 200
+#How many frames of player movement the part leaves room for
+ROI_SPEED_LOOKAHEAD = 10
+#With this many objects the whole view is used
+ROI_DENSE_OBJECTS = 8
+#How much of the way to its new size the part shrinks each frame
+ROI_SHRINK_RATE = 0.05
+#The whole view is used every this many frames so new objects are found
+ROI_FULL_SCAN_INTERVAL = 30
 
 #This is the minimum area of the object that the bot will detect
 #Any object with an area smaller than this, the bot will ignore
 MIN_OBJECT_AREA = 500
 
+#The low and high thresholds of the Canny edge detector used to find objects
+#Lower thresholds find fainter edges but also more noise
+CANNY_THRESHOLDS = (100, 200)
+
 #This is the rate at which the bot run object tracking rather than detection
 #Detection is expensive so tracking is preferred
 #Higher TRACKING RATE means better fps on video
 #But lower bot performance (It doesnt see new objects as fast)
 TRACKING_RATE = 15
+
+#Settings written by tuner.py for this machine, kept next to this file
+#If the file exists its settings replace the four above
+PERCEPTION_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__))
+    , 'perception_profile.json')
+#Setting this environment variable to 0 ignores the profile
+#The benchmarks do this so their results do not depend on it
+PERCEPTION_PROFILE_ENV = 'USE_PERCEPTION_PROFILE'
+
+"""
+Replaces the perception settings with the ones in the profile if there is one
+Returns whether the profile was used
+"""
+def load_perception_profile(path=PERCEPTION_PROFILE_PATH):
+    global CAPTURE_SIZE, MIN_OBJECT_AREA, TRACKING_RATE, CANNY_THRESHOLDS
+    if os.environ.get(PERCEPTION_PROFILE_ENV) == '0' or not os.path.exists(path):
+        return False
+    with open(path) as f:
+        profile = json.load(f)
+    CAPTURE_SIZE = tuple(profile['capture_size'])
+    MIN_OBJECT_AREA = profile['min_object_area']
+    TRACKING_RATE = profile['tracking_rate']
+    CANNY_THRESHOLDS = tuple(profile['canny_thresholds'])
+    print(f"Using the perception settings in {path}: "
+        + f"CAPTURE_SIZE {CAPTURE_SIZE}, MIN_OBJECT_AREA {MIN_OBJECT_AREA}, "
+        + f"TRACKING_RATE {TRACKING_RATE}, CANNY_THRESHOLDS {CANNY_THRESHOLDS}")
+    return True
+
+load_perception_profile()
+
+#The bot view is only rendered every this many frames
+#Rendering is done on its own thread and frames are skipped
+#if it falls behind
+RENDER_EVERY_N_FRAMES = 1
+
+#If set, the rendered bot view is recorded to this video file
+#Encoding is done on its own thread so it does not slow the bot down
+RECORD_VIDEO_PATH = None
+#Four character code of the codec used to record
+VIDEO_CODEC = 'MJPG'
+VIDEO_FPS = 10
+#How much the recorded frames are resized by
+VIDEO_SCALE = 1.0
+#How many frames can wait to be encoded before frames are dropped
+VIDEO_BACKLOG = 30
+
+#If true, capture, perception and decision each run on their own thread
+#This gives better fps on machines with more cores
+PIPELINE = False
+#How many captured frames can wait for perception
+#The oldest frames are dropped when it is full
+CAPTURE_QUEUE_SIZE = 1
+#How many captured frames are kept for their memory to be reused
+#A frame is only reused once the bot gives it back, and more are made
+#if they are all in use
+FRAME_RING_SIZE = 8
+#If true and the pipeline is used, detection and tracking run in
+#another process and frames are passed to it through shared memory
+PERCEPTION_PROCESS = False
+#How many times the perception process is started again after crashing
+PERCEPTION_MAX_RESTARTS = 3
+
+#How long each frame should take in seconds
+#When frames take longer, the bot skips work in this order:
+#rendering, detection, tracking unimportant objects, making decisions
+FRAME_DEADLINE = 0.033
+#How many objects are still tracked when the bot is running late
+DEGRADED_MAX_TRACKERS = 10
+
+#Timings of each part of the bot and counts of what it has done
+#are written to these files every METRICS_EXPORT_INTERVAL seconds
+#Set a path to None to not write that file
+METRICS_JSONL_PATH = None
+METRICS_PROMETHEUS_PATH = None
+METRICS_EXPORT_INTERVAL = 5.0
+
+#How many frames are profiled when 'o' is pressed
+PROFILE_FRAMES = 300
+#Where the profile stats of each stage are written
+PROFILE_OUTPUT_DIR = '.'
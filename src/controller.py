@@ -2,24 +2,323 @@
 import math
 import threading
 import time
-import pyautogui
-from pynput import keyboard, mouse
 from environment import *
+from metrics import METRICS
 
 
-"""This class is used by the bot to control the game"""
+#How long the shoot button is held after the last shoot command in seconds
+SHOOT_HOLD_TIME = 0.1
+
+
+"""
+Stores the commands waiting to be sent to the game
+Only the latest command of each kind is kept
+so commands that have been replaced are never sent
+"""
+class CommandQueue:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.commands = {}
+        self.closed = False
+
+    """
+    Adds a command, replacing any waiting command of the same kind
+    The time the command was given is stored with it
+    """
+    def put(self, kind, value):
+        with self.condition:
+            self.commands[kind] = (value, time.perf_counter())
+            self.condition.notify()
+
+    """
+    Waits until there are commands or the timeout passes
+    and returns all the waiting commands as a dictionary
+    of kind to (value, time given)
+    Returns None once the queue has been closed
+    """
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.commands and not self.closed:
+                self.condition.wait(timeout)
+            if self.closed:
+                return None
+            commands = self.commands
+            self.commands = {}
+            return commands
+
+    """Stops the queue"""
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+"""
+Sends inputs to the game
+This is to be overridden
+"""
+class ControllerBackend:
+    """Presses a keyboard key"""
+    def press_key(self, key):
+        pass
+
+    """Releases a keyboard key"""
+    def release_key(self, key):
+        pass
+
+    """Moves the mouse to the position on the screen"""
+    def move_mouse(self, pos):
+        pass
+
+    """Presses the left mouse button"""
+    def press_mouse(self):
+        pass
+
+    """Releases the left mouse button"""
+    def release_mouse(self):
+        pass
+
+    """Returns the mouse position on the screen as a tuple"""
+    def get_mouse_pos(self):
+        return (0, 0)
+
+    """
+    Called by the actuator before it carries out a command
+    issued_time is the time.perf_counter() when the bot gave the command
+    """
+    def on_command(self, kind, value, issued_time):
+        pass
+
+
+"""Sends inputs to the game using the real keyboard and mouse"""
+class PynputBackend(ControllerBackend):
+    def __init__(self):
+        #Imported here as these need a display
+        import pyautogui
+        from pynput import keyboard, mouse
+        self.pyautogui = pyautogui
+        self.left_button = mouse.Button.left
+        self.keyboard = keyboard.Controller()
+        self.mouse = mouse.Controller()
+
+    """Overrides"""
+    def press_key(self, key):
+        self.keyboard.press(key)
+
+    """Overrides"""
+    def release_key(self, key):
+        self.keyboard.release(key)
+
+    """Overrides"""
+    def move_mouse(self, pos):
+        self.mouse.position = pos
+
+    """Overrides"""
+    def press_mouse(self):
+        self.mouse.press(self.left_button)
+
+    """Overrides"""
+    def release_mouse(self):
+        self.mouse.release(self.left_button)
+
+    """Overrides"""
+    def get_mouse_pos(self):
+        return self.pyautogui.position()
+
+
+"""Sends no inputs. Used to run the bot without a display"""
+class NullBackend(ControllerBackend):
+    def __init__(self):
+        self.mouse_pos = (0, 0)
+
+    """Overrides"""
+    def move_mouse(self, pos):
+        self.mouse_pos = pos
+
+    """Overrides"""
+    def get_mouse_pos(self):
+        return self.mouse_pos
+
+
+"""
+Sends no inputs but records every command and input with timestamps
+Used to measure how long commands take to be carried out
+"""
+class RecordingBackend(NullBackend):
+    def __init__(self):
+        super().__init__()
+        #Stores (kind, value, issued time, actuated time)
+        self.commands = []
+        #Stores (time, input, value)
+        self.inputs = []
+        self.lock = threading.Lock()
+
+    """Records an input"""
+    def record_input(self, name, value=None):
+        with self.lock:
+            self.inputs.append((time.perf_counter(), name, value))
+
+    """Overrides"""
+    def on_command(self, kind, value, issued_time):
+        with self.lock:
+            self.commands.append((kind, value, issued_time, time.perf_counter()))
+
+    """Overrides"""
+    def press_key(self, key):
+        self.record_input('press_key', key)
+
+    """Overrides"""
+    def release_key(self, key):
+        self.record_input('release_key', key)
+
+    """Overrides"""
+    def move_mouse(self, pos):
+        super().move_mouse(pos)
+        self.record_input('move_mouse', pos)
+
+    """Overrides"""
+    def press_mouse(self):
+        self.record_input('press_mouse')
+
+    """Overrides"""
+    def release_mouse(self):
+        self.record_input('release_mouse')
+
+    """Removes everything recorded"""
+    def clear(self):
+        with self.lock:
+            self.commands = []
+            self.inputs = []
+
+    """
+    Returns a dictionary with the number of commands of each kind,
+    how many were carried out per second and the latency percentiles
+    from the bot giving a command to it being carried out in seconds
+    """
+    def summary(self):
+        with self.lock:
+            commands = list(self.commands)
+            inputs = list(self.inputs)
+        summary = {'commands' : len(commands), 'inputs' : len(inputs)}
+        if len(commands) == 0:
+            return summary
+        duration = max(commands[-1][3] - commands[0][2], 1e-9)
+        for kind in sorted(set(c[0] for c in commands)):
+            count = sum(1 for c in commands if c[0] == kind)
+            summary[kind] = {'count' : count, 'rate' : count / duration}
+        latencies = sorted(c[3] - c[2] for c in commands)
+        for percentile in (50, 95, 99):
+            index = min(len(latencies) * percentile // 100, len(latencies) - 1)
+            summary[f'latency_p{percentile}'] = latencies[index]
+        return summary
+
+
+"""
+This class is used by the bot to control the game
+All the inputs are sent by a single actuator thread so calls return
+immediately
+"""
 class BotController:
     """
     Origin is the point (0,0) of the screen capture 
     relative to the actual screen
+    backend is the ControllerBackend that sends the inputs
+    If not given the real keyboard and mouse are used
+    If threaded is False, commands are carried out straight away
+    by the thread that gives them. Used when simulating the game
     """
-    def __init__(self, origin):
+    def __init__(self, origin, backend=None, threaded=True):
         self.origin = origin
-        self.keyboard = keyboard.Controller()
-        self.mouse = mouse.Controller()
+        if backend is None:
+            backend = PynputBackend()
+        self.backend = backend
         #Stores current move direction
         self.move_direction = Vector2(0,0)
+        #Keys pressed by the actuator
         self.pressed_keys = {}
+        #Where the actuator last put the mouse
+        self.aim_pos = None
+        #When the shoot button should be released
+        #None if it is not pressed
+        self.shoot_release_time = None
+
+        self.threaded = threaded
+        self.commands = CommandQueue()
+        self.actuator = None
+        if threaded:
+            self.actuator = threading.Thread(target=self.run_actuator
+                , daemon=True)
+            self.actuator.start()
+
+    """Sends the commands to the game until the controller is stopped"""
+    def run_actuator(self):
+        while True:
+            timeout = None
+            if not self.shoot_release_time is None:
+                timeout = max(self.shoot_release_time - time.perf_counter(), 0)
+            commands = self.commands.get(timeout)
+            if commands is None:
+                break
+
+            #Commands are carried out in this order
+            with METRICS.span('actuation'):
+                for kind in ('keys', 'aim', 'shoot'):
+                    if kind in commands:
+                        value, issued_time = commands[kind]
+                        self.backend.on_command(kind, value, issued_time)
+                        self.actuate(kind, value, issued_time)
+
+            #Release the shoot button when it is due
+            if (not self.shoot_release_time is None
+                and time.perf_counter() >= self.shoot_release_time):
+                self.backend.release_mouse()
+                self.shoot_release_time = None
+
+        #Let go of everything
+        self.actuate_keys(())
+        if not self.shoot_release_time is None:
+            self.backend.release_mouse()
+            self.shoot_release_time = None
+
+    """Called by the actuator to carry out a command"""
+    def actuate(self, kind, value, issued_time):
+        if kind == 'keys':
+            self.actuate_keys(value)
+        elif kind == 'aim' and value != self.aim_pos:
+            self.aim_pos = value
+            self.backend.move_mouse(value)
+        elif kind == 'shoot':
+            if self.shoot_release_time is None:
+                self.backend.press_mouse()
+            #Keep holding while shoot commands keep coming
+            self.shoot_release_time = issued_time + SHOOT_HOLD_TIME
+
+    """
+    Gives a command to the actuator
+    When not threaded it is carried out now
+    """
+    def send(self, kind, value):
+        if self.threaded:
+            self.commands.put(kind, value)
+            return
+        issued_time = time.perf_counter()
+        if (not self.shoot_release_time is None
+            and issued_time >= self.shoot_release_time):
+            self.backend.release_mouse()
+            self.shoot_release_time = None
+        self.backend.on_command(kind, value, issued_time)
+        self.actuate(kind, value, issued_time)
+
+    """Stops the actuator and releases all the keys"""
+    def stop(self):
+        self.commands.close()
+        if self.threaded:
+            self.actuator.join()
+            return
+        self.actuate_keys(())
+        if not self.shoot_release_time is None:
+            self.backend.release_mouse()
+            self.shoot_release_time = None
 
     """
     Given the player position relative to the screen capture
@@ -27,53 +326,64 @@ class BotController:
     """
     def move(self, direction : Vector2):
         if direction.normalize() != self.move_direction:
-            #Release all pressed keys
-            for key in self.pressed_keys:
-                self.keyboard.release(key)
-
             #Move in a new direction
             self.move_direction = direction.normalize()
+            self.press_keys(BotController.direction_to_keys(self.move_direction))
+
+    """
+    Presses the given movement keys and releases the rest
+    keys is a tuple of the keys 'w', 'a', 's' and 'd'
+    """
+    def press_keys(self, keys):
+        self.send('keys', tuple(keys))
+
+    """Called by the actuator to press and release the keys that changed"""
+    def actuate_keys(self, keys):
+        #Release keys no longer needed
+        for key in list(self.pressed_keys):
+            if not key in keys:
+                self.backend.release_key(key)
+                del self.pressed_keys[key]
+        #Press the new keys
+        for key in keys:
+            if not key in self.pressed_keys:
+                self.backend.press_key(key)
+                self.pressed_keys[key] = True
+
+    """Returns the movement keys that move closest to the direction"""
+    @staticmethod
+    def direction_to_keys(direction):
+        direction = direction.normalize()
+        keys = []
+        #If direction is Vector2(0,0) dont move
+        if direction.length == 0:
+            return tuple(keys)
+
+        #Move in x direction
+        if direction.x > math.cos(3 * math.pi / 8):
+            keys.append('d')
+        elif direction.x < math.cos(5 * math.pi / 8):
+            keys.append('a')
+
+        #Move in y direction
+        if direction.y > math.sin(math.pi / 8):
+            keys.append('s')
+        elif direction.y < math.sin(math.pi / -8):
+            keys.append('w')
+        return tuple(keys)
 
-            #If direction is Vector2(0,0) dont move
-            if self.move_direction.length == 0:
-                return
-
-            #Move in x direction
-            if self.move_direction.x > math.cos(3 * math.pi / 8):
-                self.keyboard.press('d')
-                self.pressed_keys['d'] = True
-            elif self.move_direction.x < math.cos(5 * math.pi / 8):
-                self.keyboard.press('a')
-                self.pressed_keys['a'] = True
-
-            #Move in y direction
-            if self.move_direction.y > math.sin(math.pi / 8):
-                self.keyboard.press('s')
-                self.pressed_keys['s'] = True
-            elif self.move_direction.y < math.sin(math.pi / -8):
-                self.keyboard.press('w')
-                self.pressed_keys['w'] = True
-    
     """
     Shoot in a given direction. If player_pos is passed in
     it will shoot with greater accuracy
     """
     def shoot(self, shoot_pos):
         pos_on_screen = self.origin + shoot_pos
-        self.mouse.position = pos_on_screen.to_tuple()
-        self.mouse.press(mouse.Button.left)
-        #Make thread to release
-        threading.Thread(target=self.release_shoot, args=(0.1,)).start()
-        
-
-    """Release shoot button after delay"""
-    def release_shoot(self, wait_time):
-        time.sleep(wait_time)
-        self.mouse.release(mouse.Button.left)
+        self.send('aim', pos_on_screen.to_tuple())
+        self.send('shoot', True)
 
     """Returns the mouse position relative to the origin"""
     def get_mouse_pos(self):
-        x, y = pyautogui.position()
+        x, y = self.backend.get_mouse_pos()
         return Vector2(x - self.origin.x, y - self.origin.y)
 
 
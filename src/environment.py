@@ -1,8 +1,12 @@
 """
 This file has the all the environment specific classes
 """
+import itertools
 import math
-import cv2
+import numpy as np
+
+#How much of the old velocity is kept when an object moves
+VELOCITY_SMOOTHING = 0.5
 
 """Every game object is stored in this"""
 class GameObject:
@@ -13,17 +17,52 @@ class GameObject:
     PLAYER = 'Player'
     ENEMY = 'Enemy'
     ALLY = 'ALLY'
+    #Every type in the order they are numbered when stored in arrays
+    TYPES = [UNKNOWN, TRIANGLE, SQUARE, PENTAGON, PLAYER, ENEMY, ALLY]
+    #Used to give every game object a unique id
+    ids = itertools.count()
     def __init__(self, bbox, object_type, distance = None):
         self.bbox = bbox
         self.type = object_type
         self.distance = distance
+        #Identifies the object across frames
+        #Kept when the object is tracked or redetected
+        self.uid = next(GameObject.ids)
         #Stores whether the game object has still been tracked
         self.is_tracked = False
+        #Estimated movement of the object in pixels per frame
+        self.velocity = (0, 0)
 
     @property
     def centre(self):
         return BBoxOps.bbox_centre(self.bbox)
 
+    """
+    Moves the object to the new bbox
+    and updates the estimate of its velocity
+    """
+    def move_to(self, bbox):
+        old_x, old_y = self.bbox[0] + self.bbox[2]/2, self.bbox[1] + self.bbox[3]/2
+        new_x, new_y = bbox[0] + bbox[2]/2, bbox[1] + bbox[3]/2
+        self.velocity = (
+            VELOCITY_SMOOTHING * self.velocity[0]
+                + (1 - VELOCITY_SMOOTHING) * (new_x - old_x),
+            VELOCITY_SMOOTHING * self.velocity[1]
+                + (1 - VELOCITY_SMOOTHING) * (new_y - old_y)
+        )
+        self.bbox = bbox
+
+    """
+    Returns a copy of the game object
+    The copy keeps the uid so it is treated as the same object
+    """
+    def copy(self):
+        new_obj = GameObject(tuple(self.bbox), self.type, self.distance)
+        new_obj.uid = self.uid
+        new_obj.is_tracked = self.is_tracked
+        new_obj.velocity = self.velocity
+        return new_obj
+
     @staticmethod
     def make_player(bbox):
         return GameObject(bbox, GameObject.PLAYER)
@@ -50,6 +89,9 @@ class Environment:
         #Stores whether the collisions have been calculated
         #For the frame
         self.has_calculated_collisions = False
+        #Stores the obstacle distance field for the frame
+        #It is calculated by the navigation engine when needed
+        self.distance_field = None
         #Stores the game frame
         self.frame = None
 
@@ -71,10 +113,57 @@ class Environment:
         self.__player = value
         self.reset_collisions()
 
+    """
+    Makes this environment a copy of the given environment
+    The game objects are copied so changing them does not change this one
+    """
+    def copy_from(self, environment):
+        self.size = environment.size
+        self.player = None if environment.player is None else environment.player.copy()
+        self.objects = [o.copy() for o in environment.objects]
+        self.frame = environment.frame
+
+    """
+    Returns the player and objects as one float array with a row
+    per object and the player first, so the environment can be sent
+    to another process cheaply. Rows are (x, y, w, h, type number,
+    uid, velocity x, velocity y, is tracked). A missing player is all -1
+    """
+    def to_array(self):
+        array = np.empty((len(self.objects) + 1, 9))
+        for row, obj in zip(array, [self.player] + self.objects):
+            if obj is None:
+                row[:] = -1
+                continue
+            row[:4] = obj.bbox
+            row[4] = (GameObject.TYPES.index(obj.type)
+                if obj.type in GameObject.TYPES else 0)
+            row[5] = obj.uid
+            row[6:8] = obj.velocity
+            row[8] = obj.is_tracked
+        return array
+
+    """Sets the player and objects from an array made by to_array"""
+    def load_array(self, array):
+        objects = []
+        for row in array.tolist():
+            if row[4] < 0:
+                objects.append(None)
+                continue
+            obj = GameObject(tuple(row[:4]), GameObject.TYPES[int(row[4])])
+            #Keep the uid so the object is treated as the same one
+            obj.uid = int(row[5])
+            obj.velocity = (row[6], row[7])
+            obj.is_tracked = bool(row[8])
+            objects.append(obj)
+        self.player = objects[0]
+        self.objects = objects[1:]
+
     """Resets the collisions in the environment"""
     def reset_collisions(self):
         self.collisions = []
         self.has_calculated_collisions = False
+        self.distance_field = None
 
 
 """Represents a vector"""
@@ -291,6 +380,22 @@ class Circle:
         #the circle intersects
         return closest_point.distance_to_squared(self.centre) < self.radius * self.radius
 
+    """
+    Vectorised version of intersects_rect
+    Given an (N, 4) array of bboxes in form (x,y,w,h)
+    return a boolean array of which ones intersect the circle
+    """
+    def intersects_rects(self, rects):
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        #Clamp the centre into every rect at once
+        closest_x = np.maximum(rects[:, 0]
+            , np.minimum(self.centre.x, rects[:, 0] + rects[:, 2]))
+        closest_y = np.maximum(rects[:, 1]
+            , np.minimum(self.centre.y, rects[:, 1] + rects[:, 3]))
+        dist_squared = ((closest_x - self.centre.x) ** 2
+            + (closest_y - self.centre.y) ** 2)
+        return dist_squared < self.radius * self.radius
+
 
 """Class responsible for BBox operations"""
 class BBoxOps:
@@ -302,6 +407,21 @@ class BBoxOps:
     def bbox_centre(bbox):
         return Vector2(bbox[0] + bbox[2]/2, bbox[1] + bbox[3]/2)
 
+    """
+    Given a list of bboxes (x,y,w,h) return them as an (N, 4) float array
+    """
+    @staticmethod
+    def to_array(bboxes):
+        return np.asarray([tuple(b) for b in bboxes]
+            , dtype=np.float64).reshape(-1, 4)
+
+    """
+    Given an (N, 4) array of bboxes return an (N, 2) array of their centres
+    """
+    @staticmethod
+    def bbox_centres(bboxes):
+        return bboxes[:, :2] + bboxes[:, 2:] / 2
+
     """
     Given a bbox (x,y,w,h) return it in the form
     (x1, y1, x2, y2)
@@ -391,3 +511,31 @@ class BBoxOps:
         elif in_segment.p.inside_rect(rect) and in_segment.q.inside_rect(rect):
             return True
         return False
+
+    """
+    Vectorised version of intersects_rect for many segments and rects
+    Given (M, 2) arrays of segment start and end points and an (N, 4)
+    array of bboxes (x,y,w,h), return a boolean array of which segments
+    intersect which bboxes. It has shape (len(starts), len(rects))
+    with a row for each segment and a column for each bbox
+    """
+    @staticmethod
+    def segments_intersect_rects(starts, ends, rects):
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        #Separating axis test between each segment and rect using
+        #their centres and half sizes. Segments are rows, rects are columns
+        half_x = ((ends[:, 0] - starts[:, 0]) / 2)[:, None]
+        half_y = ((ends[:, 1] - starts[:, 1]) / 2)[:, None]
+        extent_x = rects[:, 2] / 2
+        extent_y = rects[:, 3] / 2
+        dist_x = (starts[:, 0, None] + half_x) - (rects[:, 0] + extent_x)
+        dist_y = (starts[:, 1, None] + half_y) - (rects[:, 1] + extent_y)
+        abs_x = np.abs(half_x)
+        abs_y = np.abs(half_y)
+        #Separated along the x axis, the y axis or the segment's normal
+        return ((np.abs(dist_x) <= extent_x + abs_x)
+            & (np.abs(dist_y) <= extent_y + abs_y)
+            & (np.abs(dist_x * half_y - dist_y * half_x)
+                <= extent_x * abs_y + extent_y * abs_x))
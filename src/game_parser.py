@@ -1,22 +1,36 @@
 """This file parses the game by analysing it each frame"""
 
 import cv2
+import math
+import threading
 import time
 import numpy as np
-import pyautogui
-from pynput import mouse
-from PIL import ImageGrab
 from environment import *
 from config import *
-from render import BotRender
+from metrics import METRICS
+from buffers import BUFFER_POOL, FrameRing
 
 """This class captures the screen"""
 class ScreenCapture:
+    #Frames show the game as it is now so old ones can be dropped
+    live = True
+
     def __init__(self, size):
         self.mouse_listener = None
         self.centre = None
         self.size = size
         self.rect = None
+        #The game view on the screen as (x1, y1, x2, y2) if it has been found
+        #The capture is kept inside it
+        self.view_rect = None
+        #Set when the player has been clicked or configuring is cancelled
+        self.configured = threading.Event()
+        self.cancelled = False
+        #Captured frames are written into these buffers in turn
+        self.frame_ring = FrameRing(FRAME_RING_SIZE, BUFFER_POOL)
+        #Imported when first needed as these need a display
+        self.image_grab = None
+        self.left_button = None
 
     """Return the centre position vector relative to the captured screen"""
     def get_view_centre(self):
@@ -32,46 +46,128 @@ class ScreenCapture:
             return None
         return (self.rect[0], self.rect[1])
 
-    """Gets the frame for the screen capture"""
-    def get_frame(self):
+    """Grabs the part of the screen in the bbox, or all of it if not given"""
+    def grab(self, bbox=None):
+        if self.image_grab is None:
+            from PIL import ImageGrab
+            self.image_grab = ImageGrab
+        return np.asarray(self.image_grab.grab(bbox))
+
+    """
+    Gets the frame for the screen capture
+    If roi is given as (x, y, w, h) in the frame, only that part is grabbed
+    and the rest of the frame is filled with the background colour
+    """
+    def get_frame(self, roi=None):
         rect = self.get_rect()
         if rect == None:
             return None
-        #Grab image
-        pil_img = ImageGrab.grab(rect)
-        #Convert to numpy array
-        frame = cv2.cvtColor(np.asarray(pil_img), cv2.COLOR_BGR2RGB)
+        if not roi is None:
+            return self.get_roi_frame(rect, roi)
+        #Grab image as a numpy array
+        #PIL always makes a new image so only the converted frame is reused
+        image = self.grab(rect)
+        frame = self.frame_ring.next(image.shape)
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=frame)
+        return frame
+
+    """Grabs part of the view into a full sized frame"""
+    def get_roi_frame(self, rect, roi):
+        x, y, w, h = roi
+        image = self.grab((rect[0] + x, rect[1] + y
+            , rect[0] + x + w, rect[1] + y + h))
+        frame = self.frame_ring.next((int(rect[3] - rect[1])
+            , int(rect[2] - rect[0]), image.shape[2]))
+        frame[:] = BACKGROUND_COLOURS[0]
+        #Reversing the channels swaps RGB to BGR without a new array
+        frame[y:y + image.shape[0], x:x + image.shape[1]] = image[..., ::-1]
         return frame
 
-    """Returns the view rectangle"""
+    """
+    Gives back a frame from get_frame once the bot is done with it
+    so its buffer can be reused
+    """
+    def release_frame(self, frame):
+        self.frame_ring.release(frame)
+
+    """
+    Returns where a capture of the length should start on one axis so it is
+    centred on centre but stays between low and high.
+    If it is longer than the space it is centred on the space
+    """
+    @staticmethod
+    def fit_span(centre, length, low, high):
+        if high - low <= length:
+            return (low + high - length) / 2
+        return min(max(centre - length / 2, low), high - length)
+
+    """Returns the view rectangle as (x1, y1, x2, y2) on the screen"""
     def get_rect(self):
         if self.centre == None:
             return None
         #Get rectangle if it hasnt been calculated yet
         if self.rect is None:
-            x_coor = max(0, self.centre[0] - self.size[0] / 2)
-            y_coor = max(0, self.centre[1] - self.size[1] / 2)
+            x1, y1, x2, y2 = self.view_rect or (0, 0, math.inf, math.inf)
+            x_coor = max(0, self.fit_span(self.centre[0], self.size[0], x1, x2))
+            y_coor = max(0, self.fit_span(self.centre[1], self.size[1], y1, y2))
 
             self.rect = (x_coor, y_coor, x_coor + self.size[0]
                 , y_coor + self.size[1])
         return self.rect
 
-    """Configures"""
+    """
+    Configures by waiting for the player tank to be clicked
+    Returns False if configuring was cancelled
+    """
     def configure(self):
+        from pynput import mouse
         print("Press the player tank")
+        self.left_button = mouse.Button.left
         self.mouse_listener = mouse.Listener(
             on_click=self.on_click,
         )
         self.mouse_listener.start()
-        while self.centre == None:
-            pass
+        #Sleeps until clicked
+        self.configured.wait()
         self.mouse_listener.stop()
+        return not self.cancelled
+
+    """
+    Configures without any input by finding the game view and the player
+    in a grab of the whole screen, or in the given frame if passed in.
+    The capture is centred on the player but kept inside the game view
+    Returns the player bbox relative to the captured screen
+    or None if the player could not be found
+    """
+    def auto_configure(self, frame=None, locator=None):
+        if frame is None:
+            frame = cv2.cvtColor(self.grab(), cv2.COLOR_BGR2RGB)
+        if locator is None:
+            locator = ViewLocator()
+        located = locator.locate(frame)
+        if located is None:
+            return None
+        self.view_rect, player_bbox = located
+        self.centre = (int(player_bbox[0] + player_bbox[2] / 2)
+            , int(player_bbox[1] + player_bbox[3] / 2))
+        self.rect = None
+        rect = self.get_rect()
+        self.configured.set()
+        return (player_bbox[0] - rect[0], player_bbox[1] - rect[1]
+            , player_bbox[2], player_bbox[3])
+
+    """Stops waiting for the player tank to be clicked"""
+    def cancel_configure(self):
+        self.cancelled = True
+        self.configured.set()
 
     """Called by mouse listener"""
     def on_click(self, x, y, button, pressed):
-        if button == mouse.Button.left and pressed:
+        if button == self.left_button and pressed:
+            import pyautogui
             print("clicked")
             self.centre = pyautogui.position()
+            self.configured.set()
 
 """This is used to detect what shape an object is"""
 class ObjectClassifier:
@@ -150,6 +246,201 @@ class ObjectClassifier:
         return b * b + g * g + r * r
 
 
+#Colour of the game background and its grid lines
+BACKGROUND_COLOURS = [(205,205,205), (195,195,195)]
+#How far a colour can be from the background or player colour
+#per channel and still match
+BACKGROUND_TOLERANCE = 8
+PLAYER_COLOUR_TOLERANCE = 50
+#The smallest area the player tank can have
+MIN_PLAYER_AREA = 300
+#How well the player must match a circle to be accepted
+MIN_PLAYER_ROUNDNESS = 0.7
+
+"""
+Finds the game view and the player tank in a frame
+The game view is the largest area of background colour
+and the player is the round ally coloured object closest to its centre
+"""
+class ViewLocator:
+    """
+    Returns the game view as (x1, y1, x2, y2)
+    or None if there is no background
+    """
+    def locate_view(self, frame):
+        mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+        for colour in BACKGROUND_COLOURS:
+            mask |= cv2.inRange(frame
+                , tuple(max(c - BACKGROUND_TOLERANCE, 0) for c in colour)
+                , tuple(min(c + BACKGROUND_TOLERANCE, 255) for c in colour))
+        #Fill in the gaps left by objects on the background
+        kernel = np.ones((15, 15), dtype=np.uint8)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask)
+        if count <= 1:
+            return None
+        #Label 0 is everything that is not background
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        x, y, w, h = stats[largest, :4]
+        return (int(x), int(y), int(x + w), int(y + h))
+
+    """
+    Returns how close the mask is to a filled circle
+    1 is a perfect match
+    """
+    def get_roundness(self, mask):
+        height, width = mask.shape
+        template = np.zeros((height + 2, width + 2), dtype=np.uint8)
+        cv2.ellipse(template, (((width + 2) / 2, (height + 2) / 2)
+            , (width, height), 0), 255, cv2.FILLED)
+        padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, 0)
+        return float(cv2.matchTemplate(padded, template
+            , cv2.TM_CCOEFF_NORMED).max())
+
+    """
+    Returns the bbox of the player tank in the view
+    view_rect is the part of the frame to look in as (x1, y1, x2, y2)
+    Returns None if it cannot be found
+    """
+    def locate_player(self, frame, view_rect):
+        x1, y1, x2, y2 = view_rect
+        view = frame[y1:y2, x1:x2]
+        colour = ObjectClassifier.OBJECT_COLOURS[GameObject.ALLY]
+        mask = cv2.inRange(view
+            , tuple(max(c - PLAYER_COLOUR_TOLERANCE, 0) for c in colour)
+            , tuple(min(c + PLAYER_COLOUR_TOLERANCE, 255) for c in colour))
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask)
+
+        #The game keeps the player in the centre of the view
+        view_centre = Vector2((x2 - x1) / 2, (y2 - y1) / 2)
+        best_bbox = None
+        best_dist = None
+        for label in range(1, count):
+            x, y, w, h, area = stats[label]
+            if area < MIN_PLAYER_AREA:
+                continue
+            component = (labels[y:y + h, x:x + w] == label).astype(np.uint8) * 255
+            if self.get_roundness(component) < MIN_PLAYER_ROUNDNESS:
+                continue
+            dist = view_centre.distance_to(BBoxOps.bbox_centre((x, y, w, h)))
+            if best_dist is None or dist < best_dist:
+                best_dist = dist
+                best_bbox = (int(x + x1), int(y + y1), int(w), int(h))
+        return best_bbox
+
+    """
+    Finds the game view and the player in a frame
+    Returns (view rect as (x1, y1, x2, y2), player bbox)
+    or None if either cannot be found
+    """
+    def locate(self, frame):
+        view_rect = self.locate_view(frame)
+        if view_rect is None:
+            return None
+        player_bbox = self.locate_player(frame, view_rect)
+        if player_bbox is None:
+            return None
+        return (view_rect, player_bbox)
+
+
+"""
+Plays back recorded frames in place of the screen capture
+so the bot can be run without a display
+frames is an iterable of frames the size of the capture
+If fps is given, frames are given no faster than it
+"""
+class ReplayCapture:
+    def __init__(self, frames, fps=None):
+        self.frames = iter(frames)
+        self.fps = fps
+        #Without pacing every frame must be used since none are missed
+        self.live = not fps is None
+        self.next_frame = next(self.frames, None)
+        if self.next_frame is None:
+            self.size = (0, 0)
+        else:
+            self.size = (self.next_frame.shape[1], self.next_frame.shape[0])
+        #The frames are the whole capture so the view is all of the frame
+        #As (x1, y1, x2, y2) like ScreenCapture
+        self.rect = (0, 0, self.size[0], self.size[1])
+        self.centre = (self.size[0] // 2, self.size[1] // 2)
+        self.last_frame_time = None
+        #How many frames have been given
+        self.frames_read = 0
+
+    """Returns the frames of a video file one at a time"""
+    @staticmethod
+    def read_video(path):
+        video = cv2.VideoCapture(path)
+        try:
+            while True:
+                success, frame = video.read()
+                if not success:
+                    return
+                yield frame
+        finally:
+            video.release()
+
+    """Makes a replay of a recorded video file"""
+    @staticmethod
+    def from_video(path, fps=None):
+        return ReplayCapture(ReplayCapture.read_video(path), fps)
+
+    """Return the centre position vector relative to the captured screen"""
+    def get_view_centre(self):
+        return Vector2(self.centre[0], self.centre[1])
+
+    @property
+    def position(self):
+        return (self.rect[0], self.rect[1])
+
+    """
+    Returns the next frame or None once the replay has finished
+    The frames are already recorded so the whole frame is always given
+    """
+    def get_frame(self, roi=None):
+        frame = self.next_frame
+        if frame is None:
+            return None
+        self.next_frame = next(self.frames, None)
+        if not self.fps is None and not self.last_frame_time is None:
+            wait = self.last_frame_time + 1 / self.fps - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        self.last_frame_time = time.perf_counter()
+        self.frames_read += 1
+        return frame
+
+    """Overrides. The recorded frames are never reused"""
+    def release_frame(self, frame):
+        pass
+
+    """Returns the view rectangle as (x1, y1, x2, y2)"""
+    def get_rect(self):
+        return self.rect
+
+    """Returns whether there are frames to play"""
+    def configure(self):
+        return not self.next_frame is None
+
+    """
+    Finds the player in the first frame
+    Returns its bbox or None if it could not be found
+    """
+    def auto_configure(self, frame=None, locator=None):
+        if frame is None:
+            frame = self.next_frame
+        if frame is None:
+            return None
+        if locator is None:
+            locator = ViewLocator()
+        return locator.locate_player(frame, self.rect)
+
+    """Overrides"""
+    def cancel_configure(self):
+        pass
+
+
 """Stores a collection of tracked objects"""
 class TrackedObjects:
     def __init__(self, objects, tracking_buffer=(20,20)):
@@ -168,6 +459,31 @@ class TrackedObjects:
             #Add tracker to list of trackers
             self.trackers.append(new_tracker)
 
+    """
+    Given the objects from before a new detection
+    give the new objects the id of the old object they overlap with
+    so they are treated as the same objects
+    """
+    def inherit_ids(self, old_objects):
+        unmatched = list(old_objects)
+        for obj in self.objects:
+            for old_obj in unmatched:
+                if (old_obj.type == obj.type
+                    and BBoxOps.bbox_overlap(old_obj.bbox, obj.bbox)):
+                    obj.uid = old_obj.uid
+                    obj.velocity = old_obj.velocity
+                    unmatched.remove(old_obj)
+                    break
+
+    """
+    Stops tracking every object whose uid is not given
+    They will be found again by the next detection
+    """
+    def keep(self, uids):
+        kept = [i for i, obj in enumerate(self.objects) if obj.uid in uids]
+        self.objects[:] = [self.objects[i] for i in kept]
+        self.trackers = [self.trackers[i] for i in kept]
+
     """
     Update all tracked objects
     returns successes list and the updated objects
@@ -178,16 +494,22 @@ class TrackedObjects:
             success, new_bbox = self.trackers[i].update(frame)
             game_obj = self.objects[i]
             if success:
-                game_obj.bbox = BBoxOps.remove_buffer(new_bbox
-                    , self.tracking_buffer)
+                game_obj.move_to(BBoxOps.remove_buffer(new_bbox
+                    , self.tracking_buffer))
                 game_obj.is_tracked = True
             else:
+                METRICS.count('tracker_failures')
                 #Redetect object from previous position
                 search_bbox = BBoxOps.make_buffer(game_obj.bbox, self.tracking_buffer)
-                new_obj = TrackedObjects.redetect(frame
-                    , search_bbox, detect_alg)
+                with METRICS.span('redetection'):
+                    new_obj = TrackedObjects.redetect(frame
+                        , search_bbox, detect_alg)
 
                 if new_obj:
+                    METRICS.count('redetects')
+                    #It is still the same object
+                    new_obj.uid = game_obj.uid
+                    new_obj.velocity = game_obj.velocity
                     self.objects[i] = new_obj
                     self.objects[i].is_tracked = True
                     self.trackers[i] = cv2.TrackerMOSSE_create()
@@ -222,8 +544,15 @@ class TrackedObjects:
 
 """Class used to detect objects"""
 class DetectionAlgorithm:
-    def __init__(self):
+    """
+    Objects with a smaller area than min_object_area are ignored
+    canny_thresholds are the low and high thresholds of the edge detector
+    """
+    def __init__(self, min_object_area=MIN_OBJECT_AREA
+        , canny_thresholds=CANNY_THRESHOLDS):
         self.classify = ObjectClassifier()
+        self.min_object_area = min_object_area
+        self.canny_thresholds = canny_thresholds
     """
     Given a frame, detect and return a list of detected game objects
     object limit is how many objects it will detect
@@ -234,12 +563,17 @@ class DetectionAlgorithm:
     """
     def detect(self, frame, object_limit = None, origin=(0,0), player_bbox=None):
         #Get contours
-        edged = cv2.Canny(frame, 100, 200)
-
-        contours, hierarchy = cv2.findContours(
-            edged,  
-            cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
-        )
+        #The edges are written into a borrowed buffer
+        with BUFFER_POOL.borrow(frame.shape[:2]) as edged:
+            with METRICS.span('canny'):
+                cv2.Canny(frame, *self.canny_thresholds, edges=edged)
+
+            with METRICS.span('contours'):
+                contours, hierarchy = cv2.findContours(
+                    edged,
+                    cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+                )
+        classify_start = time.perf_counter()
         #Empty the list of nearby objects
         nearby_objects = []
         num_detected = 0
@@ -261,7 +595,7 @@ class DetectionAlgorithm:
                 continue
 
             #Skip if the object is too small
-            if cv2.contourArea(contour) < MIN_OBJECT_AREA:
+            if cv2.contourArea(contour) < self.min_object_area:
                 continue
             
             #Detect object centre colour by moments
@@ -275,19 +609,33 @@ class DetectionAlgorithm:
             game_object = GameObject(shifted_o_bbox, shape)
             nearby_objects.append(game_object)
             num_detected += 1
+        METRICS.record('classification', time.perf_counter() - classify_start)
         return nearby_objects
 
 
+#How many times less often detection happens when it is deferred
+DEFER_DETECTION_FACTOR = 2
+
 """Used to parse the game"""
 class GameParser:
-    def __init__(self, detect_rate):
+    """
+    detect_rate is how many frames pass between full detections
+    detect_alg is the DetectionAlgorithm used. If not given the default is used
+    """
+    def __init__(self, detect_rate, detect_alg=None):
         self.trackers = []
         self.frames_passed = 0
         #Stores how many frames before detection happens again
         self.detect_rate = detect_rate
+        #When true, detection happens DEFER_DETECTION_FACTOR times less often
+        self.defer_detection = False
         self.tracked_objects = None
-        self.detect_alg = DetectionAlgorithm()
+        if detect_alg is None:
+            detect_alg = DetectionAlgorithm()
+        self.detect_alg = detect_alg
         self.player_tracker = self.make_player_tracker()
+        #The player bbox to start again from on the next update
+        self.reset_bbox = None
 
     """Makes the tracker for the player"""
     def make_player_tracker(self):
@@ -296,12 +644,33 @@ class GameParser:
     """Sets the player of the game"""
     def init(self, frame, player_bbox):
         self.player_tracker.init(frame, BBoxOps.make_int(player_bbox))
+        self.reset_bbox = None
+
+    """
+    Makes the parser start again from the given player bbox
+    on the next update. Used when frames have been missed
+    so the trackers are not following where objects used to be
+    """
+    def reset(self, player_bbox):
+        self.reset_bbox = player_bbox
+
+    """
+    Updates the environment given a frame
+    If roi is given as (x, y, w, h), objects are only found in that part
+    of the frame and the ones that leave it stop being tracked
+    """
+    def update(self, frame, environment, roi=None):
+        #Start again if asked to
+        if not self.reset_bbox is None:
+            self.player_tracker = self.make_player_tracker()
+            self.init(frame, self.reset_bbox)
+            self.tracked_objects = None
+            self.frames_passed = 0
 
-    """Updates the environment given a frame"""
-    def update(self, frame, environment):
         #Track Player
         success, new_bbox = self.player_tracker.update(frame)
         if not success:
+            METRICS.count('player_redetects')
             print("Redetecting player")
             #Redetect player from previous position
             old_bbox = environment.player.bbox
@@ -319,18 +688,38 @@ class GameParser:
         #Detect tracked objects if necessary
         if self.tracked_objects is None or self.frames_passed == 0:
             #Make detection
-            objects_list = self.detect_alg.detect(frame, player_bbox=new_bbox)
+            with METRICS.span('detection'):
+                if roi is None:
+                    objects_list = self.detect_alg.detect(frame
+                        , player_bbox=new_bbox)
+                else:
+                    x, y, w, h = roi
+                    objects_list = self.detect_alg.detect(frame[y:y + h, x:x + w]
+                        , origin=(x, y), player_bbox=new_bbox)
+            METRICS.count('full_detections')
+            METRICS.count('detections', len(objects_list))
 
+            old_tracked_objects = self.tracked_objects
             self.tracked_objects = TrackedObjects(objects_list)
+            if not old_tracked_objects is None:
+                self.tracked_objects.inherit_ids(old_tracked_objects.objects)
             self.tracked_objects.init(frame)
         else:
             #Else update existing tracked objects
-            self.tracked_objects.update(frame, self.detect_alg)
+            with METRICS.span('tracking'):
+                self.tracked_objects.update(frame, self.detect_alg)
+            if not roi is None:
+                self.tracked_objects.keep(set(o.uid for o
+                    in self.tracked_objects.objects
+                    if BBoxOps.bbox_overlap(roi, o.bbox)))
         
         #Update environment objects
         environment.objects = self.tracked_objects.objects
 
         #Iterate
         if self.detect_rate > 0:
-            self.frames_passed = (self.frames_passed + 1) % self.detect_rate
+            detect_rate = self.detect_rate
+            if self.defer_detection:
+                detect_rate *= DEFER_DETECTION_FACTOR
+            self.frames_passed = (self.frames_passed + 1) % detect_rate
         return self.tracked_objects
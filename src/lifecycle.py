@@ -0,0 +1,81 @@
+"""
+This file has the state machine for configuring, pausing and quitting the bot
+Threads wait on it without using any CPU
+"""
+import threading
+
+
+"""
+Stores whether the bot is configuring, paused, running or stopped
+Threads can wait for the state to change
+"""
+class BotLifecycle:
+    CONFIGURING = 'configuring'
+    PAUSED = 'paused'
+    RUNNING = 'running'
+    STOPPED = 'stopped'
+    #The states each state can change to
+    TRANSITIONS = {
+        CONFIGURING : (PAUSED, STOPPED),
+        PAUSED : (RUNNING, STOPPED),
+        RUNNING : (PAUSED, STOPPED),
+        STOPPED : ()
+    }
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.__state = BotLifecycle.CONFIGURING
+
+    @property
+    def state(self):
+        return self.__state
+
+    @property
+    def playing(self):
+        return self.__state != BotLifecycle.STOPPED
+
+    @property
+    def paused(self):
+        return self.__state == BotLifecycle.PAUSED
+
+    """
+    Changes to a new state and wakes up the waiting threads
+    Returns whether the state could be changed
+    """
+    def set_state(self, state):
+        with self.condition:
+            if not state in BotLifecycle.TRANSITIONS[self.__state]:
+                return False
+            self.__state = state
+            self.condition.notify_all()
+            return True
+
+    """Pauses the bot if it is running and resumes it if it is paused"""
+    def toggle_pause(self):
+        with self.condition:
+            if self.__state == BotLifecycle.RUNNING:
+                return self.set_state(BotLifecycle.PAUSED)
+            return self.set_state(BotLifecycle.RUNNING)
+
+    """Stops the bot"""
+    def stop(self):
+        return self.set_state(BotLifecycle.STOPPED)
+
+    """
+    Waits until the state is different from the given state
+    or the timeout passes. Returns the current state
+    """
+    def wait_for_change(self, state, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.__state != state, timeout)
+            return self.__state
+
+    """
+    Waits until the bot is running or stopped, or the timeout passes
+    Returns whether the bot is running
+    """
+    def wait_until_running(self, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.__state
+                in (BotLifecycle.RUNNING, BotLifecycle.STOPPED), timeout)
+            return self.__state == BotLifecycle.RUNNING
@@ -0,0 +1,160 @@
+"""
+This file measures how long each part of the bot takes
+and counts what happens, so the bot's performance can be monitored
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+"""Keeps the most recent samples so percentiles can be found"""
+class Histogram:
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        #Totals over every sample, not just the window
+        self.count = 0
+        self.total = 0
+
+    """Adds a sample"""
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    """Returns the given percentile of the recent samples"""
+    def percentile(self, percentile):
+        samples = sorted(self.samples)
+        if len(samples) == 0:
+            return None
+        index = min(len(samples) * percentile // 100, len(samples) - 1)
+        return samples[index]
+
+
+"""Times a block of code with the monotonic clock"""
+class Span:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+"""Stores the timings and counters of the bot"""
+class Metrics:
+    def __init__(self, window=1000):
+        self.window = window
+        #Maps span name to a histogram of its durations in seconds
+        self.spans = {}
+        #Maps event name to how many times it happened
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    """
+    Returns a context manager that records how long its block takes
+    Use as: with metrics.span('name'):
+    """
+    def span(self, name):
+        return Span(self, name)
+
+    """Records that a span took the given number of seconds"""
+    def record(self, name, seconds):
+        histogram = self.spans.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.spans.setdefault(name, Histogram(self.window))
+        histogram.add(seconds)
+
+    """Adds to the count of an event"""
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    """Removes all the recorded timings and counts"""
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+
+    """
+    Returns the current metrics as a dictionary
+    Span percentiles are in seconds
+    """
+    def snapshot(self):
+        with self.lock:
+            spans = dict(self.spans)
+            counters = dict(self.counters)
+        summary = {'time' : time.time(), 'spans' : {}, 'counters' : counters}
+        for name, histogram in spans.items():
+            summary['spans'][name] = {
+                'count' : histogram.count,
+                'sum' : histogram.total,
+                'p50' : histogram.percentile(50),
+                'p95' : histogram.percentile(95),
+                'p99' : histogram.percentile(99)
+            }
+        return summary
+
+
+"""
+Writes the metrics to a JSON lines file and a Prometheus text file
+every interval seconds
+"""
+class MetricsExporter:
+    """Either path can be None to not write that file"""
+    def __init__(self, metrics, jsonl_path=None, prometheus_path=None
+        , interval=5.0):
+        self.metrics = metrics
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.last_export = time.monotonic()
+
+    """Exports the metrics if the interval has passed. Cheap to call"""
+    def maybe_export(self):
+        if time.monotonic() - self.last_export >= self.interval:
+            self.export()
+
+    """Exports the metrics now"""
+    def export(self):
+        self.last_export = time.monotonic()
+        summary = self.metrics.snapshot()
+        if not self.jsonl_path is None:
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+        if not self.prometheus_path is None:
+            #Write to a temporary file first so it is never read half written
+            temp_path = self.prometheus_path + '.tmp'
+            with open(temp_path, 'w') as f:
+                f.write(MetricsExporter.to_prometheus(summary))
+            os.replace(temp_path, self.prometheus_path)
+
+    """Formats a metrics snapshot in the Prometheus text format"""
+    @staticmethod
+    def to_prometheus(summary):
+        lines = ['# HELP diepbot_span_seconds Time taken by each part of the bot'
+            , '# TYPE diepbot_span_seconds summary']
+        for name, span in sorted(summary['spans'].items()):
+            for quantile in ('p50', 'p95', 'p99'):
+                if not span[quantile] is None:
+                    lines.append(f'diepbot_span_seconds{{span="{name}"'
+                        + f',quantile="0.{quantile[1:]}"}} {span[quantile]}')
+            lines.append(f'diepbot_span_seconds_sum{{span="{name}"}} {span["sum"]}')
+            lines.append(f'diepbot_span_seconds_count{{span="{name}"}} {span["count"]}')
+        lines.append('# HELP diepbot_events_total How many times each event happened')
+        lines.append('# TYPE diepbot_events_total counter')
+        for name, count in sorted(summary['counters'].items()):
+            lines.append(f'diepbot_events_total{{event="{name}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+#The metrics recorded by the bot
+METRICS = Metrics()
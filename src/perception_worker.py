@@ -0,0 +1,248 @@
+"""
+This file runs detection and tracking in another process
+Frames are passed to it through shared memory and the environment
+comes back as a small array, so frames are never pickled
+"""
+import multiprocessing
+import queue
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from environment import Environment
+from game_parser import GameParser
+from config import FRAME_RING_SIZE, PERCEPTION_MAX_RESTARTS
+
+
+"""
+A ring of frames in shared memory
+One process writes frames into the slots in turn and
+others read them by slot number without copying
+"""
+class SharedFrameRing:
+    """If name is given the existing ring with that name is opened"""
+    def __init__(self, slots, shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = slots * int(np.prod(shape))
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8
+            , buffer=self.memory.buf)
+        self.index = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    """Copies a frame into the next slot and returns the slot"""
+    def write(self, frame):
+        slot = self.index
+        np.copyto(self.frames[slot], frame)
+        self.index = (self.index + 1) % self.slots
+        return slot
+
+    """Returns the frame in a slot. It is not a copy"""
+    def read(self, slot):
+        return self.frames[slot]
+
+    """Closes the ring. If unlink is true its memory is freed too"""
+    def close(self, unlink=False):
+        #The memory cannot be closed while an array still uses it
+        self.frames = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+"""
+Runs in the worker process
+Each request is (slot, capture time, roi, player bbox) and the player bbox
+is only given when parsing should start again from it.
+For each frame parsed, (frames used, slot, capture time, environment array)
+is put on the results. A request of None stops the worker
+If live is true, frames waiting behind a newer one are skipped
+"""
+def run_worker(ring_name, slots, shape, detect_rate, requests, results, live):
+    ring = SharedFrameRing(slots, shape, ring_name)
+    game_parser = GameParser(detect_rate)
+    environment = Environment((shape[1], shape[0]))
+    try:
+        request = requests.get()
+        while not request is None:
+            used = 1
+            #Skip to the newest frame so the environment is not stale
+            while live:
+                try:
+                    newer = requests.get_nowait()
+                except queue.Empty:
+                    break
+                if newer is None:
+                    return
+                #Keep the player bbox of a skipped frame so parsing still
+                #starts again from it
+                if newer[3] is None:
+                    newer = newer[:3] + (request[3],)
+                request = newer
+                used += 1
+            slot, capture_time, roi, player_bbox = request
+            if not player_bbox is None:
+                game_parser.reset(player_bbox)
+            game_parser.update(ring.read(slot), environment, roi)
+            results.put((used, slot, capture_time, environment.to_array()))
+            request = requests.get()
+    except KeyboardInterrupt:
+        #The bot shuts the worker down itself
+        pass
+    finally:
+        #Do not wait for results nobody will read
+        results.cancel_join_thread()
+        ring.close()
+
+
+"""
+Runs a GameParser in another process so it does not share the GIL
+with capture and decisions
+Frames are submitted by the capture stage and environment arrays are
+received by the perception stage. If the worker crashes it is started
+again from where the player was last seen, up to max_restarts times
+"""
+class PerceptionWorker:
+    """
+    player_bbox is where parsing starts from
+    If live is true, the worker skips frames when it falls behind
+    """
+    def __init__(self, detect_rate, player_bbox, slots=FRAME_RING_SIZE
+        , live=True, max_restarts=PERCEPTION_MAX_RESTARTS):
+        #Spawned so the worker does not copy the bot's threads
+        self.context = multiprocessing.get_context('spawn')
+        self.detect_rate = detect_rate
+        #Where the player was last seen. Used to start parsing again
+        self.player_bbox = player_bbox
+        self.slots = slots
+        self.live = live
+        self.max_restarts = max_restarts
+        self.ring = None
+        self.process = None
+        self.requests = None
+        self.results = None
+        #Frames sent that the worker has not finished with
+        #A slot is only written when fewer than all of them are in use
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        #Whether the next frame starts parsing again from player_bbox
+        self.needs_reset = True
+        self.stopping = False
+        #Metrics
+        self.restarts = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+    """Starts a new worker process"""
+    def start(self):
+        self.requests = self.context.Queue()
+        self.results = self.context.Queue()
+        self.process = self.context.Process(target=run_worker, name='perception'
+            , args=(self.ring.name, self.slots, self.ring.shape, self.detect_rate
+                , self.requests, self.results, self.live), daemon=True)
+        self.process.start()
+        self.in_flight = 0
+        self.needs_reset = True
+
+    """Makes parsing start again from the player bbox on the next frame"""
+    def reset(self, player_bbox):
+        with self.condition:
+            self.player_bbox = player_bbox
+            self.needs_reset = True
+
+    """
+    Copies a frame into shared memory and sends it to the worker
+    Waits up to timeout seconds for a free slot
+    Returns False if the frame could not be sent
+    """
+    def submit(self, frame, capture_time, roi=None, timeout=0.5):
+        with self.condition:
+            if self.stopping:
+                return False
+            if self.ring is None:
+                self.ring = SharedFrameRing(self.slots, frame.shape)
+                self.start()
+            if not self.condition.wait_for(lambda: self.stopping
+                or self.in_flight < self.slots - 1, timeout):
+                return False
+            if self.stopping:
+                return False
+            slot = self.ring.write(frame)
+            player_bbox = self.player_bbox if self.needs_reset else None
+            self.needs_reset = False
+            self.in_flight += 1
+            self.frames_sent += 1
+            self.requests.put((slot, capture_time, roi, player_bbox))
+            return True
+
+    """
+    Waits up to timeout seconds for the next environment array
+    Returns (slot, capture time, array) or None if there is none
+    Starts the worker again if it has crashed
+    """
+    def receive(self, timeout=None):
+        if self.results is None:
+            with self.condition:
+                self.condition.wait(timeout)
+            return None
+        try:
+            used, slot, capture_time, array = self.results.get(timeout=timeout)
+        except queue.Empty:
+            self.check_worker()
+            return None
+        with self.condition:
+            self.in_flight = max(self.in_flight - used, 0)
+            self.frames_skipped += used - 1
+            self.condition.notify_all()
+        return slot, capture_time, array
+
+    """
+    Starts the worker again if it has died
+    Raises a RuntimeError once it has crashed too many times
+    """
+    def check_worker(self):
+        with self.condition:
+            if self.stopping or self.process is None or self.process.is_alive():
+                return
+            if self.restarts >= self.max_restarts:
+                raise RuntimeError("Perception worker crashed "
+                    + f"{self.restarts + 1} times")
+            self.restarts += 1
+            print(f"Perception worker stopped with code {self.process.exitcode}. "
+                + "Starting it again")
+            #The old queues may have been left broken by the dead process
+            for old_queue in (self.requests, self.results):
+                old_queue.cancel_join_thread()
+                old_queue.close()
+            self.start()
+            self.condition.notify_all()
+
+    """Stops the worker and frees the shared memory"""
+    def stop(self, timeout=2):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if not self.process is None:
+            if self.process.is_alive():
+                self.requests.put(None)
+                self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.requests.cancel_join_thread()
+            self.requests.close()
+            self.results.close()
+        if not self.ring is None:
+            self.ring.close(unlink=True)
+            self.ring = None
+
+    """Prints how the worker performed"""
+    def print_stats(self):
+        print(f"Perception worker: {self.frames_sent} frames sent, "
+            + f"{self.frames_skipped} skipped, {self.restarts} restarts")
@@ -0,0 +1,397 @@
+"""
+This file has the classes used to run the bot as a pipeline
+Each stage of the bot runs on its own thread and passes its results
+to the next stage
+"""
+import threading
+import time
+from collections import deque
+from environment import *
+from render import Overlay
+from metrics import METRICS
+from lifecycle import BotLifecycle
+from buffers import BUFFER_POOL
+from config import FRAME_RING_SIZE
+from perception_worker import PerceptionWorker
+
+
+"""
+A bounded queue between two pipeline stages
+When it is full, either the stage putting items in waits for space
+or the oldest item is dropped
+Items that are dropped or never taken out are passed to on_drop if given
+"""
+class StageQueue:
+    #Wait until there is space. This slows down the stage putting items in
+    BLOCK = 'block'
+    #Drop the oldest item to make space
+    DROP_OLDEST = 'drop_oldest'
+
+    def __init__(self, maxsize=1, policy=DROP_OLDEST, on_drop=None):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        #How many items have been dropped
+        self.dropped = 0
+
+    """
+    Adds an item to the queue
+    Returns False if the queue was closed
+    """
+    def put(self, item):
+        dropped = None
+        with self.condition:
+            while (self.policy == StageQueue.BLOCK and not self.closed
+                and len(self.items) >= self.maxsize):
+                self.condition.wait()
+            if self.closed:
+                dropped = item
+            else:
+                if len(self.items) >= self.maxsize:
+                    dropped = self.items.popleft()
+                    self.dropped += 1
+                self.items.append(item)
+                self.condition.notify_all()
+        if not dropped is None and not self.on_drop is None:
+            self.on_drop(dropped)
+        return not dropped is item
+
+    """
+    Removes and returns the oldest item
+    Returns None if the timeout passes or the queue is closed
+    """
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if self.closed or not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    """Wakes up everything waiting on the queue and stops it"""
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    """Drops the items left in the queue"""
+    def clear(self):
+        with self.condition:
+            items = list(self.items)
+            self.items.clear()
+        if not self.on_drop is None:
+            for item in items:
+                self.on_drop(item)
+
+
+"""
+Double buffered environment shared by the perception and decision stages
+The perception stage writes into whichever buffer the decision stage
+is not reading, so perception never waits for a decision to be made
+Each buffer keeps its environment's frame until it is replaced, then
+gives it to release_frame if given so its memory can be reused
+"""
+class EnvironmentBuffer:
+    def __init__(self, size, release_frame=None):
+        self.buffers = [Environment(size), Environment(size)]
+        self.release_frame = release_frame
+        #Index of the newest buffer
+        self.front = 0
+        #Index of the buffer being read. None if not reading
+        self.reading = None
+        #Increases each time a new environment is published
+        self.version = 0
+        #Stores the capture time of the newest environment
+        self.capture_time = None
+        self.condition = threading.Condition()
+        self.closed = False
+
+    """
+    Copies the environment into a buffer and makes it the newest
+    capture_time is when the frame the environment came from was captured
+    """
+    def publish(self, environment, capture_time):
+        with self.condition:
+            back = 1 - self.front
+            #If the other buffer is being read, replace the newest instead
+            if back == self.reading:
+                back = self.front
+            #Copying is quick so readers only wait for a moment
+            old_frame = self.buffers[back].frame
+            self.buffers[back].copy_from(environment)
+            if not old_frame is None and not self.release_frame is None:
+                self.release_frame(old_frame)
+            self.front = back
+            self.version += 1
+            self.capture_time = capture_time
+            self.condition.notify_all()
+
+    """
+    Waits for an environment newer than the given version and starts
+    reading it. Returns (environment, version, capture time)
+    or None if the timeout passes or the buffer is closed
+    release must be called when done with the environment
+    """
+    def acquire(self, last_version, timeout=None):
+        with self.condition:
+            if self.version == last_version and not self.closed:
+                self.condition.wait(timeout)
+            if self.closed or self.version == last_version:
+                return None
+            self.reading = self.front
+            return (self.buffers[self.front], self.version, self.capture_time)
+
+    """Stops reading the environment given by acquire"""
+    def release(self):
+        with self.condition:
+            self.reading = None
+
+    """Wakes up everything waiting on the buffer"""
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    """Gives back the frames of both buffers once nothing is reading them"""
+    def clear(self):
+        with self.condition:
+            for environment in self.buffers:
+                if not environment.frame is None and not self.release_frame is None:
+                    self.release_frame(environment.frame)
+                environment.frame = None
+
+
+"""
+A pipeline stage. Runs its step function on its own thread
+until the pipeline is stopped
+The step returns whether it had any work to do
+If a StageProfiler is given, each step is profiled as the stage
+"""
+class Stage(threading.Thread):
+    def __init__(self, name, step, stop_event, profiler=None):
+        super().__init__(name=name, daemon=True)
+        self.step = step
+        self.stop_event = stop_event
+        self.profiler = profiler
+        #How many times the step has done work
+        self.steps = 0
+        #Total time spent doing work in seconds
+        self.busy_time = 0
+        #Stores the exception that stopped the stage
+        self.error = None
+
+    """Overrides"""
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                if self.profiler is None:
+                    worked = self.step()
+                else:
+                    with self.profiler.stage(self.name):
+                        worked = self.step()
+                if worked:
+                    step_time = time.perf_counter() - start
+                    METRICS.record(self.name, step_time)
+                    self.busy_time += step_time
+                    self.steps += 1
+        except Exception as e:
+            self.error = e
+            #Stop the other stages too
+            self.stop_event.set()
+            raise
+
+
+"""
+Runs the bot as a pipeline of stages:
+capture -> perception -> decision -> actuation
+Capture and perception are joined by a queue that drops old frames
+and perception and decision by a double buffered environment.
+Actuation is done by the controller's own thread
+"""
+class BotPipeline:
+    def __init__(self, bot, capture_queue_size=1):
+        self.bot = bot
+        self.stop_event = threading.Event()
+        #Frames that are not live, such as replays, are never dropped
+        policy = StageQueue.DROP_OLDEST
+        if not bot.screen_cap.live:
+            policy = StageQueue.BLOCK
+        #Frames are given back to the capture when they are dropped
+        #or replaced by a newer one
+        release_frame = bot.screen_cap.release_frame
+        self.frames = StageQueue(capture_queue_size, policy
+            , lambda item: release_frame(item[0]))
+        self.environments = EnvironmentBuffer(bot.environment.size, release_frame)
+        #Version of the last environment a decision was made on
+        self.decision_version = 0
+        #Time from capturing a frame to deciding on it in seconds
+        self.latencies = deque(maxlen=1000)
+        self.stages = [
+            Stage('capture', self.capture, self.stop_event, bot.profiler),
+            Stage('perception', self.perceive, self.stop_event, bot.profiler),
+            Stage('decision', self.decide, self.stop_event, bot.profiler)
+        ]
+
+    """
+    Sleeps while the bot is paused, waking up now and then
+    to check if the pipeline has been stopped
+    Returns whether the bot is still paused
+    """
+    def wait_if_paused(self):
+        if self.bot.paused:
+            return not self.bot.lifecycle.wait_until_running(0.5)
+        return False
+
+    """Capture stage. Grabs the game frame"""
+    def capture(self):
+        if self.wait_if_paused():
+            return False
+        roi_rect = self.bot.get_roi_rect()
+        frame = self.bot.screen_cap.get_frame(roi_rect)
+        #There are no more frames when replaying
+        if frame is None:
+            self.bot.lifecycle.stop()
+            return False
+        self.frames.put((frame, time.perf_counter(), roi_rect))
+        return True
+
+    """Perception stage. Updates the environment from the newest frame"""
+    def perceive(self):
+        item = self.frames.get(0.1)
+        if item is None:
+            return False
+        frame, capture_time, roi_rect = item
+        self.bot.game_parser.update(frame, self.bot.environment, roi_rect)
+        self.bot.environment.frame = frame
+        self.environments.publish(self.bot.environment, capture_time)
+        #The buffer has the frame now and gives it back when it is replaced
+        self.bot.environment.frame = None
+        return True
+
+    """Decision stage. Applies the bot action to the newest environment"""
+    def decide(self):
+        acquired = self.environments.acquire(self.decision_version, 0.1)
+        if acquired is None:
+            return False
+        environment, self.decision_version, capture_time = acquired
+        try:
+            if self.bot.paused:
+                return False
+            #Things the bot wants drawn are recorded for the renderer
+            overlay = Overlay() if self.bot.display_view else None
+            self.bot.behaviour.action(environment, self.bot.control, overlay)
+            self.latencies.append(time.perf_counter() - capture_time)
+            METRICS.record('capture_to_decision', self.latencies[-1])
+            if not self.bot.roi is None:
+                self.bot.roi.update(environment, self.bot.behaviour
+                    , self.bot.control)
+            if self.bot.display_view:
+                self.bot.render.render_view(environment.frame, environment, overlay)
+            #Frames are counted by the decisions made
+            self.bot.profiler.end_frame()
+            BUFFER_POOL.end_frame()
+            return True
+        finally:
+            self.environments.release()
+
+    """Runs the pipeline until the bot stops playing"""
+    def run(self):
+        for stage in self.stages:
+            stage.start()
+        while self.bot.playing and not self.stop_event.is_set():
+            self.bot.check_if_paused()
+            self.bot.exporter.maybe_export()
+            #Sleep until paused or quit, waking up to export metrics
+            #and check the stages are still going
+            self.bot.lifecycle.wait_for_change(BotLifecycle.RUNNING, 0.5)
+
+        #Stop all the stages
+        self.stop_event.set()
+        self.frames.close()
+        self.environments.close()
+        for stage in self.stages:
+            stage.join()
+        #Give back the frames that were not used
+        self.frames.clear()
+        self.environments.clear()
+        self.print_stats()
+
+    """Prints how each stage performed"""
+    def print_stats(self):
+        for stage in self.stages:
+            print(f"{stage.name}: {stage.steps} steps, "
+                + f"{stage.busy_time:.2f}s busy")
+        print(f"Dropped {self.frames.dropped} captured frames")
+        if len(self.latencies) > 0:
+            latencies = sorted(self.latencies)
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) * 95 // 100, len(latencies) - 1)]
+            print(f"Capture to decision latency p50 {p50 * 1000:.1f}ms, "
+                + f"p95 {p95 * 1000:.1f}ms")
+
+
+"""
+A BotPipeline where perception runs in another process
+The capture stage writes frames into shared memory for the worker
+and the perception stage loads the environments it sends back
+"""
+class WorkerPipeline(BotPipeline):
+    def __init__(self, bot, capture_queue_size=1):
+        super().__init__(bot, capture_queue_size)
+        self.worker = PerceptionWorker(bot.game_parser.detect_rate
+            , bot.player_bbox, FRAME_RING_SIZE, bot.screen_cap.live)
+        #Lets the bot start parsing again when it is resumed
+        bot.perception_worker = self.worker
+
+    """Overrides. Sends the frame to the worker instead of the queue"""
+    def capture(self):
+        if self.wait_if_paused():
+            return False
+        roi_rect = self.bot.get_roi_rect()
+        frame = self.bot.screen_cap.get_frame(roi_rect)
+        #There are no more frames when replaying
+        if frame is None:
+            self.bot.lifecycle.stop()
+            return False
+        #The frame is copied into shared memory so can be reused straight away
+        submitted = self.worker.submit(frame, time.perf_counter(), roi_rect)
+        self.bot.screen_cap.release_frame(frame)
+        return submitted
+
+    """Overrides. Loads the newest environment from the worker"""
+    def perceive(self):
+        result = self.worker.receive(0.1)
+        if result is None:
+            return False
+        slot, capture_time, array = result
+        environment = self.bot.environment
+        environment.load_array(array)
+        environment.frame = self.worker.ring.read(slot)
+        if not environment.player is None:
+            self.worker.player_bbox = environment.player.bbox
+        self.environments.publish(environment, capture_time)
+        environment.frame = None
+        return True
+
+    """Overrides. Stops the worker once the stages have stopped"""
+    def run(self):
+        try:
+            super().run()
+        finally:
+            #Frames in shared memory must not be used once it is freed
+            self.bot.environment.frame = None
+            for environment in self.environments.buffers:
+                environment.frame = None
+            self.bot.perception_worker = None
+            self.worker.stop()
+
+    """Overrides"""
+    def print_stats(self):
+        super().print_stats()
+        self.worker.print_stats()
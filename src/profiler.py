@@ -0,0 +1,116 @@
+"""
+This file profiles the bot while it is playing
+so the slow python functions in each stage can be found
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+
+"""
+Profiles each stage of the bot separately over a number of frames
+Each stage gets its own cProfile profile, dumped to its own file
+"""
+class StageProfiler:
+    def __init__(self, output_dir='.'):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        #Maps stage name to its profile. None when not profiling
+        self.profiles = None
+        self.frames_left = 0
+        self.tag = None
+
+    """Returns whether profiling is happening"""
+    @property
+    def active(self):
+        return not self.profiles is None
+
+    """
+    Starts profiling the next given number of frames
+    The dumped files are named with the tag
+    """
+    def start(self, frames, tag=None):
+        with self.lock:
+            if self.active:
+                return
+            if tag is None:
+                tag = time.strftime('%Y%m%d-%H%M%S')
+            self.tag = tag
+            self.frames_left = frames
+            self.profiles = {}
+        print(f"Profiling the next {frames} frames")
+
+    """Starts profiling if not profiling, otherwise stops it"""
+    def toggle(self, frames):
+        if self.active:
+            self.stop()
+        else:
+            self.start(frames)
+
+    """
+    Returns a context manager that profiles its block as the given stage
+    Does nothing when not profiling
+    """
+    def stage(self, name):
+        return StageProfile(self, name)
+
+    """Returns the profile of a stage, making it if needed"""
+    def get_profile(self, name):
+        with self.lock:
+            if not self.active:
+                return None
+            if not name in self.profiles:
+                self.profiles[name] = cProfile.Profile()
+            return self.profiles[name]
+
+    """Called at the end of every frame. Stops profiling after the last one"""
+    def end_frame(self):
+        if not self.active:
+            return
+        with self.lock:
+            self.frames_left -= 1
+            finished = self.frames_left <= 0
+        if finished:
+            self.stop()
+
+    """Stops profiling and dumps the stats of every stage"""
+    def stop(self):
+        with self.lock:
+            profiles = self.profiles
+            self.profiles = None
+        if profiles is None:
+            return
+        for name, profile in profiles.items():
+            path = os.path.join(self.output_dir, f"profile_{self.tag}_{name}")
+            profile.dump_stats(path + '.prof')
+            #Also write the slowest functions as text
+            text = io.StringIO()
+            stats = pstats.Stats(profile, stream=text)
+            stats.sort_stats('cumulative').print_stats(30)
+            with open(path + '.txt', 'w') as f:
+                f.write(text.getvalue())
+        print(f"Profiling done. Stats for {', '.join(profiles)} were written "
+            + f"to {os.path.abspath(self.output_dir)}")
+
+
+"""Profiles a block as a stage of the StageProfiler"""
+class StageProfile:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        if self.profiler.active:
+            self.profile = self.profiler.get_profile(self.name)
+            if not self.profile is None:
+                self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.profile is None:
+            self.profile.disable()
+        return False
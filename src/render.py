@@ -1,34 +1,264 @@
 """This class is responsible for rendering"""
 import cv2
+import queue
+import threading
 import time
+import numpy as np
+from buffers import BUFFER_POOL
 
-class BotRender:
+
+"""
+Records draw commands so they can be drawn onto a frame later
+This lets the bot say what it wants drawn without touching the frame
+"""
+class Overlay:
     def __init__(self):
+        #Stores functions that draw onto a frame and return it
+        self.commands = []
+
+    """Records a rectangle. See BotRender.draw_rect"""
+    def draw_rect(self, bbox, color=(255,0,255), thickness=2):
+        bbox = tuple(bbox)
+        self.commands.append(
+            lambda frame: BotRender.draw_rect(bbox, frame, color, thickness))
+
+    """Records a line. See BotRender.draw_line"""
+    def draw_line(self, start_point, end_point, color=(255,255,0), thickness=2):
+        self.commands.append(lambda frame: BotRender.draw_line(frame
+            , start_point, end_point, color, thickness))
+
+    """Records a circle. See BotRender.draw_circle"""
+    def draw_circle(self, circle, color=(255,0,0), thickness=2):
+        self.commands.append(
+            lambda frame: BotRender.draw_circle(frame, circle, color, thickness))
+
+    """Records text. See BotRender.draw_text"""
+    def draw_text(self, text, pos, color=(0,0,0)):
+        self.commands.append(
+            lambda frame: BotRender.draw_text(frame, text, pos, color=color))
+
+    """Draws all the recorded commands onto the frame"""
+    def draw(self, frame):
+        for command in self.commands:
+            frame = command(frame)
+        return frame
+
+
+"""
+Writes frames to a video file on a background thread
+Frames wait in a bounded queue and are dropped if the encoder falls behind
+so recording never slows down the caller
+"""
+class VideoRecorder:
+    """
+    codec is the four character code of the video codec
+    scale resizes the frames before they are encoded
+    backlog is how many frames can wait to be encoded
+    """
+    def __init__(self, path, codec='MJPG', fps=10, scale=1.0, backlog=30):
+        self.path = path
+        self.codec = codec
+        self.fps = fps
+        self.scale = scale
+        self.frames = queue.Queue(maxsize=backlog)
+        self.writer = None
+        self.written_frames = 0
+        self.dropped_frames = 0
+        #The most frames that have been waiting at once
+        self.max_backlog = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    """Returns how many frames are waiting to be encoded"""
+    @property
+    def backlog(self):
+        return self.frames.qsize()
+
+    """
+    Queues a frame to be written. The frame must not be changed after
+    If a BufferPool is given, the frame is given back to it once written
+    """
+    def write(self, frame, pool=None):
+        try:
+            self.frames.put_nowait((frame, pool))
+        except queue.Full:
+            self.dropped_frames += 1
+            if not pool is None:
+                pool.release(frame)
+        self.max_backlog = max(self.max_backlog, self.frames.qsize())
+
+    """Encodes the queued frames until released"""
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            frame, pool = item
+            if self.scale != 1:
+                resized = cv2.resize(frame, None, fx=self.scale, fy=self.scale
+                    , interpolation=cv2.INTER_AREA)
+                if not pool is None:
+                    pool.release(frame)
+                    pool = None
+                frame = resized
+            #Make the writer once the frame size is known
+            if self.writer is None:
+                height, width = frame.shape[:2]
+                self.writer = cv2.VideoWriter(self.path
+                    , cv2.VideoWriter_fourcc(*self.codec), self.fps
+                    , (width, height))
+            self.writer.write(frame)
+            self.written_frames += 1
+            if not pool is None:
+                pool.release(frame)
+
+    """Writes the frames still queued and closes the file"""
+    def release(self):
+        self.frames.put(None)
+        self.thread.join()
+        if not self.writer is None:
+            self.writer.release()
+
+
+"""
+Everything the renderer needs to draw a view
+The frame and objects are copied so the bot can keep changing them
+and the capture can reuse the frame
+"""
+class ViewSnapshot:
+    def __init__(self, frame, environment, overlay, fps):
+        #Copied into a pooled buffer that the view is drawn on
+        #It must be given back with BUFFER_POOL.release once drawn
+        self.frame = BUFFER_POOL.acquire(frame.shape, frame.dtype)
+        np.copyto(self.frame, frame)
+        self.player_bbox = None
+        if not environment.player is None:
+            self.player_bbox = tuple(environment.player.bbox)
+        self.objects = [(tuple(o.bbox), o.type) for o in environment.objects]
+        self.overlay = overlay
+        self.fps = fps
+
+
+class BotRender:
+    """
+    Only every render_every frames is rendered
+    If threaded, the view is drawn on its own thread and frames are dropped
+    when the renderer is still busy with the last one
+    """
+    def __init__(self, render_every=1, threaded=True):
         self.show_player = True
         self.show_objects = True
         self.last_render_time = None
         self.total_fps = 0
         self.fps_detects = 0
+        self.fps = None
         self.output_video = None
+        self.render_every = max(render_every, 1)
+        self.frames_seen = 0
+        #How many frames the renderer was too busy to draw
+        self.dropped_frames = 0
+
+        self.threaded = threaded
+        self.condition = threading.Condition()
+        #The next snapshot to draw
+        self.pending = None
+        self.running = True
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    """
+    Renders the view for humans to see
+    The overlay is drawn on top of the view
+    """
+    def render_view(self, frame, environment, overlay=None):
+        self.calculate_fps()
+        self.frames_seen += 1
+        if (self.frames_seen - 1) % self.render_every != 0:
+            return
+        snapshot = ViewSnapshot(frame, environment, overlay, self.fps)
+        if not self.threaded:
+            self.draw_view(snapshot)
+            return
+        with self.condition:
+            #Replace the last frame if the renderer has not got to it
+            if not self.pending is None:
+                self.dropped_frames += 1
+                BUFFER_POOL.release(self.pending.frame)
+            self.pending = snapshot
+            self.condition.notify()
+
+    """Draws the snapshots given to render_view until stopped"""
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                if not self.running:
+                    if not self.pending is None:
+                        BUFFER_POOL.release(self.pending.frame)
+                        self.pending = None
+                    break
+                snapshot = self.pending
+                self.pending = None
+            self.draw_view(snapshot)
+        #Windows are closed by the thread that made them
+        #There are none if nothing was rendered
+        if self.frames_seen > 0:
+            cv2.destroyAllWindows()
 
-    """Renders the view for humans to see"""
-    def render_view(self, frame, environment):
-        self.calculate_fps(frame)
+    """Draws a snapshot and shows it"""
+    def draw_view(self, snapshot):
+        #Draw on the snapshot's copy of the frame
+        frame = snapshot.frame
+        if not snapshot.fps is None:
+            BotRender.draw_text(frame, 'fps: ' + str(round(snapshot.fps, 0)), (10,30))
         #Show player
-        if not environment.player is None and self.show_player:
-            frame = BotRender.draw_rect(environment.player.bbox, frame, (108,238,163))
+        if not snapshot.player_bbox is None and self.show_player:
+            frame = BotRender.draw_rect(snapshot.player_bbox, frame, (108,238,163))
         #Show nearby objectsawd
         if self.show_objects:
-            for game_object in environment.objects:
-                frame = BotRender.draw_rect(game_object.bbox, frame, (74, 252, 255))
-                text_pos = (int(game_object.bbox[0]), int(game_object.bbox[1]))
-                frame = BotRender.draw_text(frame, game_object.type, text_pos)
+            for bbox, object_type in snapshot.objects:
+                frame = BotRender.draw_rect(bbox, frame, (74, 252, 255))
+                text_pos = (int(bbox[0]), int(bbox[1]))
+                frame = BotRender.draw_text(frame, object_type, text_pos)
+        if not snapshot.overlay is None:
+            frame = snapshot.overlay.draw(frame)
         #Shows frame
         cv2.imshow("Bot view", frame)
         cv2.waitKey(1)
+        #The frame is not used again so it does not need copying
+        #The recorder gives it back to the pool once written
+        if not self.output_video is None:
+            self.output_video.write(frame, BUFFER_POOL)
+        else:
+            BUFFER_POOL.release(frame)
 
-    """Calculates the fps and displays it on the frame"""
-    def calculate_fps(self, frame):
+    """
+    Records the rendered view to a video file
+    See VideoRecorder for the options
+    """
+    def record(self, path, codec='MJPG', fps=10, scale=1.0, backlog=30):
+        self.output_video = VideoRecorder(path, codec, fps, scale, backlog)
+
+    """Stops the renderer and closes its windows and video"""
+    def stop(self):
+        if self.threaded:
+            with self.condition:
+                self.running = False
+                self.condition.notify()
+            self.thread.join()
+        elif self.frames_seen > 0:
+            cv2.destroyAllWindows()
+        if not self.output_video is None:
+            self.output_video.release()
+            print(f"Recorded {self.output_video.written_frames} frames to "
+                + f"{self.output_video.path}, "
+                + f"dropped {self.output_video.dropped_frames}")
+
+    """Calculates the fps"""
+    def calculate_fps(self):
         if self.last_render_time is None:
             self.last_render_time = time.time()
         else:
@@ -38,10 +268,12 @@ class BotRender:
             fps = 1.0 / time_elapsed
             self.total_fps += fps
             self.fps_detects += 1
-            fps = round(fps, 0)
-            BotRender.draw_text(frame, 'fps: ' + str(fps), (10,30))
+            self.fps = fps
 
     def get_average_fps(self):
+        #Nothing has been rendered
+        if self.fps_detects == 0:
+            return 0
         return self.total_fps / self.fps_detects
 
     """
@@ -80,4 +312,4 @@ class BotRender:
         ,fontScale=1, color=(0,0,0), thickness=1):
         frame = cv2.putText(frame, text, pos, font
             , fontScale, color, thickness, cv2.LINE_AA)
-        return frame
\ No newline at end of file
+        return frame
@@ -0,0 +1,113 @@
+"""
+This file sizes the region of the view that is captured and parsed
+so quiet scenes cost less and busy ones are still fully covered
+"""
+from environment import *
+from behavior import TargetState, PLAYER_SPEED
+from config import (ROI_MIN_SIZE, ROI_MARGIN, ROI_THREAT_RADIUS
+    , ROI_SPEED_LOOKAHEAD, ROI_DENSE_OBJECTS, ROI_SHRINK_RATE
+    , ROI_FULL_SCAN_INTERVAL)
+
+
+"""
+A region of interest centred on the player that grows and shrinks
+It grows straight away to cover the target, the objects close to the
+player and how far the player could move, and shrinks slowly after.
+Every so often the whole view is scanned so new objects are found
+The region is a bbox (x, y, w, h) in the coordinates of the full view,
+so objects found in it need no remapping
+"""
+class AdaptiveROI:
+    def __init__(self, view_size, min_size=ROI_MIN_SIZE
+        , full_scan_interval=ROI_FULL_SCAN_INTERVAL):
+        self.view_size = view_size
+        self.min_size = (min(min_size[0], view_size[0])
+            , min(min_size[1], view_size[1]))
+        self.full_scan_interval = full_scan_interval
+        #Half the width and height of the region
+        self.half_size = (view_size[0] / 2, view_size[1] / 2)
+        self.centre = Vector2(view_size[0] / 2, view_size[1] / 2)
+        self.frames = 0
+        #Total of the fraction of the view covered each frame
+        self.total_coverage = 0
+
+    """
+    Returns the region to capture and parse next
+    Returns None when the whole view should be used
+    """
+    @property
+    def rect(self):
+        if self.full_scan_interval > 0 and self.frames % self.full_scan_interval == 0:
+            return None
+        x1 = max(int(self.centre.x - self.half_size[0]), 0)
+        y1 = max(int(self.centre.y - self.half_size[1]), 0)
+        x2 = min(int(self.centre.x + self.half_size[0]), self.view_size[0])
+        y2 = min(int(self.centre.y + self.half_size[1]), self.view_size[1])
+        if x2 - x1 >= self.view_size[0] and y2 - y1 >= self.view_size[1]:
+            return None
+        return (x1, y1, x2 - x1, y2 - y1)
+
+    """Returns the average fraction of the view that has been used"""
+    @property
+    def average_coverage(self):
+        if self.frames == 0:
+            return 1
+        return self.total_coverage / self.frames
+
+    """Returns the half size needed to cover a bbox with a margin"""
+    def get_cover(self, bbox):
+        centre = BBoxOps.bbox_centre(bbox)
+        return (abs(centre.x - self.centre.x) + bbox[2] / 2 + ROI_MARGIN
+            , abs(centre.y - self.centre.y) + bbox[3] / 2 + ROI_MARGIN)
+
+    """
+    Sizes the region for the next frame from what the bot
+    is doing now. Called after the bot has made its decision
+    If the controller is given, the region grows while the player moves
+    """
+    def update(self, environment, behaviour, controller=None):
+        rect = self.rect
+        if rect is None:
+            self.total_coverage += 1
+        else:
+            self.total_coverage += (rect[2] * rect[3]
+                / (self.view_size[0] * self.view_size[1]))
+        self.frames += 1
+
+        if not environment.player is None:
+            self.centre = environment.player.centre
+        width = self.min_size[0] / 2
+        height = self.min_size[1] / 2
+
+        #Leave room for how far the player could move
+        if not controller is None and len(controller.pressed_keys) > 0:
+            width += PLAYER_SPEED * ROI_SPEED_LOOKAHEAD
+            height += PLAYER_SPEED * ROI_SPEED_LOOKAHEAD
+
+        objects = environment.objects
+        if len(objects) >= ROI_DENSE_OBJECTS:
+            #Busy scenes get the whole view
+            width = self.view_size[0] / 2
+            height = self.view_size[1] / 2
+        else:
+            for obj in objects:
+                if self.centre.distance_to(obj.centre) <= ROI_THREAT_RADIUS:
+                    cover = self.get_cover(obj.bbox)
+                    width = max(width, cover[0])
+                    height = max(height, cover[1])
+            #Keep the target in view
+            target = behaviour.target_manager.target
+            if (isinstance(behaviour.curr_state, TargetState)
+                and not target is None):
+                cover = self.get_cover(target.bbox)
+                width = max(width, cover[0])
+                height = max(height, cover[1])
+
+        #Grow straight away but shrink slowly
+        old_width, old_height = self.half_size
+        if width < old_width:
+            width = old_width - (old_width - width) * ROI_SHRINK_RATE
+        if height < old_height:
+            height = old_height - (old_height - height) * ROI_SHRINK_RATE
+        self.half_size = (min(width, self.view_size[0] / 2)
+            , min(height, self.view_size[1] / 2))
@@ -0,0 +1,407 @@
+"""
+This file simulates a simple version of Diep.io so the bot
+can be played against it without the real game
+The bot's commands change the game, unlike when replaying a session
+"""
+import math
+import random
+import time
+import cv2
+import numpy as np
+from environment import *
+from controller import ControllerBackend, BotController
+from game_parser import GameParser, ObjectClassifier
+from synthetic import (SyntheticObject, SyntheticFrameGenerator, OBJECT_RADII
+    , BARREL_LENGTH)
+from config import CAPTURE_SIZE, TRACKING_RATE
+#The planner uses the same speed to predict where the player will be
+from behavior import PLAYER_SPEED
+
+
+#Size of the game world in pixels. Shapes bounce off its edges
+WORLD_SIZE = (3000, 3000)
+#How many shapes are in the world
+NUM_SHAPES = 150
+#Fastest a shape drifts in pixels per frame
+SHAPE_DRIFT_SPEED = 0.5
+#How quickly the player speeds up to the direction of the keys pressed
+PLAYER_ACCELERATION = 0.3
+PLAYER_HEALTH = 100
+BULLET_SPEED = 12
+BULLET_RADIUS = 8
+#How many frames a bullet lasts
+BULLET_LIFETIME = 60
+#How many frames the player waits between shots
+RELOAD_FRAMES = 10
+#Health the player loses each frame it touches a shape
+COLLISION_DAMAGE = 1
+#How many bullets it takes to destroy each shape
+SHAPE_HEALTH = {
+    GameObject.SQUARE : 1,
+    GameObject.TRIANGLE : 3,
+    GameObject.PENTAGON : 10
+}
+#Score for destroying each shape
+SHAPE_SCORE = {
+    GameObject.SQUARE : 10,
+    GameObject.TRIANGLE : 25,
+    GameObject.PENTAGON : 130
+}
+#How likely each shape is to be made
+SHAPE_CHANCES = {
+    GameObject.SQUARE : 0.6,
+    GameObject.TRIANGLE : 0.3,
+    GameObject.PENTAGON : 0.1
+}
+#Movement of each key
+KEY_DIRECTIONS = {'w' : (0, -1), 'a' : (-1, 0), 's' : (0, 1), 'd' : (1, 0)}
+
+
+"""
+A simple Diep.io game with a player, drifting shapes and bullets
+Each call to step moves the game on one frame
+Everything is stored in numpy arrays so the game runs much faster
+than the real one
+The view is the part of the world around the player that the bot sees
+"""
+class DiepSimulator:
+    SHAPE_TYPES = list(SHAPE_CHANCES)
+
+    def __init__(self, view_size=CAPTURE_SIZE, num_shapes=NUM_SHAPES
+        , world_size=WORLD_SIZE, seed=0):
+        self.view_size = view_size
+        self.world_size = np.array(world_size, dtype=float)
+        self.rng = np.random.default_rng(seed)
+
+        #Input from the bot. aim is relative to the view
+        self.keys = set()
+        self.aim = (view_size[0] / 2 + 1, view_size[1] / 2)
+        self.shoot_requested = False
+
+        self.player_pos = self.world_size / 2
+        self.player_vel = np.zeros(2)
+        self.player_health = PLAYER_HEALTH
+        self.reload = 0
+
+        #Each shape is a row in these arrays
+        self.shape_types = np.empty(0, dtype=int)
+        self.shape_pos = np.empty((0, 2))
+        self.shape_vel = np.empty((0, 2))
+        self.shape_angle = np.empty(0)
+        self.shape_spin = np.empty(0)
+        self.shape_health = np.empty(0)
+        self.shape_radius = np.empty(0)
+        self.shape_uids = np.empty(0, dtype=int)
+        #Whether each shape touched the player last frame
+        self.shape_touching = np.empty(0, dtype=bool)
+        self.spawn_shapes(num_shapes)
+
+        self.bullet_pos = np.empty((0, 2))
+        self.bullet_vel = np.empty((0, 2))
+        self.bullet_life = np.empty(0, dtype=int)
+
+        self.stats = {
+            'frames' : 0,
+            'collisions' : 0,
+            'damage_taken' : 0,
+            'deaths' : 0,
+            'shots' : 0,
+            'shapes_destroyed' : 0,
+            'score' : 0
+        }
+
+    """Adds shapes at random places away from the player"""
+    def spawn_shapes(self, count):
+        if count == 0:
+            return
+        types = self.rng.choice(len(DiepSimulator.SHAPE_TYPES), count
+            , p=list(SHAPE_CHANCES.values()))
+        radii = np.array([OBJECT_RADII[DiepSimulator.SHAPE_TYPES[t]]
+            for t in types], dtype=float)
+        pos = self.rng.uniform(0, 1, (count, 2)) * self.world_size
+        #Keep new shapes out of the view so they do not appear on the player
+        half_view = np.array(self.view_size) / 2
+        in_view = np.all(np.abs(pos - self.player_pos) < half_view, axis=1)
+        pos[in_view] = (pos[in_view] + half_view * 2) % self.world_size
+        angle = self.rng.uniform(0, 2 * math.pi, count)
+        speed = self.rng.uniform(0, SHAPE_DRIFT_SPEED, count)
+        vel = np.stack([np.cos(angle), np.sin(angle)], axis=1) * speed[:, None]
+
+        self.shape_types = np.concatenate([self.shape_types, types])
+        self.shape_pos = np.concatenate([self.shape_pos, pos])
+        self.shape_vel = np.concatenate([self.shape_vel, vel])
+        self.shape_angle = np.concatenate([self.shape_angle
+            , self.rng.uniform(0, 2 * math.pi, count)])
+        self.shape_spin = np.concatenate([self.shape_spin
+            , self.rng.uniform(-0.02, 0.02, count)])
+        self.shape_health = np.concatenate([self.shape_health
+            , [SHAPE_HEALTH[DiepSimulator.SHAPE_TYPES[t]] for t in types]])
+        self.shape_radius = np.concatenate([self.shape_radius, radii])
+        self.shape_uids = np.concatenate([self.shape_uids
+            , [next(GameObject.ids) for _ in range(count)]])
+        self.shape_touching = np.concatenate([self.shape_touching
+            , np.zeros(count, dtype=bool)])
+
+    """Removes the shapes where keep is False"""
+    def remove_shapes(self, keep):
+        self.shape_types = self.shape_types[keep]
+        self.shape_pos = self.shape_pos[keep]
+        self.shape_vel = self.shape_vel[keep]
+        self.shape_angle = self.shape_angle[keep]
+        self.shape_spin = self.shape_spin[keep]
+        self.shape_health = self.shape_health[keep]
+        self.shape_radius = self.shape_radius[keep]
+        self.shape_uids = self.shape_uids[keep]
+        self.shape_touching = self.shape_touching[keep]
+
+    """Returns the world position of the top left of the view"""
+    @property
+    def view_origin(self):
+        return self.player_pos - np.array(self.view_size) / 2
+
+    """Moves the game on one frame"""
+    def step(self):
+        self.stats['frames'] += 1
+        self.move_player()
+        self.move_shapes()
+        self.shoot()
+        self.move_bullets()
+        self.hit_shapes()
+        self.hit_player()
+
+    """Speeds the player up towards the direction of the keys pressed"""
+    def move_player(self):
+        direction = np.zeros(2)
+        for key in self.keys:
+            direction += KEY_DIRECTIONS[key]
+        length = np.linalg.norm(direction)
+        if length > 0:
+            direction /= length
+        self.player_vel += (direction * PLAYER_SPEED
+            - self.player_vel) * PLAYER_ACCELERATION
+        self.player_pos = np.clip(self.player_pos + self.player_vel
+            , 0, self.world_size)
+
+    """Drifts the shapes, bouncing them off the edges of the world"""
+    def move_shapes(self):
+        self.shape_pos += self.shape_vel
+        self.shape_angle += self.shape_spin
+        radius = self.shape_radius[:, None]
+        self.shape_vel = np.where(self.shape_pos < radius
+            , np.abs(self.shape_vel), self.shape_vel)
+        self.shape_vel = np.where(self.shape_pos > self.world_size - radius
+            , -np.abs(self.shape_vel), self.shape_vel)
+        self.shape_pos = np.clip(self.shape_pos, 0, self.world_size)
+
+    """Fires a bullet towards the aim if asked to and reloaded"""
+    def shoot(self):
+        self.reload = max(self.reload - 1, 0)
+        #The bot has to keep asking to shoot
+        requested = self.shoot_requested
+        self.shoot_requested = False
+        if not requested or self.reload > 0:
+            return
+        direction = self.view_origin + self.aim - self.player_pos
+        length = np.linalg.norm(direction)
+        if length == 0:
+            return
+        direction /= length
+        self.reload = RELOAD_FRAMES
+        self.stats['shots'] += 1
+        start = self.player_pos + direction * OBJECT_RADII[GameObject.ALLY] * BARREL_LENGTH
+        self.bullet_pos = np.concatenate([self.bullet_pos, [start]])
+        self.bullet_vel = np.concatenate([self.bullet_vel
+            , [direction * BULLET_SPEED + self.player_vel]])
+        self.bullet_life = np.concatenate([self.bullet_life, [BULLET_LIFETIME]])
+
+    """Moves the bullets and removes the old ones"""
+    def move_bullets(self):
+        self.bullet_pos += self.bullet_vel
+        self.bullet_life -= 1
+        alive = self.bullet_life > 0
+        self.bullet_pos = self.bullet_pos[alive]
+        self.bullet_vel = self.bullet_vel[alive]
+        self.bullet_life = self.bullet_life[alive]
+
+    """Damages the shapes hit by bullets and replaces destroyed shapes"""
+    def hit_shapes(self):
+        if len(self.bullet_pos) == 0 or len(self.shape_pos) == 0:
+            return
+        #Distance from every bullet to every shape
+        offsets = self.bullet_pos[:, None, :] - self.shape_pos[None, :, :]
+        dist_sq = np.einsum('ijk,ijk->ij', offsets, offsets)
+        hits = dist_sq < (self.shape_radius[None, :] + BULLET_RADIUS) ** 2
+        #Each bullet only hits one shape
+        hit_bullets = hits.any(axis=1)
+        hit_shapes = np.argmax(hits, axis=1)[hit_bullets]
+        np.subtract.at(self.shape_health, hit_shapes, 1)
+
+        keep = ~hit_bullets
+        self.bullet_pos = self.bullet_pos[keep]
+        self.bullet_vel = self.bullet_vel[keep]
+        self.bullet_life = self.bullet_life[keep]
+
+        destroyed = self.shape_health <= 0
+        num_destroyed = int(destroyed.sum())
+        if num_destroyed == 0:
+            return
+        for t in self.shape_types[destroyed]:
+            self.stats['score'] += SHAPE_SCORE[DiepSimulator.SHAPE_TYPES[t]]
+        self.stats['shapes_destroyed'] += num_destroyed
+        self.remove_shapes(~destroyed)
+        self.spawn_shapes(num_destroyed)
+
+    """Damages the player for every shape it touches and pushes them apart"""
+    def hit_player(self):
+        if len(self.shape_pos) == 0:
+            return
+        offsets = self.shape_pos - self.player_pos
+        dist = np.linalg.norm(offsets, axis=1)
+        overlap = self.shape_radius + OBJECT_RADII[GameObject.ALLY] - dist
+        touching = overlap > 0
+        #Only count a collision when the shape first touches the player
+        self.stats['collisions'] += int((touching & ~self.shape_touching).sum())
+        self.shape_touching = touching
+        num_touching = int(touching.sum())
+        if num_touching == 0:
+            return
+
+        damage = num_touching * COLLISION_DAMAGE
+        self.stats['damage_taken'] += damage
+        self.player_health -= damage
+        if self.player_health <= 0:
+            #Start again in the middle of the world
+            self.stats['deaths'] += 1
+            self.player_health = PLAYER_HEALTH
+            self.player_pos = self.world_size / 2
+            self.player_vel = np.zeros(2)
+            return
+
+        #Push the shapes out of the player
+        directions = offsets[touching] / np.maximum(dist[touching], 1e-6)[:, None]
+        self.shape_pos[touching] += directions * overlap[touching][:, None]
+        self.shape_vel[touching] = directions * SHAPE_DRIFT_SPEED
+
+    """Returns whether each shape can be seen in the view"""
+    def get_visible(self):
+        view_pos = self.shape_pos - self.view_origin
+        radius = self.shape_radius[:, None]
+        return np.all((view_pos + radius > 0)
+            & (view_pos - radius < self.view_size), axis=1)
+
+    """
+    Returns the shapes in the view as an Environment
+    so the bot can be played without perception
+    If an environment is given it is filled in instead of making a new one
+    """
+    def get_environment(self, environment=None):
+        if environment is None:
+            environment = Environment(self.view_size)
+        visible = self.get_visible()
+        view_pos = self.shape_pos[visible] - self.view_origin
+        radii = self.shape_radius[visible]
+        #Shapes move relative to the view as the player moves
+        velocities = self.shape_vel[visible] - self.player_vel
+        objects = []
+        for pos, radius, t, uid, vel in zip(view_pos, radii
+            , self.shape_types[visible], self.shape_uids[visible], velocities):
+            obj = GameObject((pos[0] - radius, pos[1] - radius
+                , radius * 2, radius * 2), DiepSimulator.SHAPE_TYPES[t])
+            obj.uid = int(uid)
+            obj.velocity = (vel[0], vel[1])
+            obj.is_tracked = True
+            objects.append(obj)
+        environment.objects = objects
+        environment.player = GameObject.make_player(self.get_player_bbox())
+        return environment
+
+    """Returns the bbox of the player's body in the view"""
+    def get_player_bbox(self):
+        radius = OBJECT_RADII[GameObject.ALLY]
+        return (self.view_size[0] / 2 - radius, self.view_size[1] / 2 - radius
+            , radius * 2, radius * 2)
+
+    """Draws the view in the colours of the game"""
+    def render(self):
+        origin = self.view_origin
+        frame = SyntheticFrameGenerator.make_background(self.view_size, origin)
+        visible = self.get_visible()
+        for pos, t, angle in zip(self.shape_pos[visible] - origin
+            , self.shape_types[visible], self.shape_angle[visible]):
+            SyntheticFrameGenerator.draw_object(frame, SyntheticObject(
+                DiepSimulator.SHAPE_TYPES[t], pos, (0, 0), angle, 0))
+        for pos in self.bullet_pos - origin:
+            cv2.circle(frame, (int(pos[0]), int(pos[1])), BULLET_RADIUS
+                , ObjectClassifier.OBJECT_COLOURS[GameObject.ALLY], cv2.FILLED)
+        aim = np.array(self.aim) - np.array(self.view_size) / 2
+        player = SyntheticObject(GameObject.ALLY, np.array(self.view_size) / 2
+            , (0, 0), math.atan2(aim[1], aim[0]), 0)
+        SyntheticFrameGenerator.draw_object(frame, player)
+        return frame
+
+
+"""Sends the bot's inputs to a DiepSimulator"""
+class SimulatorBackend(ControllerBackend):
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    """Overrides"""
+    def press_key(self, key):
+        self.simulator.keys.add(key)
+
+    """Overrides"""
+    def release_key(self, key):
+        self.simulator.keys.discard(key)
+
+    """Overrides"""
+    def move_mouse(self, pos):
+        self.simulator.aim = pos
+
+    """Overrides"""
+    def get_mouse_pos(self):
+        return self.simulator.aim
+
+    """
+    Overrides
+    A bullet is fired for each shoot command so holding
+    the mouse button does not depend on real time passing
+    """
+    def on_command(self, kind, value, issued_time):
+        if kind == 'shoot':
+            self.simulator.shoot_requested = True
+
+
+"""
+Plays the behaviour in a simulated game for a number of frames
+If perceive is true, the rendered frames go through the game parser,
+otherwise the environment is taken straight from the simulator
+Returns the simulator stats with the CPU time of each decision
+"""
+def run_episode(behaviour, frames=1000, perceive=False, seed=0
+    , view_size=CAPTURE_SIZE, num_shapes=NUM_SHAPES):
+    #The behaviours use the random module
+    random.seed(seed)
+    simulator = DiepSimulator(view_size, num_shapes, seed=seed)
+    controller = BotController(Vector2(0, 0), SimulatorBackend(simulator)
+        , threaded=False)
+    environment = Environment(view_size)
+    game_parser = None
+    if perceive:
+        game_parser = GameParser(TRACKING_RATE)
+        game_parser.init(simulator.render(), simulator.get_player_bbox())
+
+    decision_time = 0
+    for _ in range(frames):
+        if perceive:
+            game_parser.update(simulator.render(), environment)
+        else:
+            simulator.get_environment(environment)
+        start = time.process_time()
+        behaviour.action(environment, controller)
+        decision_time += time.process_time() - start
+        simulator.step()
+    controller.stop()
+
+    stats = dict(simulator.stats)
+    stats['cpu_per_decision'] = decision_time / frames
+    return stats
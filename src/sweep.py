@@ -0,0 +1,212 @@
+"""
+Searches for the best behaviour constants by playing the bot
+in the simulator with many different BehaviorConfigs
+Run python3 sweep.py from the src folder. Use --help to see the options
+"""
+import argparse
+import csv
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from behavior import (Behavior, BehaviorConfig, NAVIGATION_ENGINES
+    , NAVIGATION_ENGINE)
+from simulator import run_episode
+
+
+#The values tried for each constant
+#A grid search tries every combination, a random search picks values
+#between the smallest and largest
+SWEEP_SPACE = {
+    'max_see_ahead' : [40, 80, 120],
+    'avoidance_factor' : [0.01, 0.02, 0.04],
+    'max_avoidance_force' : [650, 1300, 2600],
+    'direction_force' : [100, 200, 400],
+    'sight_offset' : [35, 70, 105],
+    'dir_change_chance' : [0.005, 0.01, 0.02]
+}
+#How much a collision and a millisecond of decision time
+#take away from the score. Each destroyed shape adds 1
+COLLISION_PENALTY = 5
+CPU_PENALTY = 1
+#Where the results are written
+SWEEP_RESULTS_PATH = 'sweep_results.csv'
+#Columns of the results table after the constants
+RESULT_COLUMNS = ['score', 'collisions', 'shapes_destroyed', 'cpu_ms']
+#Settings the episodes were played with, written after the results
+#A sweep only carries on from results played with the same settings
+SETTING_COLUMNS = ['navigation', 'episodes', 'frames', 'perceive']
+
+
+"""Returns every combination of the values in the space"""
+def grid_search(space):
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+"""
+Returns random configs with values between the smallest
+and largest value of each constant in the space
+The same seed always gives the same configs so a search can be resumed
+"""
+def random_search(space, samples, seed=0):
+    rng = random.Random(seed)
+    for _ in range(samples):
+        config = {}
+        for name, values in space.items():
+            value = rng.uniform(min(values), max(values))
+            #Keep whole numbers whole
+            if all(isinstance(v, int) for v in values):
+                value = round(value)
+            config[name] = value
+        yield config
+
+"""Returns the key identifying a config in the results"""
+def get_key(config):
+    return tuple(round(float(config[name]), 6) for name in BehaviorConfig.NAMES)
+
+"""Returns the score of the average episode stats. Higher is better"""
+def get_score(stats):
+    return (stats['shapes_destroyed'] - COLLISION_PENALTY * stats['collisions']
+        - CPU_PENALTY * stats['cpu_ms'])
+
+"""
+Plays episodes in the simulator with the config
+and returns the average stats with the score
+Runs in a worker process
+"""
+def evaluate(config, navigation, episodes, frames, perceive):
+    totals = {'collisions' : 0, 'shapes_destroyed' : 0, 'cpu_ms' : 0}
+    for seed in range(episodes):
+        behaviour = Behavior(navigation, BehaviorConfig(**config))
+        stats = run_episode(behaviour, frames, perceive, seed)
+        totals['collisions'] += stats['collisions']
+        totals['shapes_destroyed'] += stats['shapes_destroyed']
+        totals['cpu_ms'] += stats['cpu_per_decision'] * 1000
+    result = dict(config)
+    for name, total in totals.items():
+        result[name] = total / episodes
+    result['score'] = get_score(result)
+    return result
+
+"""
+Reads the results of an earlier sweep. Returns an empty list if none
+The settings are left as text and are None if the file has none
+"""
+def read_results(path):
+    if not os.path.exists(path):
+        return []
+    results = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            result = {name : float(row[name])
+                for name in BehaviorConfig.NAMES + RESULT_COLUMNS}
+            for name in SETTING_COLUMNS:
+                result[name] = row.get(name)
+            results.append(result)
+    return results
+
+"""
+Raises a ValueError if any of the results were
+played with different settings
+"""
+def check_settings(results, settings, path):
+    for result in results:
+        for name, value in settings.items():
+            if result[name] != str(value):
+                raise ValueError(f"{path} has results played with {name} "
+                    + f"{result[name]} not {value}. Their scores cannot be "
+                    + "compared, so use another results file")
+
+"""Writes the results ranked from best to worst"""
+def write_results(path, results):
+    results = sorted(results, key=lambda r: r['score'], reverse=True)
+    #Write to a temporary file first so results are never lost
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', newline='') as f:
+        columns = BehaviorConfig.NAMES + RESULT_COLUMNS + SETTING_COLUMNS
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({name : result[name] for name in columns})
+    os.replace(temp_path, path)
+    return results
+
+"""Prints the best results as a table"""
+def print_results(results, top=10):
+    columns = BehaviorConfig.NAMES + RESULT_COLUMNS
+    print(' '.join(f"{name[:12]:>12}" for name in columns))
+    for result in results[:top]:
+        print(' '.join(f"{result[name]:>12.4g}" for name in columns))
+
+"""
+Evaluates every config over a pool of processes
+Configs already in the results file are skipped so an
+interrupted sweep carries on where it stopped.
+The results file must have been played with the same settings
+The results file is rewritten in ranked order as each config finishes
+"""
+def sweep(configs, navigation, episodes, frames, perceive=False
+    , workers=None, path=SWEEP_RESULTS_PATH):
+    if navigation is None:
+        navigation = NAVIGATION_ENGINE
+    settings = {'navigation' : navigation, 'episodes' : episodes
+        , 'frames' : frames, 'perceive' : perceive}
+    results = read_results(path)
+    check_settings(results, settings, path)
+    done = set(get_key(result) for result in results)
+    configs = [config for config in configs if not get_key(config) in done]
+    print(f"{len(done)} configs already done, {len(configs)} to go")
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(evaluate, config, navigation, episodes
+            , frames, perceive) for config in configs]
+        try:
+            for i, future in enumerate(as_completed(futures)):
+                result = future.result()
+                result.update(settings)
+                results.append(result)
+                results = write_results(path, results)
+                print(f"{i + 1}/{len(configs)} done. "
+                    + f"Best score {results[0]['score']:.2f}")
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            print("Sweep stopped. Run it again to carry on")
+            raise
+    results = write_results(path, results)
+    print_results(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Searches for the best behaviour constants")
+    parser.add_argument('--search', choices=['grid', 'random'], default='random')
+    parser.add_argument('--samples', type=int, default=50
+        , help="How many configs a random search tries")
+    parser.add_argument('--seed', type=int, default=0
+        , help="Seed of the random search")
+    parser.add_argument('--episodes', type=int, default=3
+        , help="How many episodes each config is played for")
+    parser.add_argument('--frames', type=int, default=1000
+        , help="How many frames each episode lasts")
+    parser.add_argument('--navigation', choices=list(NAVIGATION_ENGINES)
+        , default=None, help="The navigation engine used")
+    parser.add_argument('--perceive', action='store_true'
+        , help="Pass the rendered frames through the game parser")
+    parser.add_argument('--workers', type=int, default=None
+        , help="How many processes to use. Defaults to the number of CPUs")
+    parser.add_argument('--results', default=SWEEP_RESULTS_PATH
+        , help="Where the results table is written")
+    args = parser.parse_args()
+
+    if args.search == 'grid':
+        configs = grid_search(SWEEP_SPACE)
+    else:
+        configs = random_search(SWEEP_SPACE, args.samples, args.seed)
+    try:
+        sweep(list(configs), args.navigation, args.episodes, args.frames
+            , args.perceive, args.workers, args.results)
+    except ValueError as e:
+        parser.error(str(e))
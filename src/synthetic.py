@@ -0,0 +1,256 @@
+"""
+This file makes Diep style frames where the position and type
+of every object is known, so the parser can be checked against them
+"""
+import math
+import random
+import cv2
+import numpy as np
+from environment import *
+from game_parser import ObjectClassifier, BACKGROUND_COLOURS
+
+
+#Spacing of the background grid lines in pixels
+GRID_SPACING = 25
+#Outlines are drawn this much darker than the fill
+OUTLINE_SHADE = 0.75
+OUTLINE_THICKNESS = 3
+#Colour of the tank barrels
+BARREL_COLOUR = (153,153,153)
+#Radius in pixels of each type of object
+OBJECT_RADII = {
+    GameObject.SQUARE : 22,
+    GameObject.TRIANGLE : 26,
+    GameObject.PENTAGON : 32,
+    GameObject.ENEMY : 25,
+    GameObject.ALLY : 25
+}
+#How many vertices each polygon has. Tanks are circles
+POLYGON_VERTICES = {
+    GameObject.SQUARE : 4,
+    GameObject.TRIANGLE : 3,
+    GameObject.PENTAGON : 5
+}
+#How far a tank's barrel reaches out compared to its radius
+BARREL_LENGTH = 1.8
+
+
+"""Returns how far an object of the type reaches from its centre"""
+def get_extent(object_type):
+    if object_type in POLYGON_VERTICES:
+        return OBJECT_RADII[object_type]
+    return OBJECT_RADII[object_type] * BARREL_LENGTH
+
+
+"""An object in a synthetic frame"""
+class SyntheticObject:
+    def __init__(self, object_type, position, velocity, angle, spin):
+        self.type = object_type
+        self.position = position
+        #Pixels per frame
+        self.velocity = velocity
+        #Rotation in radians and radians per frame
+        self.angle = angle
+        self.spin = spin
+
+    @property
+    def radius(self):
+        return OBJECT_RADII[self.type]
+
+    """Returns the vertices of the object's polygon"""
+    def get_vertices(self):
+        sides = POLYGON_VERTICES[self.type]
+        vertices = []
+        for i in range(sides):
+            angle = self.angle + 2 * math.pi * i / sides
+            vertices.append((self.position[0] + self.radius * math.cos(angle)
+                , self.position[1] + self.radius * math.sin(angle)))
+        return np.array(vertices)
+
+    """Returns the corners of a tank's barrel"""
+    def get_barrel(self):
+        direction = np.array([math.cos(self.angle), math.sin(self.angle)])
+        side = np.array([-direction[1], direction[0]]) * self.radius * 0.4
+        start = np.array(self.position)
+        end = start + direction * self.radius * BARREL_LENGTH
+        return np.array([start + side, end + side, end - side, start - side])
+
+    """Returns the bbox of the object as drawn"""
+    def get_bbox(self):
+        if self.type in POLYGON_VERTICES:
+            points = self.get_vertices()
+        else:
+            points = np.concatenate([self.get_barrel()
+                , np.array(self.position) + [(-self.radius, -self.radius)
+                , (self.radius, self.radius)]])
+        x, y, w, h = cv2.boundingRect(np.round(points).astype(np.int32))
+        #Include the outline
+        half = OUTLINE_THICKNESS // 2
+        return (x - half, y - half, w + half * 2, h + half * 2)
+
+    """Returns the object as a GameObject"""
+    def to_game_object(self):
+        return GameObject(self.get_bbox(), self.type)
+
+
+"""
+Makes frames of moving objects on the grid background
+with the player tank in the centre
+density is the number of objects per 100x100 pixels
+speed is the most pixels an object moves each frame
+"""
+class SyntheticFrameGenerator:
+    OBJECT_TYPES = [GameObject.SQUARE, GameObject.TRIANGLE, GameObject.PENTAGON
+        , GameObject.ENEMY, GameObject.ALLY]
+
+    def __init__(self, size=(800,400), density=0.3, speed=2, seed=0
+        , object_types=OBJECT_TYPES):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.speed = speed
+        self.background = SyntheticFrameGenerator.make_background(size)
+        self.player = SyntheticObject(GameObject.ALLY
+            , (size[0] / 2, size[1] / 2), (0, 0), 0, 0)
+        num_objects = int(density * size[0] * size[1] / 10000)
+        self.objects = []
+        for _ in range(num_objects):
+            obj = self.make_object(self.rng.choice(object_types))
+            if not obj is None:
+                self.objects.append(obj)
+
+    """
+    Makes the grid background
+    offset is where the top left of the frame is in the game world
+    """
+    @staticmethod
+    def make_background(size, offset=(0, 0)):
+        background = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        background[:] = BACKGROUND_COLOURS[0]
+        background[:, int(-offset[0]) % GRID_SPACING::GRID_SPACING] = BACKGROUND_COLOURS[1]
+        background[int(-offset[1]) % GRID_SPACING::GRID_SPACING, :] = BACKGROUND_COLOURS[1]
+        return background
+
+    """
+    Makes an object that does not overlap any other object
+    Returns None if there is no space for it
+    """
+    def make_object(self, object_type, attempts=50):
+        extent = get_extent(object_type)
+        for _ in range(attempts):
+            position = (self.rng.uniform(extent, self.size[0] - extent)
+                , self.rng.uniform(extent, self.size[1] - extent))
+            if self.is_free(position, extent):
+                velocity = (self.rng.uniform(-self.speed, self.speed)
+                    , self.rng.uniform(-self.speed, self.speed))
+                return SyntheticObject(object_type, position, velocity
+                    , self.rng.uniform(0, 2 * math.pi)
+                    , self.rng.uniform(-0.02, 0.02))
+        return None
+
+    """Returns whether a circle does not overlap any object"""
+    def is_free(self, position, extent):
+        #Leave a gap so the outlines do not touch
+        gap = OUTLINE_THICKNESS * 2
+        for obj in self.objects + [self.player]:
+            dist = math.hypot(position[0] - obj.position[0]
+                , position[1] - obj.position[1])
+            if dist < extent + get_extent(obj.type) + gap:
+                return False
+        return True
+
+    """Moves every object one frame, bouncing off the edges"""
+    def step(self):
+        for obj in self.objects:
+            extent = get_extent(obj.type)
+            x = obj.position[0] + obj.velocity[0]
+            y = obj.position[1] + obj.velocity[1]
+            vx, vy = obj.velocity
+            if x < extent or x > self.size[0] - extent:
+                vx = -vx
+                x = obj.position[0] + vx
+            if y < extent or y > self.size[1] - extent:
+                vy = -vy
+                y = obj.position[1] + vy
+            obj.position = (x, y)
+            obj.velocity = (vx, vy)
+            obj.angle += obj.spin
+
+    """Draws a single object onto the frame"""
+    @staticmethod
+    def draw_object(frame, obj):
+        colour = ObjectClassifier.OBJECT_COLOURS[obj.type]
+        outline = tuple(int(c * OUTLINE_SHADE) for c in colour)
+        if obj.type in POLYGON_VERTICES:
+            points = np.round(obj.get_vertices()).astype(np.int32)
+            cv2.fillPoly(frame, [points], colour)
+            cv2.polylines(frame, [points], True, outline, OUTLINE_THICKNESS)
+            return
+        #Tanks are a circle with a barrel underneath
+        barrel = np.round(obj.get_barrel()).astype(np.int32)
+        cv2.fillPoly(frame, [barrel], BARREL_COLOUR)
+        cv2.polylines(frame, [barrel], True
+            , tuple(int(c * OUTLINE_SHADE) for c in BARREL_COLOUR)
+            , OUTLINE_THICKNESS)
+        centre = (int(obj.position[0]), int(obj.position[1]))
+        cv2.circle(frame, centre, obj.radius, colour, cv2.FILLED)
+        cv2.circle(frame, centre, obj.radius, outline, OUTLINE_THICKNESS)
+
+    """Draws every object onto a new frame"""
+    def render(self):
+        frame = self.background.copy()
+        for obj in self.objects + [self.player]:
+            SyntheticFrameGenerator.draw_object(frame, obj)
+        return frame
+
+    """
+    Moves the objects and draws the next frame
+    Returns (frame, ground truth game objects, player bbox)
+    The player is not included in the ground truth
+    """
+    def next_frame(self):
+        self.step()
+        truth = [obj.to_game_object() for obj in self.objects]
+        return (self.render(), truth, self.player.get_bbox())
+
+
+"""
+Matches detected objects to the ground truth by how much their bboxes overlap
+Returns a dictionary mapping object type to
+(true positives, false positives, false negatives)
+A detection is only correct if it has the type of the object it matches
+"""
+def match_detections(detected, truth, min_iou=0.5):
+    counts = {}
+    def add(object_type, index):
+        entry = counts.setdefault(object_type, [0, 0, 0])
+        entry[index] += 1
+
+    unmatched = list(truth)
+    for obj in detected:
+        best = None
+        best_iou = min_iou
+        for true_obj in unmatched:
+            iou = get_iou(obj.bbox, true_obj.bbox)
+            if iou >= best_iou:
+                best = true_obj
+                best_iou = iou
+        if not best is None and best.type == obj.type:
+            unmatched.remove(best)
+            add(obj.type, 0)
+        else:
+            add(obj.type, 1)
+    for true_obj in unmatched:
+        add(true_obj.type, 2)
+    return {t : tuple(c) for t, c in counts.items()}
+
+"""Returns the intersection over union of two bboxes"""
+def get_iou(bbox1, bbox2):
+    x1 = max(bbox1[0], bbox2[0])
+    y1 = max(bbox1[1], bbox2[1])
+    x2 = min(bbox1[0] + bbox1[2], bbox2[0] + bbox2[2])
+    y2 = min(bbox1[1] + bbox1[3], bbox2[1] + bbox2[3])
+    intersection = max(x2 - x1, 0) * max(y2 - y1, 0)
+    union = bbox1[2] * bbox1[3] + bbox2[2] * bbox2[3] - intersection
+    if union <= 0:
+        return 0
+    return intersection / union
@@ -0,0 +1,148 @@
+"""
+Finds the perception settings that give the best detection
+for a target frame rate on this machine
+Run python3 tuner.py from the src folder. Use --help to see the options
+"""
+import argparse
+import itertools
+import json
+import time
+from game_parser import GameParser, DetectionAlgorithm
+from environment import Environment
+from synthetic import SyntheticFrameGenerator, match_detections
+from config import PERCEPTION_PROFILE_PATH
+
+
+#The values tried for each setting
+TUNER_SPACE = {
+    'capture_size' : [(640,320), (800,400), (1024,512)],
+    'min_object_area' : [250, 500, 1000],
+    'tracking_rate' : [5, 15, 30],
+    'canny_thresholds' : [(50,150), (100,200), (150,250)]
+}
+#How many objects are in each 100x100 pixels of the synthetic sessions
+TUNER_DENSITY = 0.3
+#How far objects move each frame in the synthetic sessions
+TUNER_SPEED = 3
+
+
+"""Returns every combination of the settings in the space"""
+def get_settings(space):
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+"""
+Makes a synthetic session for a capture size
+Returns a list of (frame, ground truth, player bbox)
+The same seed gives the same objects so each size is compared fairly
+"""
+def make_session(capture_size, frames, seed=0):
+    generator = SyntheticFrameGenerator(capture_size, TUNER_DENSITY
+        , TUNER_SPEED, seed)
+    return [generator.next_frame() for _ in range(frames)]
+
+"""
+Parses a session with the settings
+Returns the settings with the fps of the parser
+and the recall of objects against the ground truth
+"""
+def evaluate(settings, session):
+    detect_alg = DetectionAlgorithm(settings['min_object_area']
+        , settings['canny_thresholds'])
+    game_parser = GameParser(settings['tracking_rate'], detect_alg)
+    environment = Environment(settings['capture_size'])
+    first_frame, _, player_bbox = session[0]
+    game_parser.init(first_frame, player_bbox)
+
+    found = 0
+    total = 0
+    parse_time = 0
+    for frame, truth, _ in session:
+        start = time.perf_counter()
+        game_parser.update(frame, environment)
+        parse_time += time.perf_counter() - start
+        for tp, fp, fn in match_detections(environment.objects, truth).values():
+            found += tp
+            total += tp + fn
+    result = dict(settings)
+    result['fps'] = len(session) / parse_time
+    result['recall'] = found / total if total > 0 else 0
+    return result
+
+"""
+Returns the results no other result beats on both fps and recall
+sorted from fastest to slowest
+"""
+def get_pareto_front(results):
+    front = []
+    for result in sorted(results, key=lambda r: (-r['fps'], -r['recall'])):
+        if len(front) == 0 or result['recall'] > front[-1]['recall']:
+            front.append(result)
+    return front
+
+"""
+Returns the result with the best recall that reaches the target fps
+If none reach it, the fastest is returned
+"""
+def recommend(front, target_fps):
+    fast_enough = [r for r in front if r['fps'] >= target_fps]
+    if len(fast_enough) == 0:
+        return front[0]
+    return max(fast_enough, key=lambda r: r['recall'])
+
+"""Prints results as a table"""
+def print_results(results):
+    print(f"{'capture':>10} {'area':>6} {'rate':>5} {'canny':>10} "
+        + f"{'fps':>8} {'recall':>7}")
+    for r in results:
+        size = f"{r['capture_size'][0]}x{r['capture_size'][1]}"
+        canny = f"{r['canny_thresholds'][0]},{r['canny_thresholds'][1]}"
+        print(f"{size:>10} {r['min_object_area']:>6} {r['tracking_rate']:>5} "
+            + f"{canny:>10} {r['fps']:>8.1f} {r['recall']:>7.2f}")
+
+"""
+Tries every combination of settings, prints the Pareto front
+and writes the settings recommended for the target fps as a profile
+Returns the recommended result
+"""
+def tune(target_fps, frames=100, space=TUNER_SPACE, path=PERCEPTION_PROFILE_PATH):
+    sessions = {size : make_session(size, frames)
+        for size in space['capture_size']}
+    results = []
+    for settings in get_settings(space):
+        results.append(evaluate(settings, sessions[settings['capture_size']]))
+
+    front = get_pareto_front(results)
+    print("Pareto front of fps and recall:")
+    print_results(front)
+    best = recommend(front, target_fps)
+    if best['fps'] < target_fps:
+        print(f"No settings reach {target_fps} fps. Using the fastest")
+
+    profile = {name : best[name] for name in space}
+    profile['target_fps'] = target_fps
+    profile['fps'] = best['fps']
+    profile['recall'] = best['recall']
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=4)
+    print(f"Recommended settings for {target_fps} fps, written to {path}:")
+    print(f"CAPTURE_SIZE = {tuple(best['capture_size'])}")
+    print(f"MIN_OBJECT_AREA = {best['min_object_area']}")
+    print(f"TRACKING_RATE = {best['tracking_rate']}")
+    print(f"CANNY_THRESHOLDS = {tuple(best['canny_thresholds'])}")
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Finds the best perception settings for a frame rate")
+    parser.add_argument('--target-fps', type=float, default=30
+        , help="The frame rate the parser should reach")
+    parser.add_argument('--frames', type=int, default=100
+        , help="How many frames each setting is tried on")
+    parser.add_argument('--profile', default=PERCEPTION_PROFILE_PATH
+        , help="Where the recommended settings are written. "
+        + "config.py only loads them from the default path")
+    args = parser.parse_args()
+    tune(args.target_fps, args.frames, path=args.profile)